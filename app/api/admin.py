@@ -1,49 +1,71 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.orm import Session, selectinload
 from typing import Optional
-from app.utils.database import get_db
+from app.utils.database import get_db, get_read_db
 from app.models.user import User
-from app.models.group import Group as GroupModel, UserGroup, Permission, GroupPermission
+from app.models.group import Group as GroupModel, UserGroup, Permission, GroupPermission, TablePermission
 from app.utils.auth import check_admin_role, check_owner_role, can_edit_user, can_change_role
 from app.schemas.user import User as UserSchema, UserUpdate, UserCreate, Group, GroupBase, Permission as PermissionSchema
 from app.utils.jwt import get_password_hash
+from app.utils.query_inspector import query_budget
+from app.utils.profiler import profile_store
+from app.utils.serialization import dumps, json_response
+from app.utils.singleflight import single_flight
+from app.utils.fieldsets import fieldset_params
+from app.utils.acl import invalidate_acl
+from app.crud.user import (
+    get_users_payload, invalidate_principals, find_user_collisions, get_user_access, get_user_by_id, get_groups_by_names
+)
 
 # Create router
 router = APIRouter()
 
 # Get all users - admin only
-@router.get("/admin/users", response_model=list[UserSchema])
+@router.get("/admin/users", response_model=list[UserSchema], dependencies=[Depends(query_budget(5))])
+@single_flight()
 def get_all_users(
-    db: Session = Depends(get_db),
+    fieldset: Optional[dict] = Depends(fieldset_params(UserSchema)),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(check_admin_role)
 ):
-    """Get all users in the system (admin only)"""
-    return db.query(User).all()
+    """Get all users in the system (admin only); ?fields= / ?exclude= trim the columns and relationships loaded"""
+    # Build plain dicts from column queries and encode them directly; same JSON as the response model
+    return json_response(dumps(get_users_payload(db, fieldset)))
 
 # Create user - admin only
-@router.post("/admin/users/add", response_model=UserSchema)
+@router.post("/admin/users/add", response_model=UserSchema, dependencies=[Depends(query_budget(6))])
 def add_user(
     user: UserCreate,
     db: Session = Depends(get_db),
     current_user: User = Depends(check_admin_role)
 ):
     """Create a new user (admin only)"""
-    # Check if username already exists
-    db_user = db.query(User).filter(User.username == user.username).first()
-    if db_user:
+    # Check username and email together with one lean query
+    username_taken, email_taken = find_user_collisions(db, username=user.username, email=user.email)
+    if username_taken:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
-    
-    # Check if email already exists
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if db_user:
+    if email_taken:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
+    # Get all requested groups in one query (invalid groups are skipped)
+    requested_groups = get_groups_by_names(db, user.groups)
+    
+    # Check if current user can assign requested groups, before creating anything
+    # Owner can assign any group; admin can only assign user or admin groups, not owner
+    current_user_groups = [g.name for g in current_user.groups]
+    if "owner" not in current_user_groups and any(group.name == "owner" for group in requested_groups):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only owner can assign owner group"
+        )
+    
     # Create user object without role
     db_user = User(
         username=user.username,
@@ -54,41 +76,19 @@ def add_user(
     
     # Add user to database first to get an ID
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    
-    # Check if current user can assign requested groups
-    current_user_groups = [g.name for g in current_user.groups]
-    
-    # Get all requested groups from database
-    for group_name in user.groups:
-        requested_group = db.query(GroupModel).filter(GroupModel.name == group_name).first()
-        if not requested_group:
-            # Skip invalid groups
-            continue
-        
-        # Check if current user can assign this group
-        # Owner can assign any group
-        if "owner" not in current_user_groups:
-            # Admin can only assign user or admin groups, not owner
-            if requested_group.name == "owner":
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Only owner can assign owner group"
-                )
-        
-        # Assign the group to the user
-        user_group = UserGroup(user_id=db_user.id, group_id=requested_group.id)
-        db.add(user_group)
+    db.flush()
+    user_id = db_user.id
     
+    # Assign the groups to the user
+    db.add_all(UserGroup(user_id=user_id, group_id=group.id) for group in requested_groups)
     db.commit()
+    invalidate_acl(user_ids=[user_id])
     
-    # Refresh user to include groups
-    db.refresh(db_user)
-    return db_user
+    # Load user with groups and permissions in one query (db_user's attributes expired on commit)
+    return get_user_by_id(db, user_id)
 
 # Update user - apply new permission rules
-@router.post("/admin/users/update/{user_id}", response_model=UserSchema)
+@router.post("/admin/users/update/{user_id}", response_model=UserSchema, dependencies=[Depends(query_budget(6))])
 def update_user(
     user_id: int,
     user_update: UserUpdate,
@@ -100,8 +100,8 @@ def update_user(
     2. Admin can only edit regular users, not other admins or owners
     3. Admin can promote regular users to admin, but can't demote or change other roles
     """
-    # Get the user to update
-    user_to_update = db.query(User).filter(User.id == user_id).first()
+    # Get the user's id, username and group levels; enough for the permission check
+    user_to_update = get_user_access(db, user_id)
     if not user_to_update:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -126,46 +126,37 @@ def update_user(
         # Hash the password before updating
         update_data["hashed_password"] = get_password_hash(update_data.pop("password"))
     
-    # Update user fields
-    for field, value in update_data.items():
-        if hasattr(user_to_update, field):
-            setattr(user_to_update, field, value)
-    
-    # Update user groups if requested
+    # Check if current user can assign requested groups, before writing anything
     if groups:
-        # Check if current user can assign requested groups
+        requested_groups = get_groups_by_names(db, groups)
         current_user_groups = [g.name for g in current_user.groups]
-        
-        # Remove existing groups
+        if "owner" not in current_user_groups and any(group.name == "owner" for group in requested_groups):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Only owner can assign owner group"
+            )
+    
+    # Update user fields with one UPDATE statement
+    columns = {field: value for field, value in update_data.items() if hasattr(User, field)}
+    if columns:
+        db.query(User).filter(User.id == user_id).update(columns, synchronize_session=False)
+    
+    # Replace user groups if requested
+    if groups:
         db.query(UserGroup).filter(UserGroup.user_id == user_id).delete()
-        
-        # Assign new groups
-        for group_name in groups:
-            requested_group = db.query(GroupModel).filter(GroupModel.name == group_name).first()
-            if not requested_group:
-                # Skip invalid groups
-                continue
-            
-            # Check if current user can assign this group
-            # Owner can assign any group
-            if "owner" not in current_user_groups:
-                # Admin can only assign user or admin groups, not owner
-                if requested_group.name == "owner":
-                    raise HTTPException(
-                        status_code=status.HTTP_403_FORBIDDEN,
-                        detail="Only owner can assign owner group"
-                    )
-            
-            # Assign the group to the user
-            user_group = UserGroup(user_id=user_id, group_id=requested_group.id)
-            db.add(user_group)
+        db.add_all(UserGroup(user_id=user_id, group_id=group.id) for group in requested_groups)
     
     db.commit()
-    db.refresh(user_to_update)
-    return user_to_update
+    
+    # Load user with groups and permissions in one query
+    db_user = get_user_by_id(db, user_id)
+    invalidate_principals(user_to_update.username, db_user.username)
+    if groups:
+        invalidate_acl(user_ids=[user_id])
+    return db_user
 
 # Delete user - apply new permission rules
-@router.post("/admin/users/delete/{user_id}", status_code=status.HTTP_200_OK)
+@router.post("/admin/users/delete/{user_id}", status_code=status.HTTP_200_OK, dependencies=[Depends(query_budget(3))])
 def delete_user(
     user_id: int,
     db: Session = Depends(get_db),
@@ -175,8 +166,8 @@ def delete_user(
     1. Owner can delete any user including other owners
     2. Admin can only delete regular users, not other admins or owners
     """
-    # Get the user to delete
-    user_to_delete = db.query(User).filter(User.id == user_id).first()
+    # Get the user's id, username and group levels; enough for the permission check
+    user_to_delete = get_user_access(db, user_id)
     if not user_to_delete:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -194,20 +185,23 @@ def delete_user(
     db.query(UserGroup).filter(UserGroup.user_id == user_id).delete()
     
     # Delete user
-    db.delete(user_to_delete)
+    db.query(User).filter(User.id == user_id).delete()
     db.commit()
+    invalidate_principals(user_to_delete.username)
+    invalidate_acl(user_ids=[user_id])
     return {"status": "success", "message": "User deleted successfully"}
 
 # Group Management Endpoints
 
 # Get all groups - admin only
-@router.get("/admin/groups", response_model=list[Group])
+@router.get("/admin/groups", response_model=list[Group], dependencies=[Depends(query_budget(3))])
+@single_flight(response_model=list[Group])
 def get_all_groups(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(check_admin_role)
 ):
     """Get all groups in the system (admin only)"""
-    return db.query(GroupModel).all()
+    return db.query(GroupModel).options(selectinload(GroupModel.permissions)).all()
 
 # Create group - owner only
 @router.post("/admin/groups/add", response_model=Group)
@@ -280,6 +274,7 @@ def update_group(
     
     db.commit()
     db.refresh(group_to_update)
+    invalidate_principals()
     return group_to_update
 
 # Delete group - owner only, cannot delete system groups
@@ -318,15 +313,24 @@ def delete_group(
     # Delete all group-permission relationships for this group
     db.query(GroupPermission).filter(GroupPermission.group_id == group_id).delete()
     
+    # Remove the group's grants on shared ledgers (the ledgers themselves stay); their access is reloaded for everyone
+    shared_ledger_ids = [ledger_id for (ledger_id,) in db.query(TablePermission.ledger_id).filter(
+        TablePermission.group_id == group_id, TablePermission.ledger_id.isnot(None)
+    )]
+    db.query(TablePermission).filter(TablePermission.group_id == group_id).delete()
+    
     # Delete the group
     db.delete(group_to_delete)
     db.commit()
+    invalidate_principals()
+    invalidate_acl(ledger_ids=shared_ledger_ids)
     return {"status": "success", "message": "Group deleted successfully"}
 
 # Get all permissions - admin only
 @router.get("/admin/permissions", response_model=list[PermissionSchema])
+@single_flight(response_model=list[PermissionSchema])
 def get_all_permissions(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(check_admin_role)
 ):
     """Get all permissions in the system (admin only)"""
@@ -334,8 +338,9 @@ def get_all_permissions(
 
 # Get all permission nodes - public admin endpoint (no auth required)
 @router.get("/admin/permission-nodes", response_model=list[dict])
+@single_flight()
 def get_all_permission_nodes(
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all permissions organized by category (public endpoint, no authentication required)"""
     permissions = db.query(Permission).all()
@@ -359,9 +364,10 @@ def get_all_permission_nodes(
 
 # Get group permissions - admin only
 @router.get("/admin/groups/{group_id}/permissions", response_model=dict)
+@single_flight()
 def get_group_permissions(
     group_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(check_admin_role)
 ):
     """Get permissions for a specific group (admin only)"""
@@ -429,4 +435,30 @@ def update_group_permissions(
             db.add(group_permission)
     
     db.commit()
+    invalidate_principals()
     return {"status": "success", "message": "Group permissions updated successfully"}
+
+# Profiling Endpoints
+
+# List recorded request profiles - owner only
+@router.get("/admin/profiles", response_model=list[dict])
+def get_profiles(
+    current_user: User = Depends(check_owner_role)
+):
+    """List recorded request profiles, newest first (owner only)"""
+    return profile_store.list()
+
+# Get flame data of a request profile - owner only
+@router.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(
+    profile_id: int,
+    current_user: User = Depends(check_owner_role)
+):
+    """Get a profile in collapsed-stack format for flamegraph.pl or speedscope (owner only)"""
+    profile = profile_store.get(profile_id)
+    if not profile:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    return PlainTextResponse(profile["folded"])
@@ -0,0 +1,137 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse, Response
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from app.utils.acl import LedgerScope, ledger_scope, get_ledger_db, get_ledger_read_db
+from app.utils.attachments import (
+    store_stream, blob_path, release_blobs, AttachmentTooLarge, EmptyAttachment,
+    ATTACHMENT_MAX_BYTES, ATTACHMENT_TYPES, ATTACHMENTS_PER_RECORD
+)
+from app.crud.record import get_record
+from app.crud.attachment import get_attachments, get_attachment, count_attachments, create_attachment, delete_attachment
+from app.schemas.attachment import Attachment
+import os
+
+# Create router
+router = APIRouter()
+
+# Stored files never change, so clients may keep them
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+def _record_not_found():
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="Record not found"
+    )
+
+def _attachment_not_found():
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="Attachment not found"
+    )
+
+def _too_large():
+    return HTTPException(
+        status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+        detail=f"Attachments are limited to {ATTACHMENT_MAX_BYTES} bytes"
+    )
+
+# Get the attachments of a record
+@router.get("/{record_id}/attachments", response_model=List[Attachment])
+def read_attachments(
+    record_id: int,
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
+    db: Session = Depends(get_ledger_read_db("can_access"))
+):
+    if get_record(db=db, record_id=record_id, user_id=scope.owner_id, ledger_id=scope.ledger_id) is None:
+        raise _record_not_found()
+    return get_attachments(db=db, record_id=record_id, user_id=scope.owner_id)
+
+# Attach a file to a record; the request body is the file itself, streamed to the store
+@router.post("/{record_id}/attachments", response_model=Attachment, status_code=status.HTTP_201_CREATED)
+async def upload_attachment(
+    record_id: int,
+    request: Request,
+    filename: Optional[str] = Query(None, max_length=255),
+    content_type: Optional[str] = Header(None),
+    content_length: Optional[int] = Header(None),
+    scope: LedgerScope = Depends(ledger_scope("can_edit")),
+    db: Session = Depends(get_ledger_db("can_edit"))
+):
+    """Send the file as the raw body (not multipart) with its Content-Type, e.g.
+    `curl --data-binary @receipt.jpg -H "Content-Type: image/jpeg" .../attachments?filename=receipt.jpg`."""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type not in ATTACHMENT_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Attachments must be one of: {', '.join(sorted(ATTACHMENT_TYPES))}"
+        )
+    if content_length is not None and content_length > ATTACHMENT_MAX_BYTES:
+        raise _too_large()
+    db_record = await run_in_threadpool(get_record, db, record_id, scope.owner_id, scope.ledger_id)
+    if db_record is None:
+        raise _record_not_found()
+    if await run_in_threadpool(count_attachments, db, record_id, scope.owner_id) >= ATTACHMENTS_PER_RECORD:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A record can have at most {ATTACHMENTS_PER_RECORD} attachments"
+        )
+    try:
+        sha256, size = await store_stream(request.stream())
+    except AttachmentTooLarge:
+        raise _too_large()
+    except EmptyAttachment:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The attachment is empty"
+        )
+    return await run_in_threadpool(create_attachment, db, record_id, scope.owner_id, sha256, size, media_type, filename)
+
+# Download an attachment; supports Range and If-None-Match
+@router.get("/{record_id}/attachments/{attachment_id}")
+def download_attachment(
+    record_id: int,
+    attachment_id: int,
+    if_none_match: Optional[str] = Header(None),
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
+    db: Session = Depends(get_ledger_read_db("can_access"))
+):
+    if get_record(db=db, record_id=record_id, user_id=scope.owner_id, ledger_id=scope.ledger_id) is None:
+        raise _record_not_found()
+    db_attachment = get_attachment(db=db, attachment_id=attachment_id, record_id=record_id, user_id=scope.owner_id)
+    if db_attachment is None:
+        raise _attachment_not_found()
+    etag = f'"{db_attachment.sha256}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL, "X-Content-Type-Options": "nosniff"}
+    if if_none_match is not None and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    path = blob_path(db_attachment.sha256)
+    if not os.path.exists(path):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Attachment file is missing"
+        )
+    return FileResponse(
+        path,
+        media_type=db_attachment.content_type,
+        filename=db_attachment.filename,
+        content_disposition_type="inline",
+        headers=headers
+    )
+
+# Delete attachment; its file goes once no attachment uses it
+@router.post("/{record_id}/attachments/delete/{attachment_id}", status_code=status.HTTP_200_OK)
+def delete_existing_attachment(
+    record_id: int,
+    attachment_id: int,
+    scope: LedgerScope = Depends(ledger_scope("can_edit")),
+    db: Session = Depends(get_ledger_db("can_edit"))
+):
+    if get_record(db=db, record_id=record_id, user_id=scope.owner_id, ledger_id=scope.ledger_id) is None:
+        raise _record_not_found()
+    sha256 = delete_attachment(db=db, attachment_id=attachment_id, record_id=record_id, user_id=scope.owner_id)
+    if sha256 is None:
+        raise _attachment_not_found()
+    release_blobs([sha256])
+    return {"status": "success", "message": "Attachment deleted successfully"}
@@ -0,0 +1,103 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+from typing import List
+from app.utils.query_inspector import query_budget
+from app.utils.acl import LedgerScope, ledger_scope, get_ledger_db, get_ledger_read_db
+from app.crud.budget import get_budget_status, get_budget, get_category_budget, create_budget, update_budget, delete_budget
+from app.crud.category import get_category
+from app.schemas.budget import Budget, BudgetCreate, BudgetUpdate, BudgetStatus
+
+# Create router
+router = APIRouter()
+
+# Highest alert threshold accepted, as a percentage of the limit
+MAX_THRESHOLD = 1000
+
+# 400 unless the limit is positive and the thresholds are percentages in range
+def _check_budget(amount, thresholds):
+    if amount is not None and amount <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Budget amount must be positive"
+        )
+    if thresholds is not None and not all(1 <= threshold <= MAX_THRESHOLD for threshold in thresholds):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Thresholds must be percentages between 1 and {MAX_THRESHOLD}"
+        )
+
+# Get budgets with this month's spending, read from the monthly totals
+@router.get("/", response_model=List[BudgetStatus], dependencies=[Depends(query_budget(2))])
+def read_budgets(
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
+    db: Session = Depends(get_ledger_read_db("can_access"))
+):
+    return get_budget_status(db=db, user_id=scope.owner_id, ledger_id=scope.ledger_id)
+
+# Create the monthly budget of an expense category, or of all expenses when category_id is omitted
+@router.post("/", response_model=Budget, status_code=status.HTTP_201_CREATED)
+def create_new_budget(
+    budget: BudgetCreate,
+    scope: LedgerScope = Depends(ledger_scope("can_add")),
+    db: Session = Depends(get_ledger_db("can_add"))
+):
+    _check_budget(budget.amount, budget.thresholds)
+    if budget.category_id is not None:
+        category = get_category(db=db, category_id=budget.category_id, user_id=scope.owner_id, ledger_id=scope.ledger_id)
+        if category is None or category.type != "expense":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Budgets need an expense category"
+            )
+    if get_category_budget(db=db, category_id=budget.category_id, user_id=scope.owner_id, ledger_id=scope.ledger_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="This category already has a budget"
+        )
+    return create_budget(db=db, budget=budget, user_id=scope.owner_id, ledger_id=scope.ledger_id)
+
+# Get budget by ID
+@router.get("/{budget_id}", response_model=Budget)
+def read_budget(
+    budget_id: int,
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
+    db: Session = Depends(get_ledger_read_db("can_access"))
+):
+    db_budget = get_budget(db=db, budget_id=budget_id, user_id=scope.owner_id, ledger_id=scope.ledger_id)
+    if db_budget is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Budget not found"
+        )
+    return db_budget
+
+# Update budget limit or thresholds
+@router.post("/update/{budget_id}", response_model=Budget)
+def update_existing_budget(
+    budget_id: int,
+    budget: BudgetUpdate,
+    scope: LedgerScope = Depends(ledger_scope("can_edit")),
+    db: Session = Depends(get_ledger_db("can_edit"))
+):
+    _check_budget(budget.amount, budget.thresholds)
+    db_budget = update_budget(db=db, budget_id=budget_id, budget=budget, user_id=scope.owner_id, ledger_id=scope.ledger_id)
+    if db_budget is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Budget not found"
+        )
+    return db_budget
+
+# Delete budget
+@router.post("/delete/{budget_id}", status_code=status.HTTP_200_OK)
+def delete_existing_budget(
+    budget_id: int,
+    scope: LedgerScope = Depends(ledger_scope("can_delete")),
+    db: Session = Depends(get_ledger_db("can_delete"))
+):
+    if not delete_budget(db=db, budget_id=budget_id, user_id=scope.owner_id, ledger_id=scope.ledger_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Budget not found"
+        )
+    return {"status": "success", "message": "Budget deleted successfully"}
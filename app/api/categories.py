@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, status
 from sqlalchemy.orm import Session
-from typing import List
-from app.utils.database import get_db
+from typing import List, Optional
+from app.utils.acl import LedgerScope, ledger_scope, get_ledger_db
 from app.utils.auth import get_current_user
 from app.crud.category import get_categories, get_category, create_category, update_category, delete_category
 from app.schemas.category import Category, CategoryCreate, CategoryUpdate
 from app.models.user import User
+from app.models.category import Category as CategoryModel
+from app.utils.idempotency import idempotent_create
 
 # Create router
 router = APIRouter()
@@ -14,19 +16,19 @@ router = APIRouter()
 @router.get("/", response_model=List[Category])
 def read_categories(
     type: str = None,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
+    db: Session = Depends(get_ledger_db("can_access"))
 ):
-    return get_categories(db=db, user_id=current_user.id, type=type)
+    return get_categories(db=db, user_id=scope.owner_id, type=type, ledger_id=scope.ledger_id)
 
 # Get category by ID
 @router.get("/{category_id}", response_model=Category)
 def read_category(
     category_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
+    db: Session = Depends(get_ledger_db("can_access"))
 ):
-    db_category = get_category(db=db, category_id=category_id, user_id=current_user.id)
+    db_category = get_category(db=db, category_id=category_id, user_id=scope.owner_id, ledger_id=scope.ledger_id)
     if db_category is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -38,20 +40,32 @@ def read_category(
 @router.post("/", response_model=Category, status_code=status.HTTP_201_CREATED)
 def create_new_category(
     category: CategoryCreate,
+    idempotency_key: Optional[str] = Header(None),
+    scope: LedgerScope = Depends(ledger_scope("can_add_category")),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_ledger_db("can_add_category"))
 ):
-    return create_category(db=db, category=category, user_id=current_user.id)
+    return idempotent_create(
+        db=db,
+        key=idempotency_key,
+        user_id=current_user.id,
+        owner_id=scope.owner_id,
+        scope="categories.create" if scope.ledger_id is None else f"categories.create:ledger{scope.ledger_id}",
+        payload=category,
+        create=lambda: create_category(db=db, category=category, user_id=scope.owner_id, ledger_id=scope.ledger_id),
+        model=CategoryModel,
+        response_model=Category
+    )
 
 # Update category
 @router.post("/update/{category_id}", response_model=Category)
 def update_existing_category(
     category_id: int,
     category: CategoryUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    scope: LedgerScope = Depends(ledger_scope("can_add_category")),
+    db: Session = Depends(get_ledger_db("can_add_category"))
 ):
-    db_category = update_category(db=db, category_id=category_id, category=category, user_id=current_user.id)
+    db_category = update_category(db=db, category_id=category_id, category=category, user_id=scope.owner_id, ledger_id=scope.ledger_id)
     if db_category is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -63,10 +77,10 @@ def update_existing_category(
 @router.post("/delete/{category_id}", status_code=status.HTTP_200_OK)
 def delete_existing_category(
     category_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    scope: LedgerScope = Depends(ledger_scope("can_delete_category")),
+    db: Session = Depends(get_ledger_db("can_delete_category"))
 ):
-    success = delete_category(db=db, category_id=category_id, user_id=current_user.id)
+    success = delete_category(db=db, category_id=category_id, user_id=scope.owner_id, ledger_id=scope.ledger_id)
     if not success:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
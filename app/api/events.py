@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from app.utils.auth import oauth2_scheme, get_current_user
+from app.utils.database import get_db
+from app.utils.acl import acl_index
+from app.utils.events import event_stream, user_topic, ledger_topic
+from app.models.user import User
+
+# Create router
+router = APIRouter()
+
+# Current user, from a session closed before the response starts instead of held open for the whole stream
+def _stream_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db, scope="function")):
+    return get_current_user(token, db)
+
+# Stream the current user's events (budget alerts) and those of the ledgers they can access, as server-sent events.
+# Ledgers granted after the stream opened are picked up when the client reconnects
+@router.get("/")
+async def stream_events(
+    request: Request,
+    current_user: User = Depends(_stream_user)
+):
+    topics = [user_topic(current_user.id)] + [
+        ledger_topic(ledger_id) for ledger_id, access in acl_index.ledgers(current_user.id).items() if access.can_access
+    ]
+    return StreamingResponse(
+        event_stream(topics, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
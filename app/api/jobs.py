@@ -0,0 +1,78 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+from typing import List
+from app.utils.database import get_db
+from app.utils.auth import get_current_user
+from app.utils.jobs import job_runner
+from app.models.job import Job as JobModel
+from app.schemas.job import Job, JobCreate
+from app.models.user import User
+import os
+
+# Register job handlers
+import app.utils.exports
+import app.utils.rollups
+import app.utils.archive
+
+# Create router
+router = APIRouter()
+
+# Get a job of the current user, or 404
+def _get_job(db: Session, job_id: int, user_id: int):
+    db_job = db.query(JobModel).filter(JobModel.id == job_id, JobModel.user_id == user_id).first()
+    if db_job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    return db_job
+
+# Submit job
+@router.post("/", response_model=Job, status_code=status.HTTP_202_ACCEPTED)
+def submit_job(
+    job: JobCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    is_admin = any(group.is_admin for group in current_user.groups)
+    return job_runner.submit(db=db, user_id=current_user.id, kind=job.kind, params=job.params, is_admin=is_admin)
+
+# Get recent jobs
+@router.get("/", response_model=List[Job])
+def read_jobs(
+    limit: int = 20,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return db.query(JobModel).filter(JobModel.user_id == current_user.id).order_by(JobModel.id.desc()).limit(limit).all()
+
+# Get job by ID
+@router.get("/{job_id}", response_model=Job)
+def read_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return _get_job(db, job_id, current_user.id)
+
+# Download job result
+@router.get("/{job_id}/download")
+def download_job_result(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    db_job = _get_job(db, job_id, current_user.id)
+    if db_job.status != "succeeded":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Job has not finished"
+        )
+    if not db_job.result_path or not os.path.exists(db_job.result_path):
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Job result has expired"
+        )
+    filename = f"{db_job.kind}-{db_job.id}{os.path.splitext(db_job.result_path)[1]}"
+    return FileResponse(db_job.result_path, filename=filename)
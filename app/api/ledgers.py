@@ -0,0 +1,116 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+from typing import List
+from app.utils.database import get_db
+from app.utils.auth import get_current_user
+from app.utils.acl import LEDGER_FLAGS, acl_index, require_ledger_access
+from app.utils.shards import bind_user_shard
+from app.crud.ledger import (
+    get_ledgers, get_ledger, create_ledger, update_ledger, delete_ledger,
+    get_ledger_permissions, set_ledger_permission, delete_ledger_permission
+)
+from app.schemas.ledger import Ledger, LedgerCreate, LedgerUpdate, LedgerAccess, LedgerPermission, LedgerPermissionSet
+from app.models.group import Group
+from app.models.user import User
+
+# Create router
+router = APIRouter()
+
+# Ledger response with the current user's access
+def _with_access(db_ledger, access):
+    return Ledger.model_validate(db_ledger).model_copy(update={
+        "access": LedgerAccess(**{flag: getattr(access, flag) for flag in LEDGER_FLAGS})
+    })
+
+# Get ledgers the current user can see
+@router.get("/", response_model=List[Ledger])
+def read_ledgers(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    access = {ledger_id: entry for ledger_id, entry in acl_index.ledgers(current_user.id).items() if entry.can_access}
+    return [_with_access(db_ledger, access[db_ledger.id]) for db_ledger in get_ledgers(db, list(access))]
+
+# Create ledger, owned by the current user
+@router.post("/", response_model=Ledger, status_code=status.HTTP_201_CREATED)
+def create_new_ledger(
+    ledger: LedgerCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    db_ledger = create_ledger(db=db, ledger=ledger, owner_id=current_user.id)
+    return _with_access(db_ledger, require_ledger_access(current_user.id, db_ledger.id))
+
+# Get ledger by ID
+@router.get("/{ledger_id}", response_model=Ledger)
+def read_ledger(
+    ledger_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    access = require_ledger_access(current_user.id, ledger_id)
+    return _with_access(get_ledger(db=db, ledger_id=ledger_id), access)
+
+# Update ledger name and description
+@router.post("/update/{ledger_id}", response_model=Ledger)
+def update_existing_ledger(
+    ledger_id: int,
+    ledger: LedgerUpdate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    access = require_ledger_access(current_user.id, ledger_id, "can_modify_table_info")
+    return _with_access(update_ledger(db=db, ledger_id=ledger_id, ledger=ledger), access)
+
+# Delete ledger with its records and categories
+@router.post("/delete/{ledger_id}", status_code=status.HTTP_200_OK)
+def delete_existing_ledger(
+    ledger_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    access = require_ledger_access(current_user.id, ledger_id, "can_delete_table")
+    delete_ledger(db=bind_user_shard(db, access.owner_id), ledger_id=ledger_id)
+    return {"status": "success", "message": "Ledger deleted successfully"}
+
+# Get the groups a ledger is shared with
+@router.get("/{ledger_id}/permissions", response_model=List[LedgerPermission])
+def read_ledger_permissions(
+    ledger_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    require_ledger_access(current_user.id, ledger_id, "can_manage")
+    return get_ledger_permissions(db=db, ledger_id=ledger_id)
+
+# Share a ledger with a group, or change what the group may do
+@router.post("/{ledger_id}/permissions", response_model=LedgerPermission)
+def set_ledger_group_permission(
+    ledger_id: int,
+    permission: LedgerPermissionSet,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    require_ledger_access(current_user.id, ledger_id, "can_manage")
+    if db.query(Group.id).filter(Group.id == permission.group_id).first() is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Group not found"
+        )
+    return set_ledger_permission(db=db, ledger_id=ledger_id, permission=permission)
+
+# Stop sharing a ledger with a group
+@router.post("/{ledger_id}/permissions/delete/{group_id}", status_code=status.HTTP_200_OK)
+def delete_ledger_group_permission(
+    ledger_id: int,
+    group_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    require_ledger_access(current_user.id, ledger_id, "can_manage")
+    if not delete_ledger_permission(db=db, ledger_id=ledger_id, group_id=group_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ledger is not shared with this group"
+        )
+    return {"status": "success", "message": "Ledger permission deleted successfully"}
@@ -1,45 +1,160 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import datetime
-from app.utils.database import get_db
+from app.utils.acl import LedgerScope, ledger_scope, get_ledger_db, get_ledger_read_db
 from app.utils.auth import get_current_user
-from app.crud.record import get_records, get_record, create_record, update_record, delete_record
-from app.schemas.record import Record, RecordCreate, RecordUpdate, RecordWithCategory
+from app.crud.record import get_record_rows, get_record, get_archived_record, create_record, update_record, delete_record, search_records
+from app.schemas.record import Record, RecordCreate, RecordUpdate, RecordWithCategory, RecordInsights, DescriptionSuggestion
 from app.models.user import User
+from app.models.record import Record as RecordModel
+from app.utils.query_inspector import query_budget
+from app.utils.idempotency import idempotent_create
+from app.utils.singleflight import single_flight
+from app.utils.fieldsets import fieldset_params
+from app.utils.insights import MAX_INSIGHTS_DAYS, get_insights
+from app.utils.autocomplete import suggest_descriptions
+from app.utils.serialization import (
+    encode_rows, json_response, negotiate_format, encode_columnar, epoch_seconds, pyarrow,
+    TYPE_CODES, COLUMNAR_JSON_MEDIA_TYPE, ARROW_STREAM_MEDIA_TYPE, RESPONSE_FORMATS
+)
 
 # Create router
 router = APIRouter()
 
 # Get all records
-@router.get("/", response_model=List[Record])
+@router.get("/", response_model=List[Record], dependencies=[Depends(query_budget(2))])
+@single_flight(per_user=True)
 def read_records(
     skip: int = 0,
     limit: int = 100,
     start_date: datetime = None,
     end_date: datetime = None,
     type: str = None,
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    fieldset: Optional[dict] = Depends(fieldset_params(Record)),
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_ledger_read_db("can_access"))
 ):
-    return get_records(
+    """List records as JSON objects, or as parallel arrays with format=columnar
+    (Accept: application/vnd.duckpay.columnar+json or application/vnd.apache.arrow.stream).
+    An explicit format= wins over Accept. ?fields= / ?exclude= select the columns of JSON objects."""
+    try:
+        response_format = negotiate_format(format, accept)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of: {', '.join(RESPONSE_FORMATS)}"
+        )
+    if response_format != "json":
+        if response_format == "arrow" and pyarrow is None:
+            raise HTTPException(
+                status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                detail="Arrow responses are not available"
+            )
+        rows = get_record_rows(
+            db=db,
+            fields=("id", "amount", "date", "category_id", "type"),
+            user_id=scope.owner_id,
+            skip=skip,
+            limit=limit,
+            start_date=start_date,
+            end_date=end_date,
+            type=type,
+            ledger_id=scope.ledger_id
+        )
+        return records_columnar_response(rows, response_format)
+    
+    # Select plain columns and encode them directly; same JSON as the response model
+    fields = tuple(fieldset) if fieldset is not None else None
+    rows = get_record_rows(
         db=db,
-        user_id=current_user.id,
+        fields=fields or Record.model_fields,
+        user_id=scope.owner_id,
         skip=skip,
         limit=limit,
         start_date=start_date,
         end_date=end_date,
-        type=type
+        type=type,
+        ledger_id=scope.ledger_id
     )
+    return json_response(encode_rows(Record, rows, fields))
+
+# Encode (id, amount, date, category_id, type) rows as parallel arrays
+def records_columnar_response(rows, response_format):
+    media_type = ARROW_STREAM_MEDIA_TYPE if response_format == "arrow" else COLUMNAR_JSON_MEDIA_TYPE
+    columns = {
+        "ids": ([row[0] for row in rows], "int64"),
+        "amounts": ([row[1] for row in rows], "double"),
+        "dates": ([epoch_seconds(row[2]) for row in rows], "int64"),
+        "category_ids": ([row[3] for row in rows], "int64"),
+        "types": ([TYPE_CODES.get(row[4], -1) for row in rows], "int8"),
+    }
+    return Response(content=encode_columnar(columns, media_type), media_type=media_type)
+
+# Get spending (or income) trends, month-over-month changes by category and unusual records
+@router.get("/insights", response_model=RecordInsights, dependencies=[Depends(query_budget(2))])
+@single_flight(per_user=True)
+def read_record_insights(
+    type: str = Query("expense", pattern="^(income|expense)$"),
+    days: int = Query(90, ge=7, le=MAX_INSIGHTS_DAYS),
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_ledger_read_db("can_access"))
+):
+    """Daily totals of the last `days` days with 7 and 30 day averages, this month's totals per
+    category against last month's, and records far above their category's usual amounts."""
+    return json_response(get_insights(db=db, user_id=scope.owner_id, type=type, days=days, ledger_id=scope.ledger_id))
+
+# Search records by description
+@router.get("/search", response_model=List[Record], dependencies=[Depends(query_budget(2))])
+def search_records_by_description(
+    q: str = Query(..., min_length=1, max_length=200),
+    skip: int = 0,
+    limit: int = Query(20, ge=1, le=100),
+    start_date: datetime = None,
+    end_date: datetime = None,
+    type: str = None,
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
+    db: Session = Depends(get_ledger_read_db("can_access"))
+):
+    """Records whose description has a word starting with each word of q, best match first."""
+    return search_records(
+        db=db,
+        user_id=scope.owner_id,
+        q=q,
+        skip=skip,
+        limit=limit,
+        start_date=start_date,
+        end_date=end_date,
+        type=type,
+        ledger_id=scope.ledger_id
+    )
+
+# Suggest descriptions (and their usual categories) for what the user is typing
+@router.get("/autocomplete", response_model=List[DescriptionSuggestion], dependencies=[Depends(query_budget(2))])
+def autocomplete_description(
+    prefix: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(10, ge=1, le=50),
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
+    db: Session = Depends(get_ledger_read_db("can_access"))
+):
+    """Descriptions of recent records with a word starting with prefix, most used first."""
+    return suggest_descriptions(db=db, user_id=scope.owner_id, prefix=prefix, limit=limit, ledger_id=scope.ledger_id)
 
 # Get record by ID
-@router.get("/{record_id}", response_model=Record)
+@router.get("/{record_id}", response_model=Record, dependencies=[Depends(query_budget(2))])
 def read_record(
     record_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
+    db: Session = Depends(get_ledger_read_db("can_access"))
 ):
-    db_record = get_record(db=db, record_id=record_id, user_id=current_user.id)
+    db_record = get_record(db=db, record_id=record_id, user_id=scope.owner_id, ledger_id=scope.ledger_id)
+    if db_record is None:
+        db_record = get_archived_record(db=db, record_id=record_id, user_id=scope.owner_id, ledger_id=scope.ledger_id)
     if db_record is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -51,20 +166,32 @@ def read_record(
 @router.post("/", response_model=Record, status_code=status.HTTP_201_CREATED)
 def create_new_record(
     record: RecordCreate,
+    idempotency_key: Optional[str] = Header(None),
+    scope: LedgerScope = Depends(ledger_scope("can_add")),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_ledger_db("can_add"))
 ):
-    return create_record(db=db, record=record, user_id=current_user.id)
+    return idempotent_create(
+        db=db,
+        key=idempotency_key,
+        user_id=current_user.id,
+        owner_id=scope.owner_id,
+        scope="records.create" if scope.ledger_id is None else f"records.create:ledger{scope.ledger_id}",
+        payload=record,
+        create=lambda: create_record(db=db, record=record, user_id=scope.owner_id, ledger_id=scope.ledger_id),
+        model=RecordModel,
+        response_model=Record
+    )
 
 # Update record
 @router.post("/update/{record_id}", response_model=Record)
 def update_existing_record(
     record_id: int,
     record: RecordUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    scope: LedgerScope = Depends(ledger_scope("can_edit")),
+    db: Session = Depends(get_ledger_db("can_edit"))
 ):
-    db_record = update_record(db=db, record_id=record_id, record=record, user_id=current_user.id)
+    db_record = update_record(db=db, record_id=record_id, record=record, user_id=scope.owner_id, ledger_id=scope.ledger_id)
     if db_record is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -76,10 +203,10 @@ def update_existing_record(
 @router.post("/delete/{record_id}", status_code=status.HTTP_200_OK)
 def delete_existing_record(
     record_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    scope: LedgerScope = Depends(ledger_scope("can_delete")),
+    db: Session = Depends(get_ledger_db("can_delete"))
 ):
-    success = delete_record(db=db, record_id=record_id, user_id=current_user.id)
+    success = delete_record(db=db, record_id=record_id, user_id=scope.owner_id, ledger_id=scope.ledger_id)
     if not success:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -0,0 +1,113 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+from typing import List
+from datetime import datetime, timedelta, timezone
+from app.utils.acl import LedgerScope, ledger_scope, get_ledger_db, get_ledger_read_db
+from app.utils.cron import CronError
+from app.utils.recurring import announce_rule
+from app.crud.recurring import (
+    get_rules, get_rule, create_rule, update_rule, delete_rule, as_utc, count_runs,
+    RECURRING_MAX_BACKFILL_DAYS, RECURRING_MAX_BACKFILL
+)
+from app.schemas.recurring import RecurringRule, RecurringRuleCreate, RecurringRuleUpdate
+
+# Create router
+router = APIRouter()
+
+# 400 for a schedule that does not parse
+def _invalid_schedule(error):
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Invalid schedule: {error}"
+    )
+
+# 400 for a start in the past that would leave the scheduler too much to catch up on
+def _check_backfill(rule: RecurringRuleCreate):
+    if rule.start_at is None:
+        return
+    now = datetime.now(timezone.utc)
+    start_at = as_utc(rule.start_at)
+    if start_at < now - timedelta(days=RECURRING_MAX_BACKFILL_DAYS):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"start_at may be at most {RECURRING_MAX_BACKFILL_DAYS} days in the past"
+        )
+    until = min(now, as_utc(rule.end_at)) if rule.end_at is not None else now
+    if count_runs(rule.schedule, start_at, until, RECURRING_MAX_BACKFILL) > RECURRING_MAX_BACKFILL:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"start_at may leave at most {RECURRING_MAX_BACKFILL} past occurrences to record"
+        )
+
+# Get recurring rules
+@router.get("/", response_model=List[RecurringRule])
+def read_rules(
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
+    db: Session = Depends(get_ledger_read_db("can_access"))
+):
+    return get_rules(db=db, user_id=scope.owner_id, ledger_id=scope.ledger_id)
+
+# Create recurring rule; occurrences since start_at (within the backfill limits) are recorded by the scheduler
+@router.post("/", response_model=RecurringRule, status_code=status.HTTP_201_CREATED)
+def create_new_rule(
+    rule: RecurringRuleCreate,
+    scope: LedgerScope = Depends(ledger_scope("can_add")),
+    db: Session = Depends(get_ledger_db("can_add"))
+):
+    try:
+        _check_backfill(rule)
+        db_rule = create_rule(db=db, rule=rule, user_id=scope.owner_id, ledger_id=scope.ledger_id)
+    except CronError as e:
+        raise _invalid_schedule(e)
+    announce_rule(db.info.get("shard"), db_rule.id, db_rule.next_run_at)
+    return db_rule
+
+# Get recurring rule by ID
+@router.get("/{rule_id}", response_model=RecurringRule)
+def read_rule(
+    rule_id: int,
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
+    db: Session = Depends(get_ledger_read_db("can_access"))
+):
+    db_rule = get_rule(db=db, rule_id=rule_id, user_id=scope.owner_id, ledger_id=scope.ledger_id)
+    if db_rule is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Recurring rule not found"
+        )
+    return db_rule
+
+# Update recurring rule
+@router.post("/update/{rule_id}", response_model=RecurringRule)
+def update_existing_rule(
+    rule_id: int,
+    rule: RecurringRuleUpdate,
+    scope: LedgerScope = Depends(ledger_scope("can_edit")),
+    db: Session = Depends(get_ledger_db("can_edit"))
+):
+    try:
+        db_rule = update_rule(db=db, rule_id=rule_id, rule=rule, user_id=scope.owner_id, ledger_id=scope.ledger_id)
+    except CronError as e:
+        raise _invalid_schedule(e)
+    if db_rule is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Recurring rule not found"
+        )
+    if db_rule.enabled:
+        announce_rule(db.info.get("shard"), db_rule.id, db_rule.next_run_at)
+    return db_rule
+
+# Delete recurring rule; records it already created are kept
+@router.post("/delete/{rule_id}", status_code=status.HTTP_200_OK)
+def delete_existing_rule(
+    rule_id: int,
+    scope: LedgerScope = Depends(ledger_scope("can_delete")),
+    db: Session = Depends(get_ledger_db("can_delete"))
+):
+    if not delete_rule(db=db, rule_id=rule_id, user_id=scope.owner_id, ledger_id=scope.ledger_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Recurring rule not found"
+        )
+    return {"status": "success", "message": "Recurring rule deleted successfully"}
@@ -1,4 +1,6 @@
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.utils.metrics import render_metrics
 
 # Create router
 router = APIRouter()
@@ -8,3 +10,9 @@ router = APIRouter()
 def get_status():
     """Return pong to indicate backend is running"""
     return {"status": "pong"}
+
+# Metrics endpoint in Prometheus text format
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Return request and database metrics for Prometheus scraping"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -1,43 +1,55 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from typing import Optional
 from app.utils.database import get_db
-from app.utils.jwt import verify_password, create_access_token
-from app.crud.user import get_user_by_username, get_user_by_email, create_user, get_user_by_id, update_user
-from app.schemas.user import UserCreate, User, Token, UserUpdate
+from app.utils.jwt import verify_password, needs_rehash, simulate_password_check, create_access_token
+from app.crud.user import get_user_by_username, find_user_collisions, create_user, get_user_by_id, update_user, rehash_password
+from app.schemas.user import UserCreate, UserLogin, User, Token, UserUpdate
+from app.schemas.record import Balance, RecordTotals
 from app.utils.auth import get_current_user
+from app.utils.acl import LedgerScope, invalidate_acl, ledger_scope, get_ledger_read_db
+from app.crud.rollup import ALL_TIME, get_rollups, rollup_period
+from app.utils.money import from_cents
+from app.utils.query_inspector import query_budget
+from app.utils.fieldsets import fieldset_params, project
+from app.utils.serialization import dumps, json_response
+from app.utils.ratelimit import enforce_rate_limits, client_ip, login_ip_limit, login_username_limit, register_ip_limit
 
 # Create router
 router = APIRouter()
 
 # User registration
-@router.post("/register", response_model=User, status_code=status.HTTP_201_CREATED)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
-    # Check if username already exists
-    db_user = get_user_by_username(db, username=user.username)
-    if db_user:
+@router.post("/register", response_model=User, status_code=status.HTTP_201_CREATED, dependencies=[Depends(query_budget(6))])
+def register_user(user: UserCreate, request: Request, db: Session = Depends(get_db)):
+    # Throttle before hashing the password
+    enforce_rate_limits((register_ip_limit, client_ip(request)))
+    
+    # Check username and email together with one lean query
+    username_taken, email_taken = find_user_collisions(db, username=user.username, email=user.email)
+    if username_taken:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
-    
-    # Check if email already exists
-    db_user = get_user_by_email(db, email=user.email)
-    if db_user:
+    if email_taken:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
     # Create new user
-    return create_user(db=db, user=user)
+    db_user = create_user(db=db, user=user)
+    # Ledgers shared with the new user's group become visible to them
+    invalidate_acl(user_ids=[db_user.id])
+    return db_user
 
 # User login
 @router.post("/login", response_model=Token)
-def login_user(user_credentials: dict, db: Session = Depends(get_db)):
-    # Get username and password from request body
-    username = user_credentials.get("username")
-    password = user_credentials.get("password")
+def login_user(user_credentials: UserLogin, request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    # Get username and password from the validated request body
+    username = user_credentials.username
+    password = user_credentials.password
     
     # Validate input
     if not username or not password:
@@ -46,9 +58,17 @@ def login_user(user_credentials: dict, db: Session = Depends(get_db)):
             detail="Username and password are required",
         )
     
+    # Throttle by client IP, then by username, before any password check
+    enforce_rate_limits(
+        (login_ip_limit, client_ip(request)),
+        (login_username_limit, username.lower()),
+    )
+    
     # Get user by username
     user = get_user_by_username(db, username=username)
     if not user:
+        # Take as long as a real check so unknown usernames can't be told apart by timing
+        simulate_password_check()
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -63,6 +83,10 @@ def login_user(user_credentials: dict, db: Session = Depends(get_db)):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Upgrade hashes made with an older bcrypt cost after the response is sent
+    if needs_rehash(user.hashed_password):
+        background_tasks.add_task(rehash_password, user.id, user.hashed_password, password)
+    
     # Create access token with user groups
     user_groups = [group.name for group in user.groups]
     access_token = create_access_token(
@@ -72,11 +96,43 @@ def login_user(user_credentials: dict, db: Session = Depends(get_db)):
     return {"access_token": access_token, "token_type": "bearer"}
 
 # Get current user
-@router.get("/me", response_model=User)
-def get_me(current_user: User = Depends(get_current_user)):
-    return current_user
+@router.get("/me", response_model=User, dependencies=[Depends(query_budget(1))])
+def get_me(fieldset: Optional[dict] = Depends(fieldset_params(User)), current_user: User = Depends(get_current_user)):
+    if fieldset is None:
+        return current_user
+    # Only the requested fields of the cached principal
+    return json_response(dumps(project(current_user.model_dump(), fieldset)))
 
 # Update current user
 @router.post("/me/update", response_model=User)
 def update_me(user_update: UserUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     return update_user(db=db, user_id=current_user.id, user=user_update)
+
+# Totals of a rollup row, or zeros when there is none yet
+def _totals(rollup):
+    if rollup is None:
+        return RecordTotals()
+    return RecordTotals(
+        income=from_cents(rollup.income_cents),
+        expense=from_cents(rollup.expense_cents),
+        income_count=rollup.income_count,
+        expense_count=rollup.expense_count,
+        balance=from_cents(rollup.income_cents - rollup.expense_cents)
+    )
+
+# Get current balance and this month's income and expense, from the maintained totals
+@router.get("/me/balance", response_model=Balance, dependencies=[Depends(query_budget(2))])
+def get_my_balance(
+    category_id: Optional[int] = None,
+    scope: LedgerScope = Depends(ledger_scope("can_access")),
+    db: Session = Depends(get_ledger_read_db("can_access"))
+):
+    period = rollup_period()
+    rollups = get_rollups(db=db, user_id=scope.owner_id, period=period, ledger_id=scope.ledger_id, category_id=category_id)
+    return Balance(
+        ledger_id=scope.ledger_id,
+        category_id=category_id,
+        period=period,
+        total=_totals(rollups.get(ALL_TIME)),
+        month=_totals(rollups.get(period))
+    )
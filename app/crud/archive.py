@@ -0,0 +1,49 @@
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, timezone
+from app.models.archive import RecordArchive
+import os
+
+# Shortest horizon accepted: insights and autocomplete read only the records table (and check their windows
+# against the horizon at startup)
+MIN_ARCHIVE_AFTER_DAYS = 400
+
+# Records dated more than this many days ago are moved to records_archive by the archive run
+ARCHIVE_AFTER_DAYS = max(int(os.getenv("ARCHIVE_AFTER_DAYS", "730")), MIN_ARCHIVE_AFTER_DAYS)
+
+# Records dated before this moment belong in the archive
+def archive_cutoff(now: datetime = None):
+    return (now or datetime.now(timezone.utc)) - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+# Whether a listing starting at start_date (None for all time) reaches into the archive
+def archive_needed(start_date: datetime = None):
+    if start_date is None:
+        return True
+    if start_date.tzinfo is None:
+        start_date = start_date.replace(tzinfo=timezone.utc)
+    return start_date < archive_cutoff()
+
+# Archive column standing for a record field; archived rows keep their record id as id
+def archive_column(field: str):
+    if field == "id":
+        return RecordArchive.record_id.label("id")
+    return getattr(RecordArchive, field).label(field)
+
+# Apply the record listing filters to a query of archived records
+def filter_archive(query, user_id: int, start_date: datetime = None, end_date: datetime = None, type: str = None, ledger_id: int = None):
+    query = query.filter(
+        RecordArchive.user_id == user_id,
+        RecordArchive.ledger_id == ledger_id if ledger_id is not None else RecordArchive.ledger_id.is_(None)
+    )
+    
+    if start_date:
+        query = query.filter(RecordArchive.date >= start_date)
+    if end_date:
+        query = query.filter(RecordArchive.date <= end_date)
+    if type:
+        query = query.filter(RecordArchive.type == type)
+    
+    return query
+
+# Delete the archived records of a shared ledger
+def delete_ledger_archive(db: Session, user_id: int, ledger_id: int):
+    db.query(RecordArchive).filter(RecordArchive.user_id == user_id, RecordArchive.ledger_id == ledger_id).delete(synchronize_session=False)
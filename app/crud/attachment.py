@@ -0,0 +1,47 @@
+from sqlalchemy.orm import Session
+from app.models.attachment import RecordAttachment
+
+# Get the attachments of a record
+def get_attachments(db: Session, record_id: int, user_id: int):
+    return db.query(RecordAttachment).filter(
+        RecordAttachment.record_id == record_id, RecordAttachment.user_id == user_id
+    ).order_by(RecordAttachment.id).all()
+
+# Get attachment by id
+def get_attachment(db: Session, attachment_id: int, record_id: int, user_id: int):
+    return db.query(RecordAttachment).filter(
+        RecordAttachment.id == attachment_id, RecordAttachment.record_id == record_id, RecordAttachment.user_id == user_id
+    ).first()
+
+# Count the attachments of a record
+def count_attachments(db: Session, record_id: int, user_id: int):
+    return db.query(RecordAttachment).filter(RecordAttachment.record_id == record_id, RecordAttachment.user_id == user_id).count()
+
+# Attach a stored file to a record
+def create_attachment(db: Session, record_id: int, user_id: int, sha256: str, size: int, content_type: str, filename: str = None):
+    db_attachment = RecordAttachment(
+        record_id=record_id, user_id=user_id, sha256=sha256, size=size, content_type=content_type, filename=filename
+    )
+    db.add(db_attachment)
+    db.commit()
+    db.refresh(db_attachment)
+    return db_attachment
+
+# Delete attachment; returns the digest of its file, to release once no other attachment uses it
+def delete_attachment(db: Session, attachment_id: int, record_id: int, user_id: int):
+    db_attachment = get_attachment(db, attachment_id, record_id, user_id)
+    if db_attachment is None:
+        return None
+    sha256 = db_attachment.sha256
+    db.delete(db_attachment)
+    db.commit()
+    return sha256
+
+# Delete the attachments of records inside the caller's transaction (record_ids may be a subquery);
+# returns the digests of their files
+def delete_record_attachments(db: Session, user_id: int, record_ids):
+    attachments = (RecordAttachment.user_id == user_id) & RecordAttachment.record_id.in_(record_ids)
+    sha256s = {sha256 for (sha256,) in db.query(RecordAttachment.sha256).filter(attachments).distinct()}
+    if sha256s:
+        db.query(RecordAttachment).filter(attachments).delete(synchronize_session=False)
+    return sha256s
@@ -0,0 +1,146 @@
+from sqlalchemy import and_, func
+from sqlalchemy.orm import Session
+from app.models.budget import Budget
+from app.models.rollup import RecordRollup
+from app.schemas.budget import BudgetCreate, BudgetUpdate
+from app.crud.rollup import rollup_period
+from app.utils.cache import Cache
+from app.utils.events import emit, scope_topic
+from app.utils.money import from_cents
+import os
+
+# Budgets of a user or shared ledger as (id, category_id or 0, amount_cents, thresholds) tuples, by "user_id:ledger_id";
+# read on every record write to find the budgets it counts towards. Budget changes clear it in other workers
+# through CACHE_URL, which several workers require
+budget_cache = Cache("budgets", ttl=float(os.getenv("BUDGET_CACHE_TTL", "300")))
+
+# Index of the expense total in rollup deltas and totals
+_EXPENSE = 1
+
+# Drop the cached budgets of a user (or a shared ledger)
+def invalidate_budgets(user_id: int, ledger_id: int = None):
+    budget_cache.invalidate(f"{user_id}:{ledger_id or 0}")
+
+# Budgets of a user's own data, or of a shared ledger (whose rows carry the owner's user_id)
+def _scope_filter(user_id: int, ledger_id: int = None):
+    return (Budget.user_id == user_id) & (Budget.ledger_id == ledger_id if ledger_id is not None else Budget.ledger_id.is_(None))
+
+# Get budgets by user_id
+def get_budgets(db: Session, user_id: int, ledger_id: int = None):
+    return db.query(Budget).filter(_scope_filter(user_id, ledger_id)).order_by(Budget.id).all()
+
+# Get budget by id
+def get_budget(db: Session, budget_id: int, user_id: int, ledger_id: int = None):
+    return db.query(Budget).filter(Budget.id == budget_id, _scope_filter(user_id, ledger_id)).first()
+
+# Get the budget of a category (None for the overall budget)
+def get_category_budget(db: Session, category_id, user_id: int, ledger_id: int = None):
+    category = Budget.category_id == category_id if category_id is not None else Budget.category_id.is_(None)
+    return db.query(Budget).filter(category, _scope_filter(user_id, ledger_id)).first()
+
+# Create budget
+def create_budget(db: Session, budget: BudgetCreate, user_id: int, ledger_id: int = None):
+    db_budget = Budget(**budget.model_dump(), user_id=user_id, ledger_id=ledger_id)
+    db.add(db_budget)
+    db.commit()
+    invalidate_budgets(user_id, ledger_id)
+    db.refresh(db_budget)
+    return db_budget
+
+# Update budget
+def update_budget(db: Session, budget_id: int, budget: BudgetUpdate, user_id: int, ledger_id: int = None):
+    db_budget = get_budget(db, budget_id, user_id, ledger_id)
+    if db_budget:
+        update_data = budget.model_dump(exclude_unset=True)
+        for field, value in update_data.items():
+            setattr(db_budget, field, value)
+        db.commit()
+        invalidate_budgets(user_id, ledger_id)
+        db.refresh(db_budget)
+    return db_budget
+
+# Delete budget
+def delete_budget(db: Session, budget_id: int, user_id: int, ledger_id: int = None):
+    db_budget = get_budget(db, budget_id, user_id, ledger_id)
+    if db_budget:
+        db.delete(db_budget)
+        db.commit()
+        invalidate_budgets(user_id, ledger_id)
+        return True
+    return False
+
+# Delete the budgets of a shared ledger
+def delete_ledger_budgets(db: Session, user_id: int, ledger_id: int):
+    db.query(Budget).filter(Budget.user_id == user_id, Budget.ledger_id == ledger_id).delete(synchronize_session=False)
+
+# Highest threshold (a percentage of limit) that spent reaches, or None
+def reached_threshold(thresholds, spent_cents: int, limit_cents: int):
+    return max((threshold for threshold in thresholds if spent_cents * 100 >= threshold * limit_cents), default=None)
+
+# Get budgets with this month's spending: one query joining each budget to its monthly totals, no records read
+def get_budget_status(db: Session, user_id: int, ledger_id: int = None):
+    period = rollup_period()
+    rows = db.query(Budget, RecordRollup.expense_cents).outerjoin(RecordRollup, and_(
+        RecordRollup.user_id == Budget.user_id,
+        RecordRollup.ledger_id == func.coalesce(Budget.ledger_id, 0),
+        RecordRollup.category_id == func.coalesce(Budget.category_id, 0),
+        RecordRollup.period == period
+    )).filter(_scope_filter(user_id, ledger_id)).order_by(Budget.id).all()
+    statuses = []
+    for db_budget, spent_cents in rows:
+        spent_cents = spent_cents or 0
+        limit_cents = db_budget.amount_cents
+        statuses.append({
+            "id": db_budget.id,
+            "user_id": db_budget.user_id,
+            "ledger_id": db_budget.ledger_id,
+            "category_id": db_budget.category_id,
+            "amount": db_budget.amount,
+            "thresholds": db_budget.thresholds,
+            "created_at": db_budget.created_at,
+            "period": period,
+            "spent": from_cents(spent_cents),
+            "remaining": from_cents(limit_cents - spent_cents),
+            "percent": round(spent_cents * 100 / limit_cents, 2) if limit_cents else 0.0,
+            "threshold": reached_threshold(db_budget.thresholds, spent_cents, limit_cents),
+        })
+    return statuses
+
+# Budgets of a user (or a shared ledger), cached
+def _budget_limits(db: Session, user_id: int, ledger_id: int = None):
+    def load():
+        return [
+            (budget.id, budget.category_id or 0, budget.amount_cents, tuple(budget.thresholds))
+            for budget in get_budgets(db, user_id, ledger_id)
+        ]
+    return budget_cache.get_or_set(f"{user_id}:{ledger_id or 0}", load)
+
+# After a record write has committed, emit an event for every budget whose spending passed one of its
+# thresholds. deltas are the rollup deltas of the write and totals the bucket totals apply_rollup_deltas returned
+def check_budget_alerts(db: Session, deltas, totals):
+    period = rollup_period()
+    # Only expenses dated this month count towards the budgets
+    scopes = {
+        (user_id, ledger_id) for (user_id, ledger_id, _, bucket_period), delta in deltas.items()
+        if bucket_period == period and delta[_EXPENSE] > 0
+    }
+    for user_id, ledger_id in scopes:
+        for budget_id, category_id, limit_cents, thresholds in _budget_limits(db, user_id, ledger_id or None):
+            bucket = (user_id, ledger_id, category_id, period)
+            if bucket not in deltas or bucket not in totals:
+                continue
+            after = totals[bucket][_EXPENSE]
+            before = after - deltas[bucket][_EXPENSE]
+            threshold = reached_threshold(thresholds, after, limit_cents)
+            if threshold is None or threshold == reached_threshold(thresholds, before, limit_cents):
+                continue
+            emit(scope_topic(user_id, ledger_id or None), {
+                "type": "budget.threshold",
+                "budget_id": budget_id,
+                "ledger_id": ledger_id or None,
+                "category_id": category_id or None,
+                "period": period,
+                "threshold": threshold,
+                "spent": from_cents(after),
+                "amount": from_cents(limit_cents),
+            })
@@ -1,50 +1,85 @@
 from sqlalchemy.orm import Session
 from app.models.category import Category
-from app.schemas.category import CategoryCreate, CategoryUpdate
+from app.schemas.category import CategoryCreate, CategoryUpdate, Category as CategorySchema
+from app.utils.cache import Cache
+import os
+
+# Category lists (schema objects) by user and type
+category_cache = Cache("categories", ttl=float(os.getenv("CATEGORY_CACHE_TTL", "300")))
+
+# Drop cached category lists of a user
+def invalidate_user_categories(user_id: int):
+    category_cache.invalidate_prefix(f"{user_id}:")
+
+# Drop cached category lists of a shared ledger
+def invalidate_ledger_categories(ledger_id: int):
+    category_cache.invalidate_prefix(f"ledger{ledger_id}:")
+
+# Drop cached category lists affected by a category; default categories are visible to everyone
+def invalidate_categories(db_category):
+    if db_category.is_default:
+        category_cache.invalidate_all()
+    elif db_category.ledger_id is not None:
+        invalidate_ledger_categories(db_category.ledger_id)
+    else:
+        invalidate_user_categories(db_category.user_id)
+
+# Categories of a user's own data or of a shared ledger (whose rows carry the owner's user_id), plus the defaults
+def _scope_filter(user_id: int, ledger_id: int = None):
+    if ledger_id is not None:
+        owned = (Category.user_id == user_id) & (Category.ledger_id == ledger_id)
+    else:
+        owned = (Category.user_id == user_id) & Category.ledger_id.is_(None)
+    return owned | (Category.is_default == True)
 
 # Get categories by user_id
-def get_categories(db: Session, user_id: int, type: str = None):
-    query = db.query(Category).filter(
-        (Category.user_id == user_id) | (Category.is_default == True)
-    )
-    if type:
-        query = query.filter(Category.type == type)
-    return query.all()
+def get_categories(db: Session, user_id: int, type: str = None, ledger_id: int = None):
+    def load():
+        query = db.query(Category).filter(_scope_filter(user_id, ledger_id))
+        if type:
+            query = query.filter(Category.type == type)
+        return [CategorySchema.model_validate(category) for category in query.all()]
+    key = f"{user_id}:{type or ''}" if ledger_id is None else f"ledger{ledger_id}:{type or ''}"
+    return category_cache.get_or_set(key, load)
 
 # Get category by id
-def get_category(db: Session, category_id: int, user_id: int):
+def get_category(db: Session, category_id: int, user_id: int, ledger_id: int = None):
     return db.query(Category).filter(
         Category.id == category_id,
-        (Category.user_id == user_id) | (Category.is_default == True)
+        _scope_filter(user_id, ledger_id)
     ).first()
 
 # Create category
-def create_category(db: Session, category: CategoryCreate, user_id: int):
+def create_category(db: Session, category: CategoryCreate, user_id: int, ledger_id: int = None):
     db_category = Category(
         **category.model_dump(),
-        user_id=user_id
+        user_id=user_id,
+        ledger_id=ledger_id
     )
     db.add(db_category)
     db.commit()
     db.refresh(db_category)
+    invalidate_categories(db_category)
     return db_category
 
 # Update category
-def update_category(db: Session, category_id: int, category: CategoryUpdate, user_id: int):
-    db_category = get_category(db, category_id, user_id)
+def update_category(db: Session, category_id: int, category: CategoryUpdate, user_id: int, ledger_id: int = None):
+    db_category = get_category(db, category_id, user_id, ledger_id)
     if db_category and not db_category.is_default:  # Only allow update non-default categories
         update_data = category.model_dump(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_category, field, value)
         db.commit()
         db.refresh(db_category)
+        invalidate_categories(db_category)
     return db_category
 
 # Delete category
-def delete_category(db: Session, category_id: int, user_id: int):
-    db_category = get_category(db, category_id, user_id)
+def delete_category(db: Session, category_id: int, user_id: int, ledger_id: int = None):
+    db_category = get_category(db, category_id, user_id, ledger_id)
     if db_category and not db_category.is_default:  # Only allow delete non-default categories
         db.delete(db_category)
         db.commit()
+        invalidate_categories(db_category)
         return True
     return False
@@ -0,0 +1,96 @@
+from sqlalchemy.orm import Session
+from app.models.ledger import Ledger
+from app.models.group import TablePermission
+from app.models.record import Record
+from app.models.category import Category
+from app.schemas.ledger import LedgerCreate, LedgerUpdate, LedgerPermissionSet
+from app.crud.category import invalidate_ledger_categories
+from app.crud.rollup import delete_ledger_rollups
+from app.crud.recurring import delete_ledger_rules
+from app.crud.budget import delete_ledger_budgets, invalidate_budgets
+from app.crud.attachment import delete_record_attachments
+from app.crud.archive import delete_ledger_archive
+from app.utils.attachments import release_blobs
+from app.utils.acl import invalidate_acl
+
+# Get ledgers by id
+def get_ledgers(db: Session, ledger_ids):
+    return db.query(Ledger).filter(Ledger.id.in_(ledger_ids)).order_by(Ledger.id).all()
+
+# Get ledger by id
+def get_ledger(db: Session, ledger_id: int):
+    return db.query(Ledger).filter(Ledger.id == ledger_id).first()
+
+# Create ledger
+def create_ledger(db: Session, ledger: LedgerCreate, owner_id: int):
+    db_ledger = Ledger(**ledger.model_dump(), owner_id=owner_id)
+    db.add(db_ledger)
+    db.commit()
+    db.refresh(db_ledger)
+    invalidate_acl(ledger_ids=[db_ledger.id])
+    return db_ledger
+
+# Update ledger
+def update_ledger(db: Session, ledger_id: int, ledger: LedgerUpdate):
+    db_ledger = get_ledger(db, ledger_id)
+    if db_ledger:
+        update_data = ledger.model_dump(exclude_unset=True)
+        for field, value in update_data.items():
+            setattr(db_ledger, field, value)
+        db.commit()
+        db.refresh(db_ledger)
+    return db_ledger
+
+# Delete ledger with its records (archived ones too), attachments, categories, recurring rules, budgets, totals and grants; db must be bound to the owner's shard
+def delete_ledger(db: Session, ledger_id: int):
+    db_ledger = get_ledger(db, ledger_id)
+    if db_ledger is None:
+        return False
+    owner_id = db_ledger.owner_id
+    ledger_records = db.query(Record).filter(Record.user_id == owner_id, Record.ledger_id == ledger_id)
+    sha256s = delete_record_attachments(db, owner_id, ledger_records.with_entities(Record.id).scalar_subquery())
+    ledger_records.delete(synchronize_session=False)
+    delete_ledger_archive(db, owner_id, ledger_id)
+    delete_ledger_rules(db, owner_id, ledger_id)
+    delete_ledger_budgets(db, owner_id, ledger_id)
+    db.query(Category).filter(Category.user_id == owner_id, Category.ledger_id == ledger_id).delete(synchronize_session=False)
+    delete_ledger_rollups(db, owner_id, ledger_id)
+    db.query(TablePermission).filter(TablePermission.ledger_id == ledger_id).delete(synchronize_session=False)
+    db.delete(db_ledger)
+    db.commit()
+    invalidate_acl(ledger_ids=[ledger_id])
+    invalidate_ledger_categories(ledger_id)
+    invalidate_budgets(owner_id, ledger_id)
+    release_blobs(sha256s)
+    return True
+
+# Get the grants of a ledger
+def get_ledger_permissions(db: Session, ledger_id: int):
+    return db.query(TablePermission).filter(TablePermission.ledger_id == ledger_id).order_by(TablePermission.id).all()
+
+# Grant a ledger to a group, replacing the group's previous grant
+def set_ledger_permission(db: Session, ledger_id: int, permission: LedgerPermissionSet):
+    db_permission = db.query(TablePermission).filter(
+        TablePermission.ledger_id == ledger_id,
+        TablePermission.group_id == permission.group_id
+    ).first()
+    if db_permission is None:
+        db_permission = TablePermission(table_name="ledgers", ledger_id=ledger_id, group_id=permission.group_id)
+        db.add(db_permission)
+    for field, value in permission.model_dump(exclude={"group_id"}).items():
+        setattr(db_permission, field, value)
+    db.commit()
+    db.refresh(db_permission)
+    invalidate_acl(ledger_ids=[ledger_id])
+    return db_permission
+
+# Revoke a group's grant of a ledger
+def delete_ledger_permission(db: Session, ledger_id: int, group_id: int):
+    deleted = db.query(TablePermission).filter(
+        TablePermission.ledger_id == ledger_id,
+        TablePermission.group_id == group_id
+    ).delete(synchronize_session=False)
+    db.commit()
+    if deleted:
+        invalidate_acl(ledger_ids=[ledger_id])
+    return deleted > 0
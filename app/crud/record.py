@@ -1,11 +1,23 @@
+from sqlalchemy import literal
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from app.models.record import Record
+from app.models.archive import RecordArchive
 from app.schemas.record import RecordCreate, RecordUpdate
+from app.crud.rollup import add_record_delta, apply_rollup_deltas
+from app.crud.budget import check_budget_alerts
+from app.crud.attachment import delete_record_attachments
+from app.crud.archive import archive_needed, archive_column, filter_archive
+from app.utils.attachments import release_blobs
+from app.utils.search import search_words, apply_search
 
-# Get records by user_id
-def get_records(db: Session, user_id: int, skip: int = 0, limit: int = 100, start_date: datetime = None, end_date: datetime = None, type: str = None):
-    query = db.query(Record).filter(Record.user_id == user_id)
+# Records of a user's own data, or of a shared ledger (whose rows carry the owner's user_id)
+def _scope_filter(user_id: int, ledger_id: int = None):
+    return (Record.user_id == user_id) & (Record.ledger_id == ledger_id if ledger_id is not None else Record.ledger_id.is_(None))
+
+# Apply the record listing filters to a query
+def _filter_records(query, user_id: int, start_date: datetime = None, end_date: datetime = None, type: str = None, ledger_id: int = None):
+    query = query.filter(_scope_filter(user_id, ledger_id))
     
     if start_date:
         query = query.filter(Record.date >= start_date)
@@ -14,39 +26,152 @@ def get_records(db: Session, user_id: int, skip: int = 0, limit: int = 100, star
     if type:
         query = query.filter(Record.type == type)
     
+    return query
+
+# Get records by user_id; reads through to the archive when the date range reaches past its horizon
+def get_records(db: Session, user_id: int, skip: int = 0, limit: int = 100, start_date: datetime = None, end_date: datetime = None, type: str = None, ledger_id: int = None):
+    query = _filter_records(db.query(Record), user_id, start_date, end_date, type, ledger_id)
+    if not archive_needed(start_date):
+        return query.offset(skip).limit(limit).all()
+    # Page through the ids of both tables, then load the rows of the page from each
+    page = _filter_records(db.query(Record.id, literal(False)), user_id, start_date, end_date, type, ledger_id).union_all(
+        filter_archive(db.query(archive_column("id"), literal(True)), user_id, start_date, end_date, type, ledger_id)
+    ).order_by(Record.id).offset(skip).limit(limit).all()
+    hot_ids = [record_id for record_id, archived in page if not archived]
+    archived_ids = [record_id for record_id, archived in page if archived]
+    records = {db_record.id: db_record for db_record in query.filter(Record.id.in_(hot_ids))} if hot_ids else {}
+    if archived_ids:
+        archived = filter_archive(db.query(RecordArchive), user_id, ledger_id=ledger_id).filter(RecordArchive.record_id.in_(archived_ids))
+        records.update((row.record_id, _from_archive(row)) for row in archived)
+    return [records[record_id] for record_id, _ in page if record_id in records]
+
+# Archived record as a Record (detached until restored)
+def _from_archive(row):
+    return Record(
+        id=row.record_id, amount_cents=row.amount_cents, amount_value=row.amount, type=row.type, description=row.description,
+        date=row.date, user_id=row.user_id, category_id=row.category_id, ledger_id=row.ledger_id
+    )
+
+# Get records by user_id as column tuples in the given field order (no ORM objects), in id order, reading through
+# to the archive when the date range reaches past its horizon
+def get_record_rows(db: Session, fields, user_id: int, skip: int = 0, limit: int = 100, start_date: datetime = None, end_date: datetime = None, type: str = None, ledger_id: int = None):
+    fields = tuple(fields)
+    # The id orders the pages; it is selected last and dropped when not asked for
+    selected = fields if "id" in fields else fields + ("id",)
+    query = db.query(*(getattr(Record, field) for field in selected))
+    query = _filter_records(query, user_id, start_date, end_date, type, ledger_id)
+    if archive_needed(start_date):
+        archived = filter_archive(db.query(*(archive_column(field) for field in selected)), user_id, start_date, end_date, type, ledger_id)
+        query = query.union_all(archived)
+    rows = query.order_by(Record.id).offset(skip).limit(limit).all()
+    if selected is fields:
+        return rows
+    return [tuple(row)[:-1] for row in rows]
+
+# Yield batches of records by user_id as column tuples in id order, using keyset pagination;
+# archived records (when the date range reaches past the horizon) come first
+def iter_record_batches(db: Session, columns, user_id: int, start_date: datetime = None, end_date: datetime = None, type: str = None, batch_size: int = 1000, ledger_id: int = None):
+    if archive_needed(start_date):
+        archive_columns = [archive_column(column.key) for column in columns]
+        yield from _iter_batches(
+            lambda: filter_archive(db.query(RecordArchive.record_id, *archive_columns), user_id, start_date, end_date, type, ledger_id),
+            RecordArchive.record_id, batch_size
+        )
+    yield from _iter_batches(
+        lambda: _filter_records(db.query(Record.id, *columns), user_id, start_date, end_date, type, ledger_id),
+        Record.id, batch_size
+    )
+
+def _iter_batches(make_query, key, batch_size):
+    last_id = 0
+    while True:
+        batch = make_query().filter(key > last_id).order_by(key).limit(batch_size).all()
+        if not batch:
+            return
+        last_id = batch[-1][0]
+        yield batch
+
+# Count records by user_id, with the archived ones when the date range reaches past the horizon
+def count_records(db: Session, user_id: int, start_date: datetime = None, end_date: datetime = None, type: str = None, ledger_id: int = None):
+    count = _filter_records(db.query(Record), user_id, start_date, end_date, type, ledger_id).count()
+    if archive_needed(start_date):
+        count += filter_archive(db.query(RecordArchive), user_id, start_date, end_date, type, ledger_id).count()
+    return count
+
+# Search records by user_id whose description matches the words of q, best match first
+def search_records(db: Session, user_id: int, q: str, skip: int = 0, limit: int = 20, start_date: datetime = None, end_date: datetime = None, type: str = None, ledger_id: int = None):
+    words = search_words(q)
+    if not words:
+        return []
+    query = _filter_records(db.query(Record), user_id, start_date, end_date, type, ledger_id)
+    query = apply_search(query, db.get_bind(Record.__mapper__), words, user_id, ledger_id)
     return query.offset(skip).limit(limit).all()
 
 # Get record by id
-def get_record(db: Session, record_id: int, user_id: int):
-    return db.query(Record).filter(Record.id == record_id, Record.user_id == user_id).first()
+def get_record(db: Session, record_id: int, user_id: int, ledger_id: int = None):
+    return db.query(Record).filter(Record.id == record_id, _scope_filter(user_id, ledger_id)).first()
+
+# Get archived record by id, as a detached Record
+def get_archived_record(db: Session, record_id: int, user_id: int, ledger_id: int = None):
+    row = filter_archive(db.query(RecordArchive), user_id, ledger_id=ledger_id).filter(RecordArchive.record_id == record_id).first()
+    return _from_archive(row) if row is not None else None
+
+# Move an archived record back into records (with its id) so it can be changed; its totals already count it
+def restore_record(db: Session, record_id: int, user_id: int, ledger_id: int = None):
+    row = filter_archive(db.query(RecordArchive), user_id, ledger_id=ledger_id).filter(RecordArchive.record_id == record_id).first()
+    if row is None:
+        return None
+    db_record = _from_archive(row)
+    db.delete(row)
+    db.add(db_record)
+    db.flush()
+    return db_record
 
 # Create record
-def create_record(db: Session, record: RecordCreate, user_id: int):
+def create_record(db: Session, record: RecordCreate, user_id: int, ledger_id: int = None):
     db_record = Record(
         **record.model_dump(),
-        user_id=user_id
+        user_id=user_id,
+        ledger_id=ledger_id
     )
     db.add(db_record)
+    # Totals change in the same transaction as the record
+    deltas = _record_delta({}, db_record)
+    totals = apply_rollup_deltas(db, deltas)
     db.commit()
+    check_budget_alerts(db, deltas, totals)
     db.refresh(db_record)
     return db_record
 
-# Update record
-def update_record(db: Session, record_id: int, record: RecordUpdate, user_id: int):
-    db_record = get_record(db, record_id, user_id)
+# Update record; an archived one is moved back into records first
+def update_record(db: Session, record_id: int, record: RecordUpdate, user_id: int, ledger_id: int = None):
+    db_record = get_record(db, record_id, user_id, ledger_id) or restore_record(db, record_id, user_id, ledger_id)
     if db_record:
+        deltas = _record_delta({}, db_record, sign=-1)
         update_data = record.model_dump(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_record, field, value)
+        totals = apply_rollup_deltas(db, _record_delta(deltas, db_record))
         db.commit()
+        check_budget_alerts(db, deltas, totals)
         db.refresh(db_record)
     return db_record
 
-# Delete record
-def delete_record(db: Session, record_id: int, user_id: int):
-    db_record = get_record(db, record_id, user_id)
+# Delete record with its attachments; an archived one is moved back into records first
+def delete_record(db: Session, record_id: int, user_id: int, ledger_id: int = None):
+    db_record = get_record(db, record_id, user_id, ledger_id) or restore_record(db, record_id, user_id, ledger_id)
     if db_record:
+        apply_rollup_deltas(db, _record_delta({}, db_record, sign=-1))
+        sha256s = delete_record_attachments(db, user_id, [record_id])
         db.delete(db_record)
         db.commit()
+        release_blobs(sha256s)
         return True
     return False
+
+# Add a record's contribution to its totals (sign -1 removes it)
+def _record_delta(deltas, db_record, sign=1):
+    return add_record_delta(
+        deltas, db_record.user_id, db_record.ledger_id, db_record.category_id,
+        db_record.type, db_record.amount_cents, db_record.date, sign
+    )
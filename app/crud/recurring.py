@@ -0,0 +1,89 @@
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, timezone
+from app.models.recurring import RecurringRule
+from app.schemas.recurring import RecurringRuleCreate, RecurringRuleUpdate
+from app.utils.cron import CronSchedule
+import os
+
+# How far back a new rule may start, and the past occurrences it may have, since the scheduler records them all
+RECURRING_MAX_BACKFILL_DAYS = int(os.getenv("RECURRING_MAX_BACKFILL_DAYS", "366"))
+RECURRING_MAX_BACKFILL = int(os.getenv("RECURRING_MAX_BACKFILL", "1000"))
+
+# SQLite returns naive datetimes; they are stored in UTC
+def as_utc(value):
+    return value.replace(tzinfo=timezone.utc) if value is not None and value.tzinfo is None else value
+
+# Next occurrence of a rule from a moment on (inclusive), or None once past its end
+def next_run(rule, moment: datetime):
+    run = CronSchedule(rule.schedule).next_after(as_utc(moment) - timedelta(microseconds=1))
+    if run is None or (rule.end_at is not None and run > as_utc(rule.end_at)):
+        return None
+    return run
+
+# Occurrences of a schedule from start (inclusive) up to until, counting no further than limit + 1;
+# raises CronError for an invalid schedule
+def count_runs(schedule: str, start: datetime, until: datetime, limit: int):
+    cron = CronSchedule(schedule)
+    count = 0
+    run = cron.next_after(as_utc(start) - timedelta(microseconds=1))
+    while run is not None and run <= until and count <= limit:
+        count += 1
+        run = cron.next_after(run)
+    return count
+
+# Rules of a user's own data, or of a shared ledger (whose rows carry the owner's user_id)
+def _scope_filter(user_id: int, ledger_id: int = None):
+    return (RecurringRule.user_id == user_id) & (RecurringRule.ledger_id == ledger_id if ledger_id is not None else RecurringRule.ledger_id.is_(None))
+
+# Get recurring rules by user_id
+def get_rules(db: Session, user_id: int, ledger_id: int = None):
+    return db.query(RecurringRule).filter(_scope_filter(user_id, ledger_id)).order_by(RecurringRule.id).all()
+
+# Get recurring rule by id
+def get_rule(db: Session, rule_id: int, user_id: int, ledger_id: int = None):
+    return db.query(RecurringRule).filter(RecurringRule.id == rule_id, _scope_filter(user_id, ledger_id)).first()
+
+# Create recurring rule; raises CronError for an invalid schedule
+def create_rule(db: Session, rule: RecurringRuleCreate, user_id: int, ledger_id: int = None):
+    CronSchedule(rule.schedule)
+    db_rule = RecurringRule(**rule.model_dump(exclude={"start_at"}), user_id=user_id, ledger_id=ledger_id)
+    db_rule.start_at = as_utc(rule.start_at) or datetime.now(timezone.utc)
+    # A start in the past is caught up with by the scheduler
+    db_rule.next_run_at = next_run(db_rule, db_rule.start_at)
+    db.add(db_rule)
+    db.commit()
+    db.refresh(db_rule)
+    return db_rule
+
+# Update recurring rule; raises CronError for an invalid schedule
+def update_rule(db: Session, rule_id: int, rule: RecurringRuleUpdate, user_id: int, ledger_id: int = None):
+    db_rule = get_rule(db, rule_id, user_id, ledger_id)
+    if db_rule:
+        update_data = rule.model_dump(exclude_unset=True)
+        if "schedule" in update_data:
+            CronSchedule(update_data["schedule"])
+        for field, value in update_data.items():
+            setattr(db_rule, field, value)
+        if {"schedule", "end_at", "enabled"} & set(update_data):
+            # Occurrences missed under the old schedule, or while disabled, are not recorded
+            now = datetime.now(timezone.utc)
+            start = max(as_utc(db_rule.start_at), now)
+            if not {"schedule", "enabled"} & set(update_data) and db_rule.next_run_at is not None:
+                start = as_utc(db_rule.next_run_at)
+            db_rule.next_run_at = next_run(db_rule, start)
+        db.commit()
+        db.refresh(db_rule)
+    return db_rule
+
+# Delete recurring rule; records it created are kept
+def delete_rule(db: Session, rule_id: int, user_id: int, ledger_id: int = None):
+    db_rule = get_rule(db, rule_id, user_id, ledger_id)
+    if db_rule:
+        db.delete(db_rule)
+        db.commit()
+        return True
+    return False
+
+# Delete the rules of a shared ledger
+def delete_ledger_rules(db: Session, user_id: int, ledger_id: int):
+    db.query(RecurringRule).filter(RecurringRule.user_id == user_id, RecurringRule.ledger_id == ledger_id).delete(synchronize_session=False)
@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app.models.rollup import RecordRollup
+
+# Period of the all-time totals
+ALL_TIME = "all"
+
+# Record types with totals; records of other types are not counted
+ROLLUP_TYPES = ("income", "expense")
+
+# Columns holding the totals, in delta order
+ROLLUP_COLUMNS = ("income_cents", "expense_cents", "income_count", "expense_count")
+
+# Dialects whose INSERT supports ON CONFLICT DO UPDATE
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+# Month a record date falls in, YYYY-MM (UTC)
+def rollup_period(date: datetime = None):
+    if date is None:
+        date = datetime.now(timezone.utc)
+    elif date.tzinfo is not None:
+        date = date.astimezone(timezone.utc)
+    return date.strftime("%Y-%m")
+
+# Add amount (in cents) and count of records of one type, category and month to a dict of
+# bucket -> [income, expense, income count, expense count], for every bucket they count in
+def add_to_buckets(deltas, user_id: int, ledger_id, category_id: int, type: str, period: str, amount_cents: int, count: int):
+    if type not in ROLLUP_TYPES:
+        return deltas
+    total_index, count_index = (0, 2) if type == "income" else (1, 3)
+    for category in (0, category_id):
+        for bucket_period in (ALL_TIME, period):
+            delta = deltas.setdefault((user_id, ledger_id or 0, category, bucket_period), [0, 0, 0, 0])
+            delta[total_index] += amount_cents
+            delta[count_index] += count
+    return deltas
+
+# Add a record's contribution (sign 1) or removal (sign -1) to bucket deltas
+def add_record_delta(deltas, user_id: int, ledger_id, category_id: int, type: str, amount_cents: int, date: datetime = None, sign: int = 1):
+    return add_to_buckets(deltas, user_id, ledger_id, category_id, type, rollup_period(date), sign * amount_cents, sign)
+
+# Apply bucket deltas inside the caller's transaction, creating missing buckets, and count a write in the
+# version of every all-time bucket of category 0 listed, even when its totals are unchanged.
+# Returns the new totals of the changed buckets, as bucket -> [income, expense, income count, expense count]
+def apply_rollup_deltas(db: Session, deltas):
+    rows = [
+        dict(zip(("user_id", "ledger_id", "category_id", "period"), bucket), **dict(zip(ROLLUP_COLUMNS, delta)), version=1)
+        for bucket, delta in deltas.items() if any(delta) or bucket[2:] == (0, ALL_TIME)
+    ]
+    if not rows:
+        return {}
+    bucket_columns = (RecordRollup.user_id, RecordRollup.ledger_id, RecordRollup.category_id, RecordRollup.period)
+    total_columns = tuple(getattr(RecordRollup, name) for name in ROLLUP_COLUMNS)
+    insert = _UPSERT_INSERTS.get(db.get_bind(RecordRollup.__mapper__).dialect.name)
+    if insert is not None:
+        # One statement for every bucket of the change, returning the totals it produced
+        statement = insert(RecordRollup).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=["user_id", "ledger_id", "category_id", "period"],
+            set_={
+                **{name: getattr(RecordRollup, name) + getattr(statement.excluded, name) for name in ROLLUP_COLUMNS},
+                "version": func.coalesce(RecordRollup.version, 0) + 1,
+                "updated_at": func.now(),
+            }
+        ).returning(*bucket_columns, *total_columns)
+        return {tuple(row[:4]): list(row[4:]) for row in db.execute(statement)}
+    totals = {}
+    for row in rows:
+        bucket = _bucket_filter(row["user_id"], row["ledger_id"], row["category_id"], row["period"])
+        updated = db.query(RecordRollup).filter(*bucket).update(
+            {
+                **{getattr(RecordRollup, name): getattr(RecordRollup, name) + row[name] for name in ROLLUP_COLUMNS},
+                RecordRollup.version: func.coalesce(RecordRollup.version, 0) + 1,
+            },
+            synchronize_session=False
+        )
+        if not updated:
+            db.add(RecordRollup(**row))
+            db.flush()
+        totals[tuple(row[name] for name in ("user_id", "ledger_id", "category_id", "period"))] = list(
+            db.query(*total_columns).filter(*bucket).one()
+        )
+    return totals
+
+def _bucket_filter(user_id: int, ledger_id, category_id: int, period: str):
+    return (
+        RecordRollup.user_id == user_id,
+        RecordRollup.ledger_id == (ledger_id or 0),
+        RecordRollup.category_id == category_id,
+        RecordRollup.period == period,
+    )
+
+# Get the all-time and given month totals of a user, ledger or category in one query, as {period: RecordRollup}
+def get_rollups(db: Session, user_id: int, period: str, ledger_id: int = None, category_id: int = None):
+    rows = db.query(RecordRollup).filter(
+        RecordRollup.user_id == user_id,
+        RecordRollup.ledger_id == (ledger_id or 0),
+        RecordRollup.category_id == (category_id or 0),
+        RecordRollup.period.in_((ALL_TIME, period))
+    ).all()
+    return {row.period: row for row in rows}
+
+# Delete the totals of a shared ledger
+def delete_ledger_rollups(db: Session, user_id: int, ledger_id: int):
+    db.query(RecordRollup).filter(RecordRollup.user_id == user_id, RecordRollup.ledger_id == ledger_id).delete(synchronize_session=False)
+
+# Version of the records of a user (or a shared ledger): the write count and time of their all-time bucket,
+# read from the database so every worker and tool sees a write as soon as it commits
+def records_version(db: Session, user_id: int, ledger_id: int = None):
+    row = db.query(RecordRollup.version, RecordRollup.updated_at).filter(*_bucket_filter(user_id, ledger_id, 0, ALL_TIME)).first()
+    return "0" if row is None else f"{row[0] or 0}:{row[1]}"
+
+# Count a write in the records version of users (or shared ledgers) whose totals did not change
+def touch_records_versions(db: Session, scopes):
+    apply_rollup_deltas(db, {(user_id, ledger_id or 0, 0, ALL_TIME): [0, 0, 0, 0] for user_id, ledger_id in scopes})
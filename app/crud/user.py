@@ -1,8 +1,60 @@
+from collections import namedtuple
+from sqlalchemy import exists, select
 from sqlalchemy.orm import Session, joinedload
 from app.models.user import User
-from app.models.group import Group, UserGroup
-from app.schemas.user import UserCreate, UserUpdate
-from app.utils.jwt import get_password_hash
+from app.models.group import Group, UserGroup, Permission, GroupPermission
+from app.schemas.user import UserCreate, UserUpdate, User as UserSchema
+from app.utils.jwt import get_password_hash, BCRYPT_REHASHES
+from app.utils.cache import Cache
+from app.utils.database import SessionLocal
+from app.utils.fieldsets import full_tree
+import os
+
+# Authenticated users (schema objects) by username, shared by every request of a worker. Invalidation only
+# reaches other workers through a shared cache (CACHE_URL); without one, entries live PRINCIPAL_LOCAL_CACHE_TTL
+# seconds at most, so a deleted or demoted user loses their rights in every worker that soon
+principal_cache = Cache(
+    "principals",
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", "60")),
+    local_ttl=float(os.getenv("PRINCIPAL_LOCAL_CACHE_TTL", "2"))
+)
+
+# Drop cached principals; without usernames every principal is dropped (group or permission changes)
+def invalidate_principals(*usernames):
+    if not usernames:
+        principal_cache.invalidate_all()
+    for username in usernames:
+        principal_cache.invalidate(username)
+
+# Lean view of a user for permission checks: enough for can_edit_user and can_change_role
+UserAccess = namedtuple("UserAccess", ["id", "username", "groups"])
+GroupAccess = namedtuple("GroupAccess", ["name", "level", "is_admin"])
+
+# Check in one query whether a username and an email are taken; returns (username_taken, email_taken)
+def find_user_collisions(db: Session, username: str, email: str):
+    return tuple(db.execute(select(
+        exists().where(User.username == username),
+        exists().where(User.email == email)
+    )).one())
+
+# Check whether a user id exists
+def user_exists(db: Session, user_id: int):
+    return db.query(exists().where(User.id == user_id)).scalar()
+
+# Get a user's id, username and group levels in one query, without loading User objects
+def get_user_access(db: Session, user_id: int):
+    rows = db.query(User.id, User.username, Group.name, Group.level, Group.is_admin).outerjoin(
+        UserGroup, UserGroup.user_id == User.id
+    ).outerjoin(Group, Group.id == UserGroup.group_id).filter(User.id == user_id).order_by(UserGroup.id).all()
+    if not rows:
+        return None
+    groups = [GroupAccess(name, level, is_admin) for _, _, name, level, is_admin in rows if name is not None]
+    return UserAccess(rows[0][0], rows[0][1], groups)
+
+# Get groups by name in one query, keeping the requested order and skipping unknown names
+def get_groups_by_names(db: Session, names):
+    groups = {group.name: group for group in db.query(Group).filter(Group.name.in_(names))} if names else {}
+    return [groups[name] for name in names if name in groups]
 
 # Get user by username
 def get_user_by_username(db: Session, username: str):
@@ -10,6 +62,17 @@ def get_user_by_username(db: Session, username: str):
         joinedload(User.groups).joinedload(Group.permissions)
     ).first()
 
+# Get the principal of a username (schema object, groups and permissions included), cached; None for unknown users
+def get_principal(db: Session, username: str):
+    user = principal_cache.get(username)
+    if user is None:
+        db_user = get_user_by_username(db, username=username)
+        if db_user is None:
+            return None
+        user = UserSchema.model_validate(db_user)
+        principal_cache.set(username, user)
+    return user
+
 # Get user by email
 def get_user_by_email(db: Session, email: str):
     return db.query(User).filter(User.email == email).options(
@@ -22,6 +85,18 @@ def get_user_by_id(db: Session, user_id: int):
         joinedload(User.groups).joinedload(Group.permissions)
     ).first()
 
+# Re-hash a password at the current bcrypt cost, unless the password changed meanwhile
+def rehash_password(user_id: int, old_hash: str, password: str):
+    """Runs as a background task after a successful login, with its own session"""
+    new_hash = get_password_hash(password)
+    with SessionLocal() as db:
+        updated = db.query(User).filter(User.id == user_id, User.hashed_password == old_hash).update(
+            {User.hashed_password: new_hash}, synchronize_session=False
+        )
+        db.commit()
+    if updated:
+        BCRYPT_REHASHES.inc()
+
 # Create user
 def create_user(db: Session, user: UserCreate):
     # If nickname is not provided or empty, use username as default
@@ -37,42 +112,85 @@ def create_user(db: Session, user: UserCreate):
     
     # Add user to database first to get an ID
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    db.flush()
+    user_id = db_user.id
     
-    # Get existing groups
-    existing_users = db.query(User).count()
+    # Check whether anyone registered before this user, without counting every row
+    is_first_user = not db.query(exists().where(User.id != user_id)).scalar()
     
     # Determine which group(s) to assign
-    if existing_users == 1:
+    if is_first_user:
         # First user gets owner group
         owner_group = db.query(Group).filter(Group.name == "owner").first()
         if owner_group:
             # Create user-group relationship
-            user_group = UserGroup(user_id=db_user.id, group_id=owner_group.id)
+            user_group = UserGroup(user_id=user_id, group_id=owner_group.id)
             db.add(user_group)
     else:
         # All other users get user group
         user_group_obj = db.query(Group).filter(Group.name == "user").first()
         if user_group_obj:
             # Create user-group relationship
-            user_group = UserGroup(user_id=db_user.id, group_id=user_group_obj.id)
+            user_group = UserGroup(user_id=user_id, group_id=user_group_obj.id)
             db.add(user_group)
     
     # Commit changes
     db.commit()
     
-    # Refresh user to include groups
-    db.refresh(db_user)
-    return db_user
+    # Load user with groups and permissions in one query (db_user's attributes expired on commit)
+    return get_user_by_id(db, user_id)
 
 # Update user
 def update_user(db: Session, user_id: int, user: UserUpdate):
     db_user = get_user_by_id(db, user_id)
     if db_user:
+        old_username = db_user.username
         update_data = user.model_dump(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_user, field, value)
         db.commit()
         db.refresh(db_user)
+        invalidate_principals(old_username, db_user.username)
     return db_user
+
+# Get all users with groups and permissions as plain dicts shaped like the User schema.
+# A fieldset (see app.utils.fieldsets) limits the columns selected and skips unrequested relationships.
+def get_users_payload(db: Session, fieldset=None):
+    fieldset = fieldset or full_tree(UserSchema)
+    group_fieldset = fieldset.get("groups")
+    permission_fieldset = group_fieldset.get("permissions") if group_fieldset else None
+    
+    # Permissions of every group, keyed by group id
+    permissions_by_group = {}
+    if permission_fieldset is not None:
+        permission_fields = list(permission_fieldset)
+        for row in db.query(GroupPermission.group_id, *[getattr(Permission, name) for name in permission_fields]).join(
+            Permission, Permission.id == GroupPermission.permission_id
+        ).order_by(GroupPermission.id):
+            permissions_by_group.setdefault(row[0], []).append(dict(zip(permission_fields, row[1:])))
+    
+    # Groups, each shared by all of its members, and group membership keyed by user id
+    groups_by_user = {}
+    if group_fieldset is not None:
+        group_fields = [name for name in group_fieldset if name != "permissions"]
+        groups = {}
+        for row in db.query(Group.id, *[getattr(Group, name) for name in group_fields]).order_by(Group.id):
+            values = dict(zip(group_fields, row[1:]))
+            groups[row[0]] = {
+                name: permissions_by_group.get(row[0], []) if name == "permissions" else values[name]
+                for name in group_fieldset
+            }
+        for user_id, group_id in db.query(UserGroup.user_id, UserGroup.group_id).order_by(UserGroup.id):
+            if group_id in groups:
+                groups_by_user.setdefault(user_id, []).append(groups[group_id])
+    
+    # Users, with fields in schema order so the JSON matches the response model
+    user_fields = [name for name in fieldset if name != "groups"]
+    users = []
+    for row in db.query(User.id, *[getattr(User, name) for name in user_fields]).order_by(User.id):
+        values = dict(zip(user_fields, row[1:]))
+        users.append({
+            name: groups_by_user.get(row[0], []) if name == "groups" else values[name]
+            for name in fieldset
+        })
+    return users
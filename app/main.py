@@ -1,19 +1,41 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import users, categories, records, status, admin
-from app.utils.database import engine, Base, init_db
+from app.api import users, categories, records, status, admin, jobs, ledgers, recurring, budgets, events, attachments
+from app.utils.migrations import check_schema
+from app.utils.metrics import MetricsMiddleware
+from app.utils.query_inspector import QUERY_INSPECTOR_ENABLED, QueryInspectorMiddleware
+from app.utils.profiler import PROFILER_ENABLED, ProfilerMiddleware
+from app.utils.jobs import job_runner
+from app.utils.recurring import recurring_scheduler
+from app.utils.jwt import calibrate_bcrypt
+from app.utils.cache import check_worker_setup
 
-# Create all database tables
-Base.metadata.create_all(bind=engine)
+# Several workers must share one cache, or they would miss each other's invalidations and events
+check_worker_setup()
 
-# Initialize database with default groups and permissions
-init_db()
+# Tables are created and upgraded by `python -m app.utils.migrations`, run once before the workers start
+check_schema()
+
+# Start and stop background services with the app
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pick the bcrypt cost for this CPU before the first login or registration
+    calibrate_bcrypt()
+    # Resume jobs interrupted by the last shutdown
+    job_runner.recover()
+    # Record recurring occurrences due since the last run, then as they come due
+    recurring_scheduler.start()
+    yield
+    recurring_scheduler.stop()
+    job_runner.shutdown()
 
 # Create FastAPI app
 app = FastAPI(
     title="DuckPay",
     description="Where My Duck Goes?",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -25,12 +47,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Report N+1 patterns, slow queries and query budgets (development/staging only)
+if QUERY_INSPECTOR_ENABLED:
+    app.add_middleware(QueryInspectorMiddleware)
+
+# Sample stacks of requests chosen by header or sampling rate
+if PROFILER_ENABLED:
+    app.add_middleware(ProfilerMiddleware)
+
+# Record per-route latency, status and SQL statement metrics
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(users.router, prefix="/api/users", tags=["users"])
 app.include_router(categories.router, prefix="/api/categories", tags=["categories"])
 app.include_router(records.router, prefix="/api/records", tags=["records"])
+app.include_router(attachments.router, prefix="/api/records", tags=["attachments"])
 app.include_router(status.router, prefix="/api", tags=["status"])
 app.include_router(admin.router, prefix="/api", tags=["admin"])
+app.include_router(jobs.router, prefix="/api/jobs", tags=["jobs"])
+app.include_router(ledgers.router, prefix="/api/ledgers", tags=["ledgers"])
+app.include_router(recurring.router, prefix="/api/recurring", tags=["recurring"])
+app.include_router(budgets.router, prefix="/api/budgets", tags=["budgets"])
+app.include_router(events.router, prefix="/api/events", tags=["events"])
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,33 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Index, Float, cast
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.sql import func
+from app.utils.database import Base
+from app.utils.money import CENTS_PER_UNIT, from_cents
+
+# Records older than the archive horizon, moved out of records; read-only
+class RecordArchive(Base):
+    __tablename__ = "records_archive"
+    __table_args__ = (
+        # The only index besides the key: archived rows are read by user (or ledger) and date range
+        Index("ix_records_archive_scope_date", "user_id", "ledger_id", "date"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    record_id = Column(Integer, nullable=False)  # Id the record had in records, still shown as its id
+    amount_cents = Column(BigInteger, nullable=False)
+    type = Column(String, nullable=False)  # income, expense
+    description = Column(String, nullable=True)
+    date = Column(DateTime(timezone=True), index=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=False)
+    ledger_id = Column(Integer, ForeignKey("ledgers.id"), nullable=True)  # Shared ledger; user_id is then the ledger owner
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # Decimal amount, stored as integer cents
+    @hybrid_property
+    def amount(self):
+        return from_cents(self.amount_cents)
+
+    @amount.expression
+    def amount(cls):
+        return cast(cls.amount_cents, Float) / float(CENTS_PER_UNIT)
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from app.utils.database import Base
+
+class RecordAttachment(Base):
+    __tablename__ = "record_attachments"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # Owner of the record
+    record_id = Column(Integer, ForeignKey("records.id"), index=True, nullable=False)
+    sha256 = Column(String(64), index=True, nullable=False)  # Hex digest naming the stored file
+    size = Column(BigInteger, nullable=False)  # Bytes
+    content_type = Column(String, nullable=False)
+    filename = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,35 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.sql import func
+from app.utils.database import Base
+from app.utils.money import to_cents, from_cents
+
+class Budget(Base):
+    __tablename__ = "budgets"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    ledger_id = Column(Integer, ForeignKey("ledgers.id"), nullable=True)  # Shared ledger; user_id is then the ledger owner
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=True)  # None for all expenses
+    amount_cents = Column(BigInteger, nullable=False)  # Monthly limit
+    thresholds_text = Column("thresholds", String, nullable=False, default="80,100")  # Percentages of the limit that raise an alert
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    # Decimal monthly limit, stored as integer cents
+    @hybrid_property
+    def amount(self):
+        return from_cents(self.amount_cents)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_cents = to_cents(value)
+
+    # Alert thresholds as a sorted list of percentages
+    @property
+    def thresholds(self):
+        return [int(threshold) for threshold in self.thresholds_text.split(",") if threshold]
+
+    @thresholds.setter
+    def thresholds(self, values):
+        self.thresholds_text = ",".join(str(value) for value in sorted(set(values)))
@@ -12,6 +12,7 @@ class Category(Base):
     color = Column(String, nullable=True, default="#000000")
     is_default = Column(Boolean, default=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # nullable=True for default categories
+    ledger_id = Column(Integer, ForeignKey("ledgers.id"), index=True, nullable=True)  # Shared ledger; user_id is then the ledger owner
     
     # Relationships
     user = relationship("User", back_populates="categories")
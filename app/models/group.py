@@ -51,8 +51,9 @@ class TablePermission(Base):
     __tablename__ = "table_permissions"
     
     id = Column(Integer, primary_key=True, index=True)
-    table_name = Column(String, nullable=False)  # e.g., "records", "categories"
+    table_name = Column(String, nullable=False)  # e.g., "records", "categories", "ledgers"
     group_id = Column(Integer, index=True, nullable=False)
+    ledger_id = Column(Integer, ForeignKey("ledgers.id"), index=True, nullable=True)  # Shared ledger this grant applies to
     can_access = Column(Boolean, default=True)
     can_edit = Column(Boolean, default=False)
     can_add = Column(Boolean, default=False)
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from app.utils.database import Base
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("user_id", "scope", "key", name="uq_idempotency_user_scope_key"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    scope = Column(String, nullable=False)  # e.g. "records.create"
+    key = Column(String(255), nullable=False)  # Idempotency-Key header sent by the client
+    request_hash = Column(String(64), nullable=False)  # SHA-256 of the request body
+    status_code = Column(Integer, nullable=True)  # None while the first request is still running
+    response_body = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), index=True, nullable=False)
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, Float, Text, DateTime, Index
+from sqlalchemy.sql import func
+from app.utils.database import Base
+
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (Index("uq_jobs_user_slot", "user_id", "slot", unique=True),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, index=True, nullable=False)
+    kind = Column(String, nullable=False)  # e.g. "export_records"
+    params = Column(Text, nullable=False, default="{}")  # JSON
+    status = Column(String, index=True, nullable=False, default="queued")  # queued, running, succeeded, failed
+    progress = Column(Float, nullable=False, default=0.0)  # 0.0 to 1.0
+    result_path = Column(String, nullable=True)  # File produced by the job, served for download
+    error = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    slot = Column(Integer, nullable=True)  # One of the user's JOB_MAX_PER_USER slots while queued or running
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)  # Refreshed while running; stale means the worker died
+    finished_at = Column(DateTime(timezone=True), nullable=True)
@@ -1,19 +1,45 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, ForeignKey, Index, cast
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.utils.database import Base
+from app.utils.money import CENTS_PER_UNIT, to_cents, from_cents
 
 class Record(Base):
     __tablename__ = "records"
+    __table_args__ = (
+        # Listings, insights and autocomplete read a user's (or ledger's) records by date range
+        Index("ix_records_scope_date", "user_id", "ledger_id", "date"),
+        # Ids are never handed out again on SQLite either: archived records keep theirs
+        {"sqlite_autoincrement": True},
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    amount = Column(Float, nullable=False)
+    amount_cents = Column(BigInteger, nullable=True)  # Amount in cents; filled from amount for rows of older versions
+    amount_value = Column("amount", Float, nullable=False)  # Float amount of older versions, still written alongside amount_cents
     type = Column(String, nullable=False)  # income, expense
     description = Column(String, nullable=True)
     date = Column(DateTime(timezone=True), server_default=func.now())
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     category_id = Column(Integer, ForeignKey("categories.id"), nullable=False)
+    ledger_id = Column(Integer, ForeignKey("ledgers.id"), index=True, nullable=True)  # Shared ledger; user_id is then the ledger owner
     
     # Relationships
     user = relationship("User", back_populates="records")
     category = relationship("Category", back_populates="records")
+
+    # Decimal amount, stored as integer cents
+    @hybrid_property
+    def amount(self):
+        if self.amount_cents is None:
+            return self.amount_value
+        return from_cents(self.amount_cents)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_cents = to_cents(value)
+        self.amount_value = from_cents(self.amount_cents)
+
+    @amount.expression
+    def amount(cls):
+        return cast(cls.amount_cents, Float) / float(CENTS_PER_UNIT)
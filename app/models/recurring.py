@@ -0,0 +1,31 @@
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, ForeignKey
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.sql import func
+from app.utils.database import Base
+from app.utils.money import to_cents, from_cents
+
+class RecurringRule(Base):
+    __tablename__ = "recurring_rules"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    ledger_id = Column(Integer, ForeignKey("ledgers.id"), nullable=True)  # Shared ledger; user_id is then the ledger owner
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=False)
+    amount_cents = Column(BigInteger, nullable=False)
+    type = Column(String, nullable=False)  # income, expense
+    description = Column(String, nullable=True)
+    schedule = Column(String, nullable=False)  # Cron expression, UTC
+    start_at = Column(DateTime(timezone=True), nullable=False)  # No occurrence before this
+    end_at = Column(DateTime(timezone=True), nullable=True)  # No occurrence after this
+    enabled = Column(Boolean, nullable=False, default=True)
+    next_run_at = Column(DateTime(timezone=True), index=True, nullable=True)  # Next occurrence to record; None when finished
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # Decimal amount, stored as integer cents
+    @hybrid_property
+    def amount(self):
+        return from_cents(self.amount_cents)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_cents = to_cents(value)
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy.sql import func
+from app.utils.database import Base
+
+class RecordRollup(Base):
+    __tablename__ = "record_rollups"
+    __table_args__ = (
+        UniqueConstraint("user_id", "ledger_id", "category_id", "period", name="uq_record_rollups_bucket"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    ledger_id = Column(Integer, nullable=False, default=0)  # 0 for the user's own records
+    category_id = Column(Integer, nullable=False, default=0, info={"remap": "categories"})  # 0 for all categories
+    period = Column(String(7), nullable=False)  # "all" or a month, YYYY-MM
+    income_cents = Column(BigInteger, nullable=False, default=0)
+    expense_cents = Column(BigInteger, nullable=False, default=0)
+    income_count = Column(Integer, nullable=False, default=0)
+    expense_count = Column(Integer, nullable=False, default=0)
+    version = Column(Integer, nullable=True, default=1)  # Writes counted in the all-time bucket of category 0; NULL for rows of older versions
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,11 @@
+from sqlalchemy import Column, Integer, Boolean, DateTime
+from sqlalchemy.sql import func
+from app.utils.database import Base
+
+class UserShard(Base):
+    __tablename__ = "user_shards"
+    
+    user_id = Column(Integer, primary_key=True)
+    shard = Column(Integer, nullable=False)  # Index into SHARD_DATABASE_URLS
+    moving = Column(Boolean, default=False, nullable=False)  # Set while the user's data is being moved
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
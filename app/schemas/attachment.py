@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+
+# Attachment response schema; the file is at /api/records/{record_id}/attachments/{id}
+class Attachment(BaseModel):
+    id: int
+    record_id: int
+    sha256: str
+    size: int
+    content_type: str
+    filename: Optional[str] = None
+    created_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
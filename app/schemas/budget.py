@@ -0,0 +1,38 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+from app.utils.money import Amount
+
+# Budget base schema
+class BudgetBase(BaseModel):
+    category_id: Optional[int] = None  # None for all expenses
+    amount: Amount  # Monthly limit
+    thresholds: List[int] = [80, 100]  # Percentages of the limit that raise an alert
+
+# Budget create schema
+class BudgetCreate(BudgetBase):
+    pass
+
+# Budget update schema
+class BudgetUpdate(BaseModel):
+    amount: Optional[Amount] = None
+    thresholds: Optional[List[int]] = None
+
+# Budget response schema
+class Budget(BudgetBase):
+    id: int
+    amount: float  # Stored amounts are returned as they are
+    user_id: int
+    ledger_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+# Budget with this month's spending
+class BudgetStatus(Budget):
+    period: str  # Current month, YYYY-MM
+    spent: float
+    remaining: float
+    percent: float  # Spent as a percentage of the limit
+    threshold: Optional[int] = None  # Highest threshold reached this month
@@ -23,6 +23,7 @@ class CategoryUpdate(BaseModel):
 class Category(CategoryBase):
     id: int
     user_id: Optional[int] = None
+    ledger_id: Optional[int] = None
     
     class Config:
         from_attributes = True
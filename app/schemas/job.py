@@ -0,0 +1,22 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+
+# Job submit schema
+class JobCreate(BaseModel):
+    kind: str  # export_records
+    params: dict = {}
+
+# Job response schema
+class Job(BaseModel):
+    id: int
+    kind: str
+    status: str  # queued, running, succeeded, failed
+    progress: float
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
@@ -0,0 +1,54 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+
+# Ledger base schema
+class LedgerBase(BaseModel):
+    name: str
+    description: Optional[str] = None
+
+# Ledger create schema
+class LedgerCreate(LedgerBase):
+    pass
+
+# Ledger update schema
+class LedgerUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+
+# What a user may do in a ledger
+class LedgerAccess(BaseModel):
+    can_access: bool = True
+    can_edit: bool = False
+    can_add: bool = False
+    can_delete: bool = False
+    can_manage: bool = False
+    can_modify_table_info: bool = False
+    can_add_category: bool = False
+    can_delete_category: bool = False
+    can_delete_table: bool = False
+
+# Ledger response schema, with the current user's access
+class Ledger(LedgerBase):
+    id: int
+    owner_id: int
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    access: Optional[LedgerAccess] = None
+    
+    class Config:
+        from_attributes = True
+
+# Grant of a ledger to a group
+class LedgerPermissionSet(LedgerAccess):
+    group_id: int
+
+# Ledger grant response schema
+class LedgerPermission(LedgerPermissionSet):
+    id: int
+    ledger_id: int
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
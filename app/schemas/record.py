@@ -1,10 +1,11 @@
 from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional
+from datetime import date as Date, datetime
+from typing import List, Optional
+from app.utils.money import Amount
 
 # Record base schema
 class RecordBase(BaseModel):
-    amount: float
+    amount: Amount
     type: str  # income, expense
     description: Optional[str] = None
     category_id: int
@@ -16,7 +17,8 @@ class RecordCreate(RecordBase):
 
 # Record update schema
 class RecordUpdate(BaseModel):
-    amount: Optional[float] = None
+    amount: Optional[Amount] = None
+    type: Optional[str] = None  # income, expense
     description: Optional[str] = None
     category_id: Optional[int] = None
     date: Optional[datetime] = None
@@ -24,12 +26,70 @@ class RecordUpdate(BaseModel):
 # Record response schema
 class Record(RecordBase):
     id: int
+    amount: float  # Stored amounts are returned as they are
     user_id: int
+    ledger_id: Optional[int] = None
     date: datetime
     
     class Config:
         from_attributes = True
 
+# Income and expense totals of a set of records
+class RecordTotals(BaseModel):
+    income: float = 0.0
+    expense: float = 0.0
+    income_count: int = 0
+    expense_count: int = 0
+    balance: float = 0.0
+
+# Balance response schema: all-time totals and those of the current month
+class Balance(BaseModel):
+    ledger_id: Optional[int] = None
+    category_id: Optional[int] = None
+    period: str  # Current month, YYYY-MM
+    total: RecordTotals
+    month: RecordTotals
+
+# Daily total of a record type with its trailing 7 and 30 day averages
+class InsightDay(BaseModel):
+    date: Date
+    total: float
+    avg_7: float
+    avg_30: float
+
+# Totals of a category in the current and the previous month
+class CategoryTrend(BaseModel):
+    category_id: int
+    month_total: float
+    previous_total: float
+    delta: float
+    change: Optional[float] = None  # delta / previous_total, None when there was nothing last month
+
+# Record far above the usual amounts of its category
+class RecordAnomaly(BaseModel):
+    id: int
+    date: datetime
+    amount: float
+    category_id: int
+    score: float  # Standard deviations above the category's other records (log amounts)
+
+# Insights response schema: trends, month-over-month changes and unusual records of one type
+class RecordInsights(BaseModel):
+    type: str
+    ledger_id: Optional[int] = None
+    days: int
+    month: str  # Current month, YYYY-MM
+    previous_month: str
+    daily: List[InsightDay]
+    categories: List[CategoryTrend]
+    anomalies: List[RecordAnomaly]
+
+# Description suggested for a prefix, with the categories it is usually filed under
+class DescriptionSuggestion(BaseModel):
+    description: str
+    count: int  # Records with this description in the recent history
+    category_ids: List[int]  # Most used first
+
 # Record with category details
 class RecordWithCategory(Record):
     category: dict  # Will include category details
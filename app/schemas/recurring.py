@@ -0,0 +1,42 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+from app.utils.money import Amount
+
+# Recurring rule base schema
+class RecurringRuleBase(BaseModel):
+    amount: Amount
+    type: str  # income, expense
+    description: Optional[str] = None
+    category_id: int
+    schedule: str  # Cron expression in UTC, e.g. "0 9 1 * *" for 09:00 on the 1st of every month
+    start_at: Optional[datetime] = None  # Defaults to now
+    end_at: Optional[datetime] = None
+    enabled: bool = True
+
+# Recurring rule create schema
+class RecurringRuleCreate(RecurringRuleBase):
+    pass
+
+# Recurring rule update schema
+class RecurringRuleUpdate(BaseModel):
+    amount: Optional[Amount] = None
+    type: Optional[str] = None
+    description: Optional[str] = None
+    category_id: Optional[int] = None
+    schedule: Optional[str] = None
+    end_at: Optional[datetime] = None
+    enabled: Optional[bool] = None
+
+# Recurring rule response schema
+class RecurringRule(RecurringRuleBase):
+    id: int
+    amount: float  # Stored amounts are returned as they are
+    user_id: int
+    ledger_id: Optional[int] = None
+    start_at: datetime
+    next_run_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
@@ -0,0 +1,246 @@
+"""Access control for shared ledgers.
+
+A ledger's owner may do everything in it. Other users get what the
+``table_permissions`` rows of the ledger grant to their groups, combined
+over all of their groups. Rather than joining user_groups and
+table_permissions on every request, every worker keeps an index of the
+effective access of each (user, ledger), so a check is two dict lookups.
+
+Anything that changes ledgers, grants or group membership calls
+``invalidate_acl()`` with the ledgers or users it touched, which tells
+every worker (over the cache's publish channel) to reload the access of
+just those before the next check. The index is also rebuilt in full after
+``ACL_INDEX_TTL`` seconds in case a message was lost.
+
+The publish channel only reaches other workers through a shared cache
+(``CACHE_URL``); running several workers without one is refused at startup.
+"""
+from collections import namedtuple
+from functools import lru_cache
+from typing import Optional
+from fastapi import Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from app.models.group import TablePermission, UserGroup
+from app.models.ledger import Ledger
+from app.utils.auth import get_current_user
+from app.utils.cache import publish, subscribe
+from app.utils.database import SessionLocal, get_db, get_read_db
+from app.utils.metrics import Counter
+from app.utils.query_inspector import current_query_tracker
+from app.utils.shards import bind_user_shard
+import os
+import threading
+import time
+
+# Load environment variables
+load_dotenv()
+
+# Longest time an index is used without a rebuild, should an invalidation message be lost
+ACL_INDEX_TTL = float(os.getenv("ACL_INDEX_TTL", "60"))
+
+# Flags of a ledger grant, as on TablePermission
+LEDGER_FLAGS = (
+    "can_access", "can_edit", "can_add", "can_delete", "can_manage",
+    "can_modify_table_info", "can_add_category", "can_delete_category", "can_delete_table"
+)
+
+# Effective access of a user to a ledger
+LedgerAccess = namedtuple("LedgerAccess", ("ledger_id", "owner_id") + LEDGER_FLAGS)
+
+# Ledger whose records and categories a request works on; ledger_id None means the user's own
+LedgerScope = namedtuple("LedgerScope", ["owner_id", "ledger_id"])
+
+ACL_REBUILDS = Counter(
+    "duckpay_acl_index_rebuilds_total", "Rebuilds of the ledger access index in this worker: full, or ledgers and users reloaded", ("scope",)
+)
+
+_CHANNEL = "acl"
+
+# Effective access by user and ledger from ledger owners ({ledger_id: owner_id}) and grant rows
+# (ledger_id, user_id, *flags); grants to several groups of a user combine
+def _combine(owners, grants):
+    by_user = {}
+    for ledger_id, owner_id in owners.items():
+        by_user.setdefault(owner_id, {})[ledger_id] = LedgerAccess(ledger_id, owner_id, *(True,) * len(LEDGER_FLAGS))
+    for ledger_id, user_id, *flags in grants:
+        if ledger_id not in owners:
+            continue
+        ledgers = by_user.setdefault(user_id, {})
+        current = ledgers.get(ledger_id)
+        flags = [bool(flag) for flag in flags]
+        if current is not None:
+            flags = [old or new for old, new in zip(current[2:], flags)]
+        ledgers[ledger_id] = LedgerAccess(ledger_id, owners[ledger_id], *flags)
+    return by_user
+
+def _grants(db: Session):
+    return db.query(
+        TablePermission.ledger_id, UserGroup.user_id, *(getattr(TablePermission, flag) for flag in LEDGER_FLAGS)
+    ).join(UserGroup, UserGroup.group_id == TablePermission.group_id).filter(TablePermission.ledger_id.isnot(None))
+
+class ACLIndex:
+    """Effective ledger access by user and ledger.
+
+    An invalidation naming ledgers or users marks just those stale; the next check
+    reloads their rows only. Anything else (or ACL_INDEX_TTL passing) rebuilds the index.
+    Entries are replaced, never changed in place, so checks read without locking."""
+
+    def __init__(self, ttl=ACL_INDEX_TTL):
+        self.ttl = ttl
+        self._by_user = {}
+        self._users_by_ledger = {}
+        self._generation = 0
+        self._built_generation = -1
+        self._built_at = 0.0
+        self._stale_ledgers = set()
+        self._stale_users = set()
+        self._lock = threading.Lock()
+        self._generation_lock = threading.Lock()
+
+    def invalidate(self, message=None):
+        with self._generation_lock:
+            if isinstance(message, dict):
+                self._stale_ledgers.update(message.get("ledgers", ()))
+                self._stale_users.update(message.get("users", ()))
+            else:
+                self._generation += 1
+
+    def _stale(self):
+        return self._built_generation != self._generation or time.monotonic() - self._built_at > self.ttl
+
+    def _build(self):
+        with self._generation_lock:
+            generation = self._generation
+            self._stale_ledgers.clear()
+            self._stale_users.clear()
+        with SessionLocal() as db:
+            by_user = _combine(dict(db.query(Ledger.id, Ledger.owner_id).all()), _grants(db))
+        users_by_ledger = {}
+        for user_id, ledgers in by_user.items():
+            for ledger_id in ledgers:
+                users_by_ledger.setdefault(ledger_id, set()).add(user_id)
+        self._by_user = by_user
+        self._users_by_ledger = users_by_ledger
+        self._built_generation = generation
+        self._built_at = time.monotonic()
+        ACL_REBUILDS.inc("full")
+
+    # Replace the entries of one user
+    def _set_user(self, user_id, ledgers):
+        for ledger_id in self._by_user.get(user_id, {}):
+            self._users_by_ledger.get(ledger_id, set()).discard(user_id)
+        for ledger_id in ledgers:
+            self._users_by_ledger.setdefault(ledger_id, set()).add(user_id)
+        if ledgers:
+            self._by_user[user_id] = ledgers
+        else:
+            self._by_user.pop(user_id, None)
+
+    def _refresh(self, ledger_ids, user_ids):
+        with SessionLocal() as db:
+            if ledger_ids:
+                owners = dict(db.query(Ledger.id, Ledger.owner_id).filter(Ledger.id.in_(ledger_ids)))
+                by_ledger = {}
+                for user_id, ledgers in _combine(owners, _grants(db).filter(TablePermission.ledger_id.in_(ledger_ids))).items():
+                    for ledger_id, access in ledgers.items():
+                        by_ledger.setdefault(ledger_id, {})[user_id] = access
+                for ledger_id in ledger_ids:
+                    granted = by_ledger.get(ledger_id, {})
+                    for user_id in self._users_by_ledger.get(ledger_id, set()) | set(granted):
+                        ledgers = dict(self._by_user.get(user_id, {}))
+                        ledgers.pop(ledger_id, None)
+                        if user_id in granted:
+                            ledgers[ledger_id] = granted[user_id]
+                        self._set_user(user_id, ledgers)
+                ACL_REBUILDS.inc("ledger", amount=len(ledger_ids))
+            if user_ids:
+                grants = _grants(db).filter(UserGroup.user_id.in_(user_ids)).all()
+                owners = dict(db.query(Ledger.id, Ledger.owner_id).filter(
+                    Ledger.owner_id.in_(user_ids) | Ledger.id.in_({grant[0] for grant in grants})
+                ))
+                by_user = _combine(owners, grants)
+                for user_id in user_ids:
+                    self._set_user(user_id, by_user.get(user_id, {}))
+                ACL_REBUILDS.inc("user", amount=len(user_ids))
+
+    def _current(self):
+        if self._stale() or self._stale_ledgers or self._stale_users:
+            with self._lock:
+                # Index maintenance is not part of the request's query budget
+                token = current_query_tracker.set(None)
+                try:
+                    if self._stale():
+                        self._build()
+                    else:
+                        with self._generation_lock:
+                            ledger_ids, self._stale_ledgers = self._stale_ledgers, set()
+                            user_ids, self._stale_users = self._stale_users, set()
+                        if ledger_ids or user_ids:
+                            self._refresh(ledger_ids, user_ids)
+                finally:
+                    current_query_tracker.reset(token)
+        return self._by_user
+
+    def access(self, user_id: int, ledger_id: int) -> Optional[LedgerAccess]:
+        """Access of a user to a ledger, or None when they have none"""
+        return self._current().get(user_id, {}).get(ledger_id)
+
+    def ledgers(self, user_id: int):
+        """Access of a user to every ledger they can see, by ledger id"""
+        return dict(self._current().get(user_id, {}))
+
+acl_index = ACLIndex()
+subscribe(_CHANNEL, acl_index.invalidate)
+
+# Make every worker reload the access of the given ledgers and users before its next check;
+# with neither, the whole index is rebuilt
+def invalidate_acl(ledger_ids=None, user_ids=None):
+    if ledger_ids is None and user_ids is None:
+        message = "invalidate"
+    else:
+        message = {"ledgers": list(ledger_ids or ()), "users": list(user_ids or ())}
+    acl_index.invalidate(message)
+    publish(_CHANNEL, message)
+
+# Access of a user to a ledger; 404 when they cannot see it, 403 when the flag is not granted
+def require_ledger_access(user_id: int, ledger_id: int, flag="can_access"):
+    access = acl_index.access(user_id, ledger_id)
+    if access is None or not access.can_access:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ledger not found"
+        )
+    if not getattr(access, flag):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Insufficient permissions"
+        )
+    return access
+
+# Dependency resolving the ledger_id query parameter to the ledger to work on, requiring a flag
+@lru_cache(maxsize=None)
+def ledger_scope(flag="can_access"):
+    def dependency(
+        ledger_id: Optional[int] = Query(None, description="Shared ledger to work in; omit for your own data"),
+        current_user = Depends(get_current_user)
+    ):
+        if ledger_id is None:
+            return LedgerScope(current_user.id, None)
+        access = require_ledger_access(current_user.id, ledger_id, flag)
+        return LedgerScope(access.owner_id, ledger_id)
+    return dependency
+
+# Dependency to get a DB session bound to the shard of the requested ledger's owner
+@lru_cache(maxsize=None)
+def get_ledger_db(flag="can_access"):
+    def dependency(scope: LedgerScope = Depends(ledger_scope(flag)), db: Session = Depends(get_db)):
+        return bind_user_shard(db, scope.owner_id)
+    return dependency
+
+# Dependency to get a read-only DB session bound to the shard of the requested ledger's owner
+@lru_cache(maxsize=None)
+def get_ledger_read_db(flag="can_access"):
+    def dependency(scope: LedgerScope = Depends(ledger_scope(flag)), db: Session = Depends(get_read_db)):
+        return bind_user_shard(db, scope.owner_id)
+    return dependency
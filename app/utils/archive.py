@@ -0,0 +1,164 @@
+"""Moves old records out of ``records`` into ``records_archive``.
+
+Records dated more than ``ARCHIVE_AFTER_DAYS`` ago are copied to the
+archive and deleted from ``records`` in batches of ``ARCHIVE_BATCH_SIZE``,
+each in one transaction, so the hot table (and its indexes, the search
+index included) holds only recent records:
+
+    python -m app.utils.archive run
+    python -m app.utils.archive status
+
+Admins can run it in the background as the ``archive_records`` job.
+``records_archive`` is sharded like ``records``; listings and exports read
+through to it when their date range starts before the horizon, or has no
+start. Archived records keep their id (record ids are never reused, with
+AUTOINCREMENT on SQLite), and search, insights and autocomplete leave them
+out. Updating or deleting an archived record moves it back into
+``records`` first; a later run archives it again if it is still old. The
+totals in ``record_rollups`` are not touched: they already count the
+archived records, and the rollup check counts them too.
+
+Records with attachments stay in ``records``. After the horizon is
+raised, the next run moves records that are newer than it back into
+``records``. Moving a user to another shard restores their archived
+records first, so they get new ids on the target like the rest, and
+archives them again there.
+"""
+from sqlalchemy import select, insert, delete, exists, func, Float, cast
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from app.utils.database import engine, shard_engines
+from app.utils.jobs import job_handler
+from app.utils.money import CENTS_PER_UNIT
+from app.crud.archive import ARCHIVE_AFTER_DAYS, archive_cutoff
+from app.crud.rollup import touch_records_versions
+from app.models.archive import RecordArchive
+from app.models.attachment import RecordAttachment
+from app.models.record import Record
+import argparse
+import json
+import os
+
+# Load environment variables
+load_dotenv()
+
+# Records moved per transaction
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+
+# Columns copied between the two tables, by name in records and in records_archive
+_COPIED = ("type", "description", "date", "user_id", "category_id", "ledger_id")
+
+# Engines holding records: every shard, or the main database when sharding is off
+def _engines():
+    return list(shard_engines) or [engine]
+
+# Move archived records dated at or after the cutoff (all of them without one) back into records, of every
+# user or one; returns the records restored
+def _restore(data_engine, cutoff, batch_size, user_id: int = None):
+    candidates = select(RecordArchive.id, RecordArchive.user_id, RecordArchive.ledger_id).order_by(RecordArchive.id).limit(batch_size)
+    if cutoff is not None:
+        candidates = candidates.where(RecordArchive.date >= cutoff)
+    if user_id is not None:
+        candidates = candidates.where(RecordArchive.user_id == user_id)
+    restored = 0
+    while True:
+        with data_engine.begin() as conn:
+            rows = conn.execute(candidates).all()
+            if not rows:
+                return restored
+            ids = [row[0] for row in rows]
+            conn.execute(insert(Record).from_select(
+                ["id", "amount_cents", "amount", *_COPIED],
+                select(
+                    RecordArchive.record_id, RecordArchive.amount_cents,
+                    cast(RecordArchive.amount_cents, Float) / float(CENTS_PER_UNIT),
+                    *(getattr(RecordArchive, name) for name in _COPIED)
+                ).where(RecordArchive.id.in_(ids))
+            ))
+            conn.execute(delete(RecordArchive).where(RecordArchive.id.in_(ids)))
+            _touch(conn, rows)
+        restored += len(rows)
+
+# Move records dated before the cutoff into the archive, of every user or one; returns the records archived
+def _archive(data_engine, cutoff, batch_size, user_id: int = None):
+    archived = 0
+    candidates = select(Record.id, Record.user_id, Record.ledger_id).where(
+        Record.date < cutoff,
+        ~exists().where(RecordAttachment.record_id == Record.id)
+    ).order_by(Record.id).limit(batch_size)
+    if user_id is not None:
+        candidates = candidates.where(Record.user_id == user_id)
+    while True:
+        with data_engine.begin() as conn:
+            rows = conn.execute(candidates).all()
+            if not rows:
+                return archived
+            ids = [row[0] for row in rows]
+            conn.execute(insert(RecordArchive).from_select(
+                ["record_id", "amount_cents", *_COPIED],
+                select(Record.id, Record.amount_cents, *(getattr(Record, name) for name in _COPIED)).where(Record.id.in_(ids))
+            ))
+            conn.execute(delete(Record).where(Record.id.in_(ids)))
+            _touch(conn, rows)
+        archived += len(rows)
+
+# Give the records of the users (or shared ledgers) of moved rows a new version, in the batch's transaction
+def _touch(conn, rows):
+    with Session(bind=conn) as db:
+        touch_records_versions(db, {(row[1], row[2]) for row in rows})
+        db.commit()
+
+def run_archive(cutoff=None, batch_size: int = ARCHIVE_BATCH_SIZE):
+    """Bring every shard in line with the horizon; returns (records archived, records restored)"""
+    cutoff = cutoff or archive_cutoff()
+    archived = restored = 0
+    for data_engine in _engines():
+        restored += _restore(data_engine, cutoff, batch_size)
+        archived += _archive(data_engine, cutoff, batch_size)
+    return archived, restored
+
+def restore_user(data_engine, user_id: int):
+    """Move every archived record of a user on one engine back into records; returns the records restored.
+
+    The shard mover calls this before copying a user, so archived records get new ids on the target
+    along with the others."""
+    return _restore(data_engine, None, ARCHIVE_BATCH_SIZE, user_id)
+
+def archive_user(data_engine, user_id: int):
+    """Move a user's records past the horizon on one engine into the archive; returns the records archived"""
+    return _archive(data_engine, archive_cutoff(), ARCHIVE_BATCH_SIZE, user_id)
+
+def archive_status():
+    """Records in records and in records_archive, over every shard, and the current cutoff"""
+    hot = cold = 0
+    for data_engine in _engines():
+        with data_engine.connect() as conn:
+            hot += conn.execute(select(func.count()).select_from(Record)).scalar()
+            cold += conn.execute(select(func.count()).select_from(RecordArchive)).scalar()
+    return {"records": hot, "archived": cold, "cutoff": archive_cutoff().isoformat()}
+
+@job_handler("archive_records", admin_only=True)
+def archive_records_job(context):
+    """Move the records past the horizon into the archive"""
+    archived, restored = run_archive()
+    context.progress(1.0)
+    with open(context.result_file(".json"), "w", encoding="utf-8") as f:
+        json.dump({"archived": archived, "restored": restored}, f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old records into the archive")
+    parser.add_argument("command", choices=["run", "status"])
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="records moved per transaction")
+    args = parser.parse_args()
+
+    from app.utils.migrations import check_schema
+    check_schema()
+    if args.command == "status":
+        status = archive_status()
+        print(f"{status['records']} record(s), {status['archived']} archived; horizon {ARCHIVE_AFTER_DAYS} days (before {status['cutoff']})")
+        return
+    archived, restored = run_archive(batch_size=args.batch_size)
+    print(f"Archived {archived} record(s), restored {restored}")
+
+if __name__ == "__main__":
+    main()
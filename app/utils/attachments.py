@@ -0,0 +1,171 @@
+"""Content-addressed store for record attachments (receipts).
+
+Uploads are streamed to a temporary file in chunks, hashed with SHA-256 as
+they arrive, then renamed to ``objects/<ab>/<sha256>`` under
+``ATTACHMENTS_DIR``: identical files are stored once, however many records
+or users attach them, and nothing is held in memory but the current chunk.
+Stored files never change, so they are served with their hash as ETag and
+cached for good; FileResponse answers Range requests and hands the file to
+the server to send (``http.response.pathsend``) when the server supports it.
+
+A file is deleted once no attachment row on any shard refers to it. Uploads
+of content already stored touch the file first, and files touched within
+``ATTACHMENT_GRACE_SECONDS`` are kept, so a delete racing an upload of the
+same receipt leaves it in place. ``python -m app.utils.attachments sweep``
+removes what is left behind: files released during their grace period and
+temporary files of interrupted uploads.
+"""
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+from app.utils.database import engine, shard_engines
+from app.models.attachment import RecordAttachment
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+# Load environment variables
+load_dotenv()
+
+# Directory holding the stored files
+ATTACHMENTS_DIR = os.getenv("ATTACHMENTS_DIR", "./attachments")
+
+# Largest upload accepted, in bytes
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# Attachments allowed per record
+ATTACHMENTS_PER_RECORD = int(os.getenv("ATTACHMENTS_PER_RECORD", "10"))
+
+# Content types accepted (served back as stored, with nosniff)
+ATTACHMENT_TYPES = frozenset(
+    content_type.strip() for content_type in
+    os.getenv("ATTACHMENT_TYPES", "image/jpeg,image/png,image/webp,image/heic,application/pdf").split(",")
+    if content_type.strip()
+)
+
+# Seconds an unreferenced file is kept after it was last stored
+ATTACHMENT_GRACE_SECONDS = float(os.getenv("ATTACHMENT_GRACE_SECONDS", "3600"))
+
+# sha256 values looked up per query when sweeping
+SWEEP_BATCH_SIZE = 500
+
+_OBJECTS_DIR = os.path.join(ATTACHMENTS_DIR, "objects")
+_TMP_DIR = os.path.join(ATTACHMENTS_DIR, "tmp")
+
+class AttachmentTooLarge(Exception):
+    """An upload over ATTACHMENT_MAX_BYTES"""
+
+class EmptyAttachment(Exception):
+    """An upload without content"""
+
+# Engines holding attachment rows: every shard, or the main database when sharding is off
+def _engines():
+    return list(shard_engines) or [engine]
+
+# Path of the stored file with a given hex digest
+def blob_path(sha256: str):
+    return os.path.join(_OBJECTS_DIR, sha256[:2], sha256)
+
+def _write(file, digest, chunk):
+    digest.update(chunk)
+    file.write(chunk)
+
+def _finish(file, temp_path, sha256):
+    file.flush()
+    os.fsync(file.fileno())
+    file.close()
+    path = blob_path(sha256)
+    try:
+        # Already stored: keep the existing file, marked as just used
+        os.utime(path)
+        os.remove(temp_path)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+
+async def store_stream(chunks, max_bytes: int = ATTACHMENT_MAX_BYTES):
+    """Store the bytes of an async iterator of chunks; returns (sha256, size).
+
+    Raises AttachmentTooLarge past max_bytes and EmptyAttachment without content, leaving nothing behind."""
+    os.makedirs(_TMP_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=_TMP_DIR)
+    file = os.fdopen(fd, "wb")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            size += len(chunk)
+            if size > max_bytes:
+                raise AttachmentTooLarge()
+            await run_in_threadpool(_write, file, digest, chunk)
+        if size == 0:
+            raise EmptyAttachment()
+        sha256 = digest.hexdigest()
+        await run_in_threadpool(_finish, file, temp_path, sha256)
+    except BaseException:
+        file.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return sha256, size
+
+# Digests among sha256s that an attachment row on any shard refers to
+def referenced(sha256s):
+    sha256s = list(sha256s)
+    found = set()
+    for data_engine in _engines():
+        with data_engine.connect() as conn:
+            for start in range(0, len(sha256s), SWEEP_BATCH_SIZE):
+                batch = sha256s[start:start + SWEEP_BATCH_SIZE]
+                found.update(conn.execute(
+                    select(RecordAttachment.sha256).where(RecordAttachment.sha256.in_(batch)).distinct()
+                ).scalars())
+    return found
+
+def _remove_if_stale(path, grace_seconds):
+    try:
+        if os.stat(path).st_mtime <= time.time() - grace_seconds:
+            os.remove(path)
+            return True
+    except FileNotFoundError:
+        pass
+    return False
+
+def release_blobs(sha256s, grace_seconds: float = ATTACHMENT_GRACE_SECONDS):
+    """Delete the stored files of digests no attachment refers to any more; call after the rows' deletion commits"""
+    sha256s = set(sha256s)
+    if not sha256s:
+        return 0
+    return sum(_remove_if_stale(blob_path(sha256), grace_seconds) for sha256 in sha256s - referenced(sha256s))
+
+def sweep(grace_seconds: float = ATTACHMENT_GRACE_SECONDS):
+    """Delete unreferenced stored files and abandoned temporary files; returns (files, temporary files) deleted"""
+    stored = []
+    for root, _, names in os.walk(_OBJECTS_DIR):
+        stored.extend(names)
+    removed = 0
+    for start in range(0, len(stored), SWEEP_BATCH_SIZE):
+        removed += release_blobs(stored[start:start + SWEEP_BATCH_SIZE], grace_seconds)
+    temporary = 0
+    if os.path.isdir(_TMP_DIR):
+        temporary = sum(_remove_if_stale(os.path.join(_TMP_DIR, name), grace_seconds) for name in os.listdir(_TMP_DIR))
+    return removed, temporary
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the attachment store")
+    parser.add_argument("command", choices=["sweep"])
+    parser.add_argument("--grace-seconds", type=float, default=ATTACHMENT_GRACE_SECONDS, help="keep files stored more recently than this")
+    args = parser.parse_args()
+
+    from app.utils.migrations import check_schema
+    check_schema()
+    removed, temporary = sweep(args.grace_seconds)
+    print(f"Deleted {removed} unreferenced file(s) and {temporary} abandoned upload(s)")
+
+if __name__ == "__main__":
+    main()
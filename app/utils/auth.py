@@ -4,8 +4,8 @@ from jose import JWTError
 from sqlalchemy.orm import Session
 from app.utils.database import get_db
 from app.utils.jwt import decode_access_token
-from app.crud.user import get_user_by_username
-from app.schemas.user import TokenData
+from app.crud.user import get_principal
+from app.schemas.user import TokenData, User as UserSchema
 
 # OAuth2 scheme for token authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/login")
@@ -30,8 +30,10 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
 		raise credentials_exception
     
 	token_data = TokenData(username=username, user_id=user_id, groups=groups)
-	user = get_user_by_username(db, username=token_data.username)
-    
+	
+	# Principals are cached as schema objects (groups and permissions included)
+	# and invalidated whenever a user, group or group permission changes
+	user = get_principal(db, token_data.username)
 	if user is None:
 		raise credentials_exception
     
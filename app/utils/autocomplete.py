@@ -0,0 +1,125 @@
+"""Description autocomplete from an in-memory index of recent records.
+
+The index of a user (or shared ledger) is built with one grouped query over
+the described records of the last ``AUTOCOMPLETE_HISTORY_DAYS`` days: each
+distinct description (compared case-insensitively) with how often it was
+used, when it was last used, and the categories it was filed under.
+
+Every word start of a description is a key in a sorted list, so a prefix
+lookup is a binary search; matches are ranked by frequency, then recency,
+descriptions that begin with the prefix first. Indexes are kept per worker
+(the least recently used are dropped beyond ``AUTOCOMPLETE_MAX_INDEXES``)
+and rebuilt on the next lookup after the records change.
+"""
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from app.crud.archive import ARCHIVE_AFTER_DAYS
+from app.crud.rollup import records_version
+from app.models.record import Record
+from app.utils.cache import LRUBackend, MISSING
+import heapq
+import os
+import re
+
+# Load environment variables
+load_dotenv()
+
+# Days of records suggestions are drawn from
+AUTOCOMPLETE_HISTORY_DAYS = int(os.getenv("AUTOCOMPLETE_HISTORY_DAYS", "365"))
+# Only the records table is read, so the history must end before the archive horizon
+if AUTOCOMPLETE_HISTORY_DAYS >= ARCHIVE_AFTER_DAYS:
+    raise ValueError(
+        f"AUTOCOMPLETE_HISTORY_DAYS ({AUTOCOMPLETE_HISTORY_DAYS}) must be below ARCHIVE_AFTER_DAYS ({ARCHIVE_AFTER_DAYS}), "
+        "since archived records are not read"
+    )
+
+# Users (or shared ledgers) whose index a worker keeps
+AUTOCOMPLETE_MAX_INDEXES = int(os.getenv("AUTOCOMPLETE_MAX_INDEXES", "1000"))
+
+# Categories suggested per description, most used first
+MAX_SUGGESTED_CATEGORIES = 3
+
+_indexes = LRUBackend(maxsize=AUTOCOMPLETE_MAX_INDEXES)
+
+# Case-insensitive form of a description, with runs of whitespace collapsed
+def normalize(text: str):
+    return " ".join(text.casefold().split())
+
+class SuggestionIndex:
+    """Distinct descriptions with their use counts and categories, searchable by word prefix"""
+
+    def __init__(self, rows):
+        phrases = {}
+        for description, category_id, count, last_used in rows:
+            key = normalize(description)
+            if not key:
+                continue
+            phrase = phrases.setdefault(key, {"variants": Counter(), "count": 0, "last_used": last_used, "categories": Counter()})
+            phrase["variants"][description.strip()] += count
+            phrase["count"] += count
+            phrase["categories"][category_id] += count
+            if last_used is not None and (phrase["last_used"] is None or last_used > phrase["last_used"]):
+                phrase["last_used"] = last_used
+        # Shown as most often written; ranked by use, then by last use
+        self.phrases = [
+            (
+                phrase["variants"].most_common(1)[0][0], phrase["count"],
+                phrase["last_used"].timestamp() if phrase["last_used"] is not None else 0.0,
+                [category_id for category_id, _ in phrase["categories"].most_common(MAX_SUGGESTED_CATEGORIES)],
+            )
+            for phrase in phrases.values()
+        ]
+        # (text from a word start on, phrase, whether that word is the first)
+        keys = []
+        for index, key in enumerate(phrases):
+            for match in re.finditer(r"\w+", key):
+                keys.append((key[match.start():], index, match.start() == 0))
+        keys.sort()
+        self._keys = [key for key, _, _ in keys]
+        self._phrase_ids = [index for _, index, _ in keys]
+        self._leading = [leading for _, _, leading in keys]
+
+    def suggest(self, prefix: str, limit: int = 10):
+        """Descriptions with a word starting with prefix, as (description, count, category ids)"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        start = bisect_left(self._keys, prefix)
+        matches = {}
+        for position in range(start, len(self._keys)):
+            if not self._keys[position].startswith(prefix):
+                break
+            # Descriptions beginning with the prefix rank above those matching a later word
+            phrase_id = self._phrase_ids[position]
+            matches[phrase_id] = matches.get(phrase_id, False) or self._leading[position]
+        best = heapq.nlargest(
+            limit, matches,
+            key=lambda phrase_id: (matches[phrase_id], self.phrases[phrase_id][1], self.phrases[phrase_id][2])
+        )
+        return [(self.phrases[phrase_id][0], self.phrases[phrase_id][1], self.phrases[phrase_id][3]) for phrase_id in best]
+
+# Build the suggestion index of a user's (or a shared ledger's) recent records
+def build_index(db: Session, user_id: int, ledger_id: int = None):
+    since = datetime.now(timezone.utc) - timedelta(days=AUTOCOMPLETE_HISTORY_DAYS)
+    scope = Record.ledger_id == ledger_id if ledger_id is not None else Record.ledger_id.is_(None)
+    rows = db.query(Record.description, Record.category_id, func.count(Record.id), func.max(Record.date)).filter(
+        Record.user_id == user_id, scope, Record.description.isnot(None), Record.date >= since
+    ).group_by(Record.description, Record.category_id).all()
+    return SuggestionIndex(rows)
+
+def suggest_descriptions(db: Session, user_id: int, prefix: str, limit: int = 10, ledger_id: int = None):
+    """Suggestions for a description prefix, from this worker's index while the records are unchanged"""
+    key = f"{user_id}:{ledger_id or 0}"
+    version = records_version(db, user_id, ledger_id)
+    entry = _indexes.get(key)
+    if entry is MISSING or entry[0] != version:
+        entry = (version, build_index(db, user_id, ledger_id))
+        _indexes.set(key, entry)
+    return [
+        {"description": description, "count": count, "category_ids": category_ids}
+        for description, count, category_ids in entry[1].suggest(prefix, limit)
+    ]
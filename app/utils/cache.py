@@ -0,0 +1,423 @@
+"""Cache shared by the app's consumers, in process or across uvicorn workers.
+
+With CACHE_URL unset every worker keeps its own LRU. With
+CACHE_URL=tcp://host:port, workers share one cache server (start it with
+``python -m app.utils.cache serve --address host:port``) and keep a short
+lived local copy of hot entries, which the server's invalidation channel
+clears whenever any worker deletes a key. Entries travel pickled, so the
+server and its clients refuse to start without an explicit CACHE_AUTHKEY.
+
+When the server cannot be reached, the failure is logged and counted, the
+local copies are dropped and lookups go to the database; deletions that
+did not reach the server are sent again, before anything else, once it is
+back.
+"""
+from collections import OrderedDict
+from multiprocessing.connection import Client, Listener
+from dotenv import load_dotenv
+from app.utils.metrics import Counter
+import argparse
+import logging
+import os
+import shlex
+import sys
+import threading
+import time
+
+# Load environment variables
+load_dotenv()
+
+# Shared cache server, e.g. tcp://127.0.0.1:6390; empty means per-process caches
+CACHE_URL = os.getenv("CACHE_URL", "")
+
+# Secret both the server and the workers must know; required with CACHE_URL
+CACHE_AUTHKEY = os.getenv("CACHE_AUTHKEY", "").encode("utf-8")
+
+# Values that are not secrets: empty, the old built-in default and the .env.example placeholder
+_PUBLIC_AUTHKEYS = {b"", b"duckpay-cache", b"change-this-cache-secret"}
+
+# Workers serving the app; uvicorn --workers and gunicorn --workers default to it
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Lifetime of the local copy of a shared entry
+CACHE_LOCAL_TTL = float(os.getenv("CACHE_LOCAL_TTL", "5"))
+
+# Deletions kept for the cache server while it is unreachable; past this, it is cleared instead
+CACHE_MAX_PENDING_INVALIDATIONS = 1000
+
+logger = logging.getLogger(__name__)
+
+CACHE_REQUESTS = Counter("duckpay_cache_requests_total", "Cache lookups by result", ("cache", "result"))
+CACHE_EVICTIONS = Counter("duckpay_cache_evictions_total", "Entries evicted to respect the cache size", ("cache",))
+CACHE_SERVER_ERRORS = Counter("duckpay_cache_server_errors_total", "Calls to the cache server that failed", ("command",))
+
+# Marks a missing entry, since None is a valid cached value
+MISSING = object()
+
+class LRUBackend:
+    """Least-recently-used entries with per-entry expiry, in process memory"""
+
+    def __init__(self, maxsize=10000, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store an entry; returns the keys evicted to make room"""
+        expires_at = time.monotonic() + ttl if ttl else None
+        evicted = []
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                evicted.append(self._entries.popitem(last=False)[0])
+        if evicted and self.on_evict:
+            self.on_evict(len(evicted))
+        return evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self, prefix=""):
+        with self._lock:
+            if not prefix:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+class CacheConfigError(RuntimeError):
+    """A cache setup that cannot work safely"""
+
+# Anyone holding the key can make every worker unpickle what they send, so it must be a real secret
+def _require_authkey(authkey):
+    if authkey in _PUBLIC_AUTHKEYS:
+        raise CacheConfigError("Set CACHE_AUTHKEY to a long random secret to use a shared cache server")
+    return authkey
+
+# Worker processes the server was started with: --workers/-w on its command line (uvicorn, gunicorn and
+# GUNICORN_CMD_ARGS; spawned uvicorn workers get the supervisor's arguments), else WEB_CONCURRENCY
+def worker_count(argv=None):
+    args = list(sys.argv[1:] if argv is None else argv) + shlex.split(os.getenv("GUNICORN_CMD_ARGS", ""))
+    count = WEB_CONCURRENCY
+    for i, arg in enumerate(args):
+        if arg in ("--workers", "-w") and i + 1 < len(args):
+            value = args[i + 1]
+        elif arg.startswith("--workers="):
+            value = arg.split("=", 1)[1]
+        elif arg.startswith("-w") and arg[2:].isdigit():
+            value = arg[2:]
+        else:
+            continue
+        if value.isdigit():
+            count = int(value)
+    return count
+
+def check_worker_setup():
+    """Refuse several workers with per-process caches: invalidations and published messages would
+    only reach the worker that sent them"""
+    workers = worker_count()
+    if workers > 1 and not CACHE_URL:
+        raise CacheConfigError(f"{workers} workers need a shared cache: set CACHE_URL and CACHE_AUTHKEY")
+
+def _parse_address(url):
+    host, _, port = url.replace("tcp://", "").rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+class RemoteBackend:
+    """Client of a cache server, with a local copy kept fresh by its invalidation channel"""
+
+    def __init__(self, address, authkey=CACHE_AUTHKEY, local_ttl=CACHE_LOCAL_TTL):
+        self.address = address
+        self.authkey = _require_authkey(authkey)
+        self.local_ttl = local_ttl
+        self.local = LRUBackend()
+        self._connections = threading.local()
+        # Deletions and clears the server has not received; local copies are bypassed until they are sent
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._subscribers = {}
+        self._subscriber_thread = threading.Thread(target=self._listen, name="cache-invalidation", daemon=True)
+        self._subscriber_thread.start()
+
+    def _send(self, request):
+        # A kept connection may predate a server restart, so a failure is retried once on a new one
+        for attempt in range(2):
+            conn = getattr(self._connections, "conn", None)
+            try:
+                if conn is None:
+                    conn = self._connections.conn = Client(self.address, authkey=self.authkey)
+                conn.send(request)
+                return conn.recv()
+            except (OSError, EOFError):
+                self._connections.conn = None
+                if attempt:
+                    raise
+
+    def _flush_pending(self):
+        with self._pending_lock:
+            while self._pending:
+                self._send(self._pending[0])
+                self._pending.pop(0)
+
+    def _call(self, *request):
+        """Send a request after any pending invalidations; None when the server cannot be reached"""
+        try:
+            if self._pending:
+                self._flush_pending()
+            return self._send(request)
+        except (OSError, EOFError) as e:
+            CACHE_SERVER_ERRORS.inc(request[0])
+            logger.error("Cache server %s unavailable for %s: %s", self.address, request[0], e)
+            if request[0] in ("delete", "clear"):
+                with self._pending_lock:
+                    self._pending.append(request)
+                    if len(self._pending) > CACHE_MAX_PENDING_INVALIDATIONS:
+                        self._pending = [("clear", "")]
+            # Other workers' invalidations may be missed too while the server is away
+            self.local.clear()
+            return None
+
+    def get(self, key):
+        if not self._pending:
+            value = self.local.get(key)
+            if value is not MISSING:
+                return value
+        reply = self._call("get", key)
+        if not reply or not reply[0]:
+            return MISSING
+        self.local.set(key, reply[1], self.local_ttl)
+        return reply[1]
+
+    def set(self, key, value, ttl=None):
+        reply = self._call("set", key, value, ttl)
+        if reply is None:
+            return
+        self.local.set(key, value, min(ttl, self.local_ttl) if ttl else self.local_ttl)
+        # The server reports the entries it evicted to make room, by cache name
+        if isinstance(reply, dict):
+            for name, count in reply.items():
+                CACHE_EVICTIONS.inc(name, amount=count)
+
+    def delete(self, key):
+        self.local.delete(key)
+        self._call("delete", key)
+
+    def clear(self, prefix=""):
+        self.local.clear(prefix)
+        self._call("clear", prefix)
+
+    def publish(self, channel, message):
+        self._call("publish", channel, message)
+
+    def subscribe(self, channel, callback):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def _listen(self):
+        backoff = 0.5
+        while True:
+            try:
+                conn = Client(self.address, authkey=self.authkey)
+                conn.send(("subscribe",))
+                # Anything cached before (re)connecting may have missed an invalidation
+                self.local.clear()
+                backoff = 0.5
+                while True:
+                    message = conn.recv()
+                    if message[0] == "invalidate":
+                        self.local.delete(message[1])
+                    elif message[0] == "invalidate_prefix":
+                        self.local.clear(message[1])
+                    elif message[0] == "message":
+                        for callback in self._subscribers.get(message[1], []):
+                            callback(message[2])
+            except (OSError, EOFError):
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 10)
+
+class LocalBackend(LRUBackend):
+    """Per-process backend; publishing only reaches this process's subscribers"""
+
+    def __init__(self, maxsize=10000, on_evict=None):
+        super().__init__(maxsize, on_evict)
+        self._subscribers = {}
+
+    def publish(self, channel, message):
+        for callback in self._subscribers.get(channel, []):
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+# Backend shared by every cache and channel in this process, created on first use
+_shared_backend = None
+_shared_backend_lock = threading.Lock()
+
+def _get_shared_backend():
+    global _shared_backend
+    with _shared_backend_lock:
+        if _shared_backend is None:
+            _shared_backend = RemoteBackend(_parse_address(CACHE_URL)) if CACHE_URL else LocalBackend(0)
+        return _shared_backend
+
+def _backend_for(name, maxsize):
+    if CACHE_URL:
+        return _get_shared_backend()
+    return LocalBackend(maxsize, on_evict=lambda count: CACHE_EVICTIONS.inc(name, amount=count))
+
+class Cache:
+    """A named cache: one key space, one TTL and one set of hit/miss/eviction metrics.
+
+    local_ttl caps the TTL when the cache is per process (no CACHE_URL), for entries
+    whose invalidation must reach every worker: other workers then see changes that
+    soon at the latest."""
+
+    def __init__(self, name, ttl=60, maxsize=10000, local_ttl=None):
+        self.name = name
+        self.ttl = ttl if CACHE_URL or local_ttl is None else min(ttl, local_ttl)
+        self.backend = _backend_for(name, maxsize)
+
+    def _key(self, key):
+        return f"{self.name}:{key}"
+
+    def get(self, key, default=None):
+        value = self.backend.get(self._key(key))
+        CACHE_REQUESTS.inc(self.name, "miss" if value is MISSING else "hit")
+        return default if value is MISSING else value
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(self._key(key), value, ttl or self.ttl)
+
+    def get_or_set(self, key, loader, ttl=None):
+        value = self.backend.get(self._key(key))
+        if value is not MISSING:
+            CACHE_REQUESTS.inc(self.name, "hit")
+            return value
+        CACHE_REQUESTS.inc(self.name, "miss")
+        value = loader()
+        self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, key):
+        self.backend.delete(self._key(key))
+
+    def invalidate_prefix(self, prefix):
+        self.backend.clear(self._key(prefix))
+
+    def invalidate_all(self):
+        self.backend.clear(self._key(""))
+
+# Publish a message to every worker subscribed to channel
+def publish(channel, message):
+    _get_shared_backend().publish(channel, message)
+
+# Call callback(message) for every message published on channel, by any worker
+def subscribe(channel, callback):
+    _get_shared_backend().subscribe(channel, callback)
+
+class CacheServer:
+    """Cache server shared by workers, with a push channel for invalidations and messages"""
+
+    def __init__(self, address, authkey=CACHE_AUTHKEY, maxsize=100000):
+        self.listener = Listener(address, authkey=_require_authkey(authkey))
+        self.store = LRUBackend(maxsize)
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    @property
+    def address(self):
+        return self.listener.address
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                return
+            except Exception as e:
+                # Failed authentication or handshake from one client
+                logger.warning("Rejected cache client: %s", e)
+                continue
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="cache-server", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        self.listener.close()
+
+    def _broadcast(self, message):
+        # Sends happen under the lock so messages to one subscriber never interleave
+        with self._lock:
+            for conn in list(self._subscribers):
+                try:
+                    conn.send(message)
+                except OSError:
+                    self._subscribers.remove(conn)
+
+    def _handle(self, conn):
+        try:
+            while True:
+                request = conn.recv()
+                command = request[0]
+                if command == "get":
+                    value = self.store.get(request[1])
+                    conn.send((False, None) if value is MISSING else (True, value))
+                elif command == "set":
+                    evicted = {}
+                    for key in self.store.set(request[1], request[2], request[3]):
+                        name = key.partition(":")[0]
+                        evicted[name] = evicted.get(name, 0) + 1
+                    conn.send(evicted)
+                elif command == "delete":
+                    self.store.delete(request[1])
+                    conn.send(True)
+                    self._broadcast(("invalidate", request[1]))
+                elif command == "clear":
+                    self.store.clear(request[1])
+                    conn.send(True)
+                    self._broadcast(("invalidate_prefix", request[1]))
+                elif command == "publish":
+                    conn.send(True)
+                    self._broadcast(("message", request[1], request[2]))
+                elif command == "subscribe":
+                    with self._lock:
+                        self._subscribers.append(conn)
+                    return
+        except (OSError, EOFError):
+            conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="DuckPay shared cache server")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--address", default=CACHE_URL or "127.0.0.1:6390", help="host:port to listen on")
+    parser.add_argument("--maxsize", type=int, default=100000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        _require_authkey(CACHE_AUTHKEY)
+    except CacheConfigError as e:
+        raise SystemExit(str(e))
+    server = CacheServer(_parse_address(args.address), maxsize=args.maxsize)
+    logger.info("Cache server listening on %s:%s", *server.address)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Five-field cron schedules (minute hour day-of-month month day-of-week), in UTC.
+
+Fields take ``*``, numbers, ranges ``a-b``, steps ``*/n`` or ``a-b/n`` and
+comma separated lists of those. Day of week is 0-6 from Sunday (7 is also
+Sunday). As in cron, when both day fields are restricted a day matches
+either of them. Nicknames ``@hourly``, ``@daily``, ``@weekly``,
+``@monthly`` and ``@yearly`` are accepted.
+"""
+from datetime import datetime, timedelta, timezone
+
+# Nicknames and the schedules they stand for
+NICKNAMES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+}
+
+# (lowest, highest) value of each field
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+# Years searched for the next run before a schedule is considered never due (e.g. "0 0 30 2 *")
+MAX_SEARCH_YEARS = 8
+
+class CronError(ValueError):
+    """An invalid cron expression"""
+
+def _parse_field(text, lowest, highest):
+    values = set()
+    for part in text.split(","):
+        range_text, _, step_text = part.partition("/")
+        try:
+            step = int(step_text) if step_text else 1
+            if range_text == "*":
+                start, end = lowest, highest
+            elif "-" in range_text:
+                start, end = (int(value) for value in range_text.split("-", 1))
+            else:
+                start = int(range_text)
+                end = highest if step_text else start
+        except ValueError:
+            raise CronError(f"Invalid field: {text}") from None
+        if step < 1 or not lowest <= start <= end <= highest:
+            raise CronError(f"Invalid field: {text}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+class CronSchedule:
+    """A parsed cron expression"""
+
+    def __init__(self, expression: str):
+        self.expression = expression.strip()
+        fields = NICKNAMES.get(self.expression.lower(), self.expression).split()
+        if len(fields) != 5:
+            raise CronError("A schedule needs 5 fields: minute hour day-of-month month day-of-week")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(text, lowest, highest) for text, (lowest, highest) in zip(fields, FIELD_RANGES)
+        )
+        # Sunday is both 0 and 7; stored as Python weekdays (Monday 0)
+        self.weekdays = frozenset((day - 1) % 7 for day in weekdays)
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, moment):
+        day_match = moment.day in self.days
+        weekday_match = moment.weekday() in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_match and weekday_match
+        return day_match or weekday_match
+
+    def next_after(self, moment: datetime):
+        """First run strictly after moment (UTC), or None when the schedule never runs"""
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        moment = moment.astimezone(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment.year + MAX_SEARCH_YEARS
+        while moment.year <= limit:
+            if moment.month not in self.months:
+                year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+                moment = moment.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if moment.hour not in self.hours:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+                continue
+            minute = min((value for value in self.minutes if value >= moment.minute), default=None)
+            if minute is None:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+                continue
+            return moment.replace(minute=minute)
+        return None
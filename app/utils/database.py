@@ -1,8 +1,14 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text, Insert, Update, Delete
+from sqlalchemy.schema import CreateTable, CreateIndex
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+import itertools
+import threading
+import time
 import os
 from dotenv import load_dotenv
+from app.utils.metrics import instrument_engine
+from app.utils.query_inspector import QUERY_INSPECTOR_ENABLED, inspect_engine
 
 # Load environment variables
 load_dotenv()
@@ -10,13 +16,118 @@ load_dotenv()
 # Database URL
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
 
+# Read replica URLs (comma separated), empty means all traffic goes to the primary
+SQLALCHEMY_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# Shard URLs (comma separated) holding per-user tables; empty keeps all data in the main database
+SHARD_DATABASE_URLS = [url.strip() for url in os.getenv("SHARD_DATABASE_URLS", "").split(",") if url.strip()]
+
+# Tables partitioned by user_id across shards; every other table stays in the main (directory) database
+SHARDED_TABLES = {
+    "records", "categories", "record_rollups", "recurring_rules", "budgets", "record_attachments", "records_archive",
+    "idempotency_keys",
+}
+
+# How long a failing replica is kept out of rotation
+REPLICA_EJECT_SECONDS = float(os.getenv("REPLICA_EJECT_SECONDS", "30"))
+
+# Create an engine for a database URL, with statement metrics attached
+def create_db_engine(url, **kwargs):
+    db_engine = create_engine(
+        url, connect_args={"check_same_thread": False} if "sqlite" in url else {}, **kwargs
+    )
+    instrument_engine(db_engine)
+    if QUERY_INSPECTOR_ENABLED:
+        inspect_engine(db_engine)
+    return db_engine
+
 # Create engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in SQLALCHEMY_DATABASE_URL else {}
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
+
+class ReplicaPool:
+    """Round-robin over replica engines, skipping replicas that recently failed"""
+
+    def __init__(self, engines, eject_seconds=REPLICA_EJECT_SECONDS):
+        self.engines = list(engines)
+        self.eject_seconds = eject_seconds
+        self._ejected_until = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        for replica in self.engines:
+            event.listen(replica, "handle_error", self._on_error)
+
+    def pick(self):
+        """Return the next healthy replica, or None if every replica is ejected"""
+        now = time.monotonic()
+        for _ in range(len(self.engines)):
+            replica = self.engines[next(self._counter) % len(self.engines)]
+            if self._ejected_until.get(replica, 0) <= now:
+                return replica
+        return None
+
+    def eject(self, replica):
+        with self._lock:
+            self._ejected_until[replica] = time.monotonic() + self.eject_seconds
+
+    def healthy(self):
+        now = time.monotonic()
+        return [replica for replica in self.engines if self._ejected_until.get(replica, 0) <= now]
+
+    def _on_error(self, context):
+        # Connection failures and disconnects take the replica out of rotation
+        if context.is_disconnect or context.connection is None:
+            self.eject(context.engine)
+
+# Replica engines share the primary's settings but check connections before use
+replica_pool = ReplicaPool(
+    create_db_engine(url, pool_pre_ping=True) for url in SQLALCHEMY_REPLICA_URLS
 )
 
+# Shard engines, indexed by shard number
+shard_engines = [create_db_engine(url) for url in SHARD_DATABASE_URLS]
+
+class ShardNotSelected(RuntimeError):
+    """A sharded table was queried through a session not bound to a user's shard"""
+
+class RoutingSession(Session):
+    """Session that routes per-user tables to a shard and may read from a replica until it writes.
+
+    With shards configured, tables in ``SHARDED_TABLES`` go to the shard in
+    ``info["shard"]`` (set by ``bind_user_shard``); everything else goes to the
+    main database. Sessions opened with ``info["use_replica"]`` send SELECTs
+    on main tables to one replica (chosen once per session). As soon as the
+    session flushes or executes a write statement, it sticks to the primary
+    so later reads in the same request see its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if shard_engines and mapper is not None and mapper.local_table.name in SHARDED_TABLES:
+            shard = self.info.get("shard")
+            if shard is None:
+                raise ShardNotSelected(f"Session is not bound to a shard for table {mapper.local_table.name}")
+            return shard_engines[shard]
+        if self.info.get("use_replica") and not self.info.get("wrote") and not self._flushing:
+            if not isinstance(clause, (Insert, Update, Delete)):
+                replica = self.info.get("replica")
+                if replica is None or replica not in replica_pool.healthy():
+                    replica = replica_pool.pick()
+                    self.info["replica"] = replica
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+# Pin the session to the primary once it has written anything
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_flush_written(session, flush_context):
+    session.info["wrote"] = True
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _mark_statement_written(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info["wrote"] = True
+
 # Create session local class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=RoutingSession)
 
 # Create base class
 Base = declarative_base()
@@ -29,9 +140,64 @@ def get_db():
     finally:
         db.close()
 
+# Dependency to get a read-only DB session, served by a replica when one is configured
+def get_read_db():
+    db = SessionLocal(info={"use_replica": True})
+    try:
+        yield db
+    finally:
+        db.close()
+
 # Import models here to avoid circular imports
 from app.models.user import User
 from app.models.group import Group, UserGroup, Permission, GroupPermission, TablePermission
+from app.models.category import Category
+from app.models.record import Record
+from app.models.idempotency import IdempotencyKey
+from app.models.job import Job
+from app.models.shard import UserShard
+from app.models.ledger import Ledger
+from app.models.rollup import RecordRollup
+from app.models.recurring import RecurringRule
+from app.models.budget import Budget
+from app.models.attachment import RecordAttachment
+from app.models.archive import RecordArchive
+
+# Create the sharded tables on every shard; foreign keys to main database tables are left out
+def create_shard_tables():
+    for shard_engine in shard_engines:
+        existing = set(inspect(shard_engine).get_table_names())
+        with shard_engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if table.name not in SHARDED_TABLES or table.name in existing:
+                    continue
+                foreign_keys = [fk for fk in table.foreign_key_constraints if fk.referred_table.name in SHARDED_TABLES]
+                conn.execute(CreateTable(table, include_foreign_key_constraints=foreign_keys))
+                for index in table.indexes:
+                    conn.execute(CreateIndex(index))
+
+# Add nullable columns and indexes declared on the models but missing from tables created by an older version
+def ensure_columns():
+    targets = [(engine, None)] + [(shard_engine, SHARDED_TABLES) for shard_engine in shard_engines]
+    for target, table_names in targets:
+        inspector = inspect(target)
+        existing = set(inspector.get_table_names())
+        quote = target.dialect.identifier_preparer.quote
+        with target.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if table.name not in existing or (table_names is not None and table.name not in table_names):
+                    continue
+                present = {column["name"] for column in inspector.get_columns(table.name)}
+                missing = [column for column in table.columns if column.name not in present]
+                for column in missing:
+                    if not column.nullable:
+                        raise RuntimeError(f"Cannot add required column {table.name}.{column.name} to an existing table")
+                    column_type = column.type.compile(dialect=target.dialect)
+                    conn.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"))
+                indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in indexes or any(column in missing for column in index.columns):
+                        conn.execute(CreateIndex(index))
 
 # Initialize default groups and permissions
 def init_db():
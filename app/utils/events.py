@@ -0,0 +1,106 @@
+"""Live notifications pushed to clients as server-sent events.
+
+Events are addressed to a topic: a user (``user:42``) or a shared ledger
+(``ledger:7``). ``emit()`` publishes them on the cache's channel: with
+CACHE_URL set they reach the clients connected to any worker, without it
+only those of the emitting process (which is why several workers refuse to
+start without CACHE_URL). ``GET /api/events`` streams the events of the
+signed-in user and of every ledger they can access, as they happen; nothing
+is stored, so a client that is not connected misses them.
+"""
+from dotenv import load_dotenv
+from app.utils.cache import publish, subscribe
+from app.utils.metrics import Counter, Gauge
+import asyncio
+import json
+import os
+import threading
+
+# Load environment variables
+load_dotenv()
+
+# Events buffered per connection; a client too slow to keep up loses the oldest ones
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+
+# Seconds between keep-alive comments on an idle stream
+EVENT_KEEPALIVE_SECONDS = float(os.getenv("EVENT_KEEPALIVE_SECONDS", "15"))
+
+EVENTS_EMITTED = Counter("duckpay_events_emitted_total", "Events published, by type", ("type",))
+EVENT_STREAMS = Gauge("duckpay_event_streams", "Event streams open in this worker")
+
+_CHANNEL = "events"
+
+# Topic of a user's own events
+def user_topic(user_id: int):
+    return f"user:{user_id}"
+
+# Topic of a shared ledger's events
+def ledger_topic(ledger_id: int):
+    return f"ledger:{ledger_id}"
+
+# Topic of the events of a user's own data, or of a shared ledger's
+def scope_topic(user_id: int, ledger_id: int = None):
+    return user_topic(user_id) if ledger_id is None else ledger_topic(ledger_id)
+
+def _put(queue, event):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+class EventHub:
+    """Event queues of this worker's open streams, by topic"""
+
+    def __init__(self):
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def open(self, topics):
+        """Queue receiving the events of topics, on the running event loop"""
+        queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        entry = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            for topic in topics:
+                self._queues.setdefault(topic, set()).add(entry)
+        EVENT_STREAMS.inc()
+        return entry
+
+    def close(self, topics, entry):
+        with self._lock:
+            for topic in topics:
+                entries = self._queues.get(topic)
+                if entries is not None:
+                    entries.discard(entry)
+                    if not entries:
+                        del self._queues[topic]
+        EVENT_STREAMS.dec()
+
+    def deliver(self, message):
+        topic, event = message
+        with self._lock:
+            entries = list(self._queues.get(topic, ()))
+        for loop, queue in entries:
+            loop.call_soon_threadsafe(_put, queue, event)
+
+event_hub = EventHub()
+subscribe(_CHANNEL, event_hub.deliver)
+
+# Send an event (a JSON-serializable dict with a "type") to the clients listening on a topic
+def emit(topic: str, event: dict):
+    EVENTS_EMITTED.inc(event.get("type", ""))
+    publish(_CHANNEL, (topic, event))
+
+async def event_stream(topics, is_disconnected):
+    """Server-sent events of topics until the client disconnects"""
+    entry = event_hub.open(topics)
+    _, queue = entry
+    try:
+        yield ": connected\n\n"
+        while not await is_disconnected():
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=EVENT_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+    finally:
+        event_hub.close(topics, entry)
@@ -0,0 +1,67 @@
+from datetime import datetime
+from app.crud.record import iter_record_batches, count_records
+from app.models.category import Category
+from app.models.record import Record
+from app.utils.jobs import job_handler
+import csv
+
+# Columns of a records export, after the record id
+EXPORT_COLUMNS = ("date", "type", "amount", "category_id", "category", "description")
+
+# Record types an export can be filtered by
+EXPORT_TYPES = ("income", "expense")
+
+# Parse an optional ISO date parameter of an export
+def _date_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{name} must be an ISO date")
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO date, got {value!r}")
+
+# Reject export parameters before the job is queued
+def validate_export_params(params):
+    start_date = _date_param(params, "start_date")
+    end_date = _date_param(params, "end_date")
+    if start_date is not None and end_date is not None:
+        if (start_date.tzinfo is None) != (end_date.tzinfo is None):
+            raise ValueError("start_date and end_date must both have a time zone or both have none")
+        if start_date > end_date:
+            raise ValueError("start_date must not be after end_date")
+    if params.get("type") is not None and params["type"] not in EXPORT_TYPES:
+        raise ValueError(f"type must be one of {', '.join(EXPORT_TYPES)}")
+
+@job_handler("export_records", validate=validate_export_params)
+def export_records(context):
+    """Write the user's records, optionally filtered by start_date/end_date/type, to a CSV file"""
+    params = context.params
+    filters = {
+        "user_id": context.user_id,
+        "start_date": _date_param(params, "start_date"),
+        "end_date": _date_param(params, "end_date"),
+        "type": params.get("type"),
+    }
+    # Category names for the user's and the default categories, loaded once
+    category_names = dict(context.db.query(Category.id, Category.name).filter(
+        (Category.user_id == context.user_id) | (Category.is_default == True)
+    ).all())
+
+    total = count_records(context.db, **filters)
+    written = 0
+    columns = (Record.date, Record.type, Record.amount, Record.category_id, Record.description)
+    with open(context.result_file(".csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(("id",) + EXPORT_COLUMNS)
+        for batch in iter_record_batches(context.db, columns, **filters):
+            writer.writerows(
+                (record_id, date.isoformat() if date else "", type, amount, category_id, category_names.get(category_id, ""), description or "")
+                for record_id, date, type, amount, category_id, description in batch
+            )
+            written += len(batch)
+            context.progress(written / total if total else 1.0)
+            # End the read transaction between batches rather than leave the connection idle in it
+            context.db.rollback()
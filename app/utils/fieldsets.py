@@ -0,0 +1,120 @@
+"""Sparse fieldsets: the ``fields`` and ``exclude`` query parameters.
+
+``fields=nickname,groups.name`` keeps only the listed fields, with dotted
+paths reaching into nested models. ``exclude=groups.permissions`` drops
+fields. A model field named without sub-fields is kept or dropped whole.
+
+A fieldset is a dict tree in schema field order: each selected field maps
+to ``True``, or to the tree of its nested model. Endpoints use it both to
+select fewer columns (and skip unrequested relationships) and to shape
+the JSON they return.
+"""
+from functools import lru_cache
+from typing import List, Optional, Union, get_args, get_origin
+from types import UnionType
+from fastapi import HTTPException, Query, status
+from pydantic import BaseModel
+
+# The model a field holds, directly or as a list/optional of it; None for plain values
+def _nested_schema(annotation):
+    if get_origin(annotation) in (list, List, Union, UnionType):
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        return _nested_schema(args[0]) if len(args) == 1 else None
+    return annotation if isinstance(annotation, type) and issubclass(annotation, BaseModel) else None
+
+# Every field of a schema, nested models included
+@lru_cache(maxsize=None)
+def _full_tree(schema):
+    tree = {}
+    for name, field in schema.model_fields.items():
+        nested = _nested_schema(field.annotation)
+        tree[name] = _full_tree(nested) if nested else True
+    return tree
+
+def full_tree(schema):
+    return _copy(_full_tree(schema))
+
+def _copy(tree):
+    return {name: _copy(value) if isinstance(value, dict) else value for name, value in tree.items()}
+
+# Split "a,b.c" into paths, ignoring blanks
+def _paths(spec):
+    return [tuple(part for part in path.strip().split(".")) for path in spec.split(",") if path.strip()]
+
+# Check a path against the schema; returns the nested schema of each step
+def _resolve(schema, path):
+    schemas = []
+    for name in path:
+        if schema is None or name not in schema.model_fields:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown field: {'.'.join(path)}"
+            )
+        schemas.append(schema)
+        schema = _nested_schema(schema.model_fields[name].annotation)
+    return schemas + [schema]
+
+# Add a path to a tree; naming a model field takes all of it
+def _select(schema, path, tree):
+    schemas = _resolve(schema, path)
+    for name in path[:-1]:
+        if tree.get(name) is None:
+            tree[name] = {}
+        tree = tree[name]
+    nested = schemas[-1]
+    tree[path[-1]] = full_tree(nested) if nested is not None else True
+
+# Remove a path from a tree
+def _drop(schema, path, tree):
+    _resolve(schema, path)
+    for name in path[:-1]:
+        tree = tree.get(name)
+        if not isinstance(tree, dict):
+            return
+    tree.pop(path[-1], None)
+
+# Put a tree's keys back in schema order
+def _ordered(schema, tree):
+    ordered = {}
+    for name in schema.model_fields:
+        if name in tree:
+            value = tree[name]
+            ordered[name] = _ordered(_nested_schema(schema.model_fields[name].annotation), value) if isinstance(value, dict) else value
+    return ordered
+
+def parse_fieldset(schema, fields: Optional[str] = None, exclude: Optional[str] = None):
+    """Fieldset tree for the query parameters, or None when neither is given"""
+    if not fields and not exclude:
+        return None
+    if fields:
+        tree = {}
+        for path in _paths(fields):
+            _select(schema, path, tree)
+    else:
+        tree = full_tree(schema)
+    for path in _paths(exclude or ""):
+        _drop(schema, path, tree)
+    if not tree:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No fields selected"
+        )
+    return _ordered(schema, tree)
+
+# Dependency reading ?fields= and ?exclude= for a response schema
+def fieldset_params(schema):
+    def dependency(
+        fields: Optional[str] = Query(None, description="Comma separated fields to return; dotted paths select nested fields"),
+        exclude: Optional[str] = Query(None, description="Comma separated fields to leave out")
+    ):
+        return parse_fieldset(schema, fields, exclude)
+    return dependency
+
+# Keep only the fieldset's keys of a dict (or list of dicts), in fieldset order
+def project(data, tree):
+    if isinstance(data, list):
+        return [project(item, tree) for item in data]
+    return {
+        name: project(data[name], value) if isinstance(value, dict) and data[name] is not None else data[name]
+        for name, value in tree.items()
+    }
@@ -0,0 +1,219 @@
+"""Idempotency-Key support for create endpoints.
+
+The first request with a key reserves it in the ``idempotency_keys``
+table, runs the create and stores the response. Retries with the same key
+replay the stored response (with ``Idempotent-Replayed: true``) instead
+of creating again. Concurrent duplicates wait on a per-key lock in the
+same worker; a duplicate in another worker gets 409 until the first one
+finishes, since the table's unique constraint lets only one of them
+reserve the key.
+
+The table is sharded: keys live on the shard of the data's owner (the
+ledger owner for ledger writes, with the caller in the stored scope), and
+the response is written by the transaction that commits the created row.
+A crash after that commit leaves a complete key to replay, never a
+reservation that expires and lets a retry create a duplicate.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException, status
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from app.models.idempotency import IdempotencyKey
+from app.utils.metrics import Counter
+from app.utils.serialization import json_response
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Load environment variables
+load_dotenv()
+
+# How long a completed response is replayed
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+
+# How long a reservation holds the key; after that the request is assumed dead and the key is free again
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+
+# Minimum seconds between sweeps of expired keys in one process
+_PURGE_INTERVAL = 300
+
+IDEMPOTENT_REPLAYS = Counter("duckpay_idempotent_replays_total", "Create requests answered from a stored response", ("scope",))
+
+class KeyLocks:
+    """One lock per key, dropped once nobody holds or waits for it"""
+
+    def __init__(self):
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, key):
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+_key_locks = KeyLocks()
+# Last sweep per shard (None without sharding)
+_last_purge = {}
+
+# SHA-256 of a request body, independent of key order
+def request_fingerprint(payload):
+    canonical = json.dumps(payload.model_dump(mode="json"), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+# SQLite returns naive datetimes; they are stored in UTC
+def _as_utc(value):
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+# Delete expired keys of the session's shard, at most once per interval per process
+def _purge_expired(db: Session, now):
+    shard = db.info.get("shard")
+    if time.monotonic() - _last_purge.get(shard, 0.0) < _PURGE_INTERVAL:
+        return
+    _last_purge[shard] = time.monotonic()
+    db.query(IdempotencyKey).filter(IdempotencyKey.expires_at < now).delete(synchronize_session=False)
+    db.commit()
+
+@contextmanager
+def _respond_on_commit(db: Session, entry_id, model, response_model, status_code):
+    """Store the response of the first ``model`` row added while inside, in the transaction that commits it.
+
+    Yields a list that holds the stored body once it is written."""
+    created = []
+    stored = []
+
+    def capture(session, flush_context):
+        if not created:
+            created.extend(obj for obj in session.new if isinstance(obj, model))
+
+    def store(session):
+        if stored:
+            return
+        session.flush()
+        if not created:
+            return
+        body = response_model.model_validate(created[0]).model_dump_json()
+        session.query(IdempotencyKey).filter(IdempotencyKey.id == entry_id).update({
+            IdempotencyKey.status_code: status_code,
+            IdempotencyKey.response_body: body,
+            IdempotencyKey.expires_at: datetime.now(timezone.utc) + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+        }, synchronize_session=False)
+        stored.append(body)
+
+    event.listen(db, "after_flush", capture)
+    event.listen(db, "before_commit", store)
+    try:
+        yield stored
+    finally:
+        event.remove(db, "after_flush", capture)
+        event.remove(db, "before_commit", store)
+
+def _replay(entry, scope):
+    IDEMPOTENT_REPLAYS.inc(scope)
+    return json_response(
+        entry.response_body.encode("utf-8"), status_code=entry.status_code, headers={"Idempotent-Replayed": "true"}
+    )
+
+def idempotent_create(db: Session, key, user_id: int, scope: str, payload, create, model, response_model,
+                      owner_id: int = None, status_code=status.HTTP_201_CREATED):
+    """Run ``create()`` once per (user, scope, key) and return its response as ``response_model``.
+
+    ``create()`` adds and commits one ``model`` row through ``db``, which is
+    bound to the shard of ``owner_id`` (default: the user). Without a key,
+    ``create()`` simply runs. Reusing a key with a different body is
+    rejected with 422.
+    """
+    if key is None:
+        return create()
+    if not key or len(key) > 255:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Idempotency-Key must be 1 to 255 characters"
+        )
+
+    fingerprint = request_fingerprint(payload)
+    owner_id = user_id if owner_id is None else owner_id
+    stored_scope = scope if owner_id == user_id else f"{scope}:user{user_id}"
+    with _key_locks.hold((user_id, scope, key)):
+        now = datetime.now(timezone.utc)
+        _purge_expired(db, now)
+        entry = db.query(IdempotencyKey).filter(
+            IdempotencyKey.user_id == owner_id,
+            IdempotencyKey.scope == stored_scope,
+            IdempotencyKey.key == key
+        ).first()
+        if entry is not None and _as_utc(entry.expires_at) <= now:
+            db.delete(entry)
+            db.commit()
+            entry = None
+
+        if entry is not None:
+            if entry.request_hash != fingerprint:
+                raise HTTPException(
+                    status_code=422,  # Unprocessable content
+                    detail="Idempotency-Key was already used with a different request"
+                )
+            if entry.status_code is not None:
+                return _replay(entry, scope)
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still in progress",
+                headers={"Retry-After": "1"}
+            )
+
+        # Reserve the key; the unique constraint settles races between workers
+        entry = IdempotencyKey(
+            user_id=owner_id,
+            scope=stored_scope,
+            key=key,
+            request_hash=fingerprint,
+            expires_at=now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+        )
+        db.add(entry)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still in progress",
+                headers={"Retry-After": "1"}
+            )
+        entry_id = entry.id
+
+        try:
+            with _respond_on_commit(db, entry_id, model, response_model, status_code) as stored:
+                result = create()
+        except Exception:
+            # Failed requests release the key so the client can retry, unless the row was committed
+            db.rollback()
+            db.query(IdempotencyKey).filter(
+                IdempotencyKey.id == entry_id, IdempotencyKey.status_code.is_(None)
+            ).delete(synchronize_session=False)
+            db.commit()
+            raise
+
+        if stored:
+            body = stored[0]
+        else:
+            body = response_model.model_validate(result).model_dump_json()
+            db.query(IdempotencyKey).filter(IdempotencyKey.id == entry_id).update({
+                IdempotencyKey.status_code: status_code,
+                IdempotencyKey.response_body: body,
+                IdempotencyKey.expires_at: datetime.now(timezone.utc) + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+            }, synchronize_session=False)
+            db.commit()
+        return json_response(body.encode("utf-8"), status_code=status_code)
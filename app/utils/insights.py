@@ -0,0 +1,200 @@
+"""Spending insights over a user's records, computed with NumPy.
+
+One query loads the id, amount (cents), time and category of the records
+of one type into arrays; everything else is vectorized:
+
+- daily totals over the last ``days`` days, with trailing 7 and 30 day
+  averages (days without records count as zero);
+- each category's total this month and last month, and the change;
+- anomalies: records of the window whose log amount is more than
+  ``INSIGHTS_ANOMALY_Z`` standard deviations above the other records of
+  their category over the last ``INSIGHTS_HISTORY_DAYS`` days.
+
+Results are cached as encoded JSON per user (or shared ledger), parameters
+and records version (kept in record_rollups), so any record write, by any
+worker, makes the next request recompute.
+
+Only the records table is read, so the app refuses to start when the
+oldest day insights look at is past the archive horizon.
+"""
+from datetime import datetime, timezone
+from sqlalchemy import select, cast, func, Integer, BigInteger
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from app.crud.archive import ARCHIVE_AFTER_DAYS
+from app.crud.rollup import records_version
+from app.models.record import Record
+from app.schemas.record import RecordInsights
+from app.utils.cache import Cache
+from app.utils.money import CENTS_PER_UNIT
+import itertools
+import numpy as np
+import os
+
+# Load environment variables
+load_dotenv()
+
+# Seconds computed insights are kept (a record write replaces them sooner)
+INSIGHTS_CACHE_TTL = float(os.getenv("INSIGHTS_CACHE_TTL", "600"))
+
+# Records this many standard deviations above their category's others are anomalies
+INSIGHTS_ANOMALY_Z = float(os.getenv("INSIGHTS_ANOMALY_Z", "3"))
+
+# A category needs this many other records before its records can be anomalies
+INSIGHTS_MIN_SAMPLES = int(os.getenv("INSIGHTS_MIN_SAMPLES", "5"))
+
+# Days of history that anomalies are compared with
+INSIGHTS_HISTORY_DAYS = int(os.getenv("INSIGHTS_HISTORY_DAYS", "180"))
+
+# Trailing averages of the daily series, in days
+ROLLING_WINDOWS = (7, 30)
+
+# Longest daily series a request can ask for
+MAX_INSIGHTS_DAYS = 366
+
+# Oldest day insights read: the history of anomalies, or the longest series with its first trailing averages
+INSIGHTS_LOOKBACK_DAYS = max(INSIGHTS_HISTORY_DAYS, MAX_INSIGHTS_DAYS + max(ROLLING_WINDOWS))
+if INSIGHTS_LOOKBACK_DAYS >= ARCHIVE_AFTER_DAYS:
+    raise ValueError(
+        f"Insights read {INSIGHTS_LOOKBACK_DAYS} days of records, but records older than ARCHIVE_AFTER_DAYS "
+        f"({ARCHIVE_AFTER_DAYS}) are archived; lower INSIGHTS_HISTORY_DAYS or raise ARCHIVE_AFTER_DAYS"
+    )
+
+# Most anomalies returned, highest score first
+MAX_ANOMALIES = 20
+
+# Smallest spread of a category's log amounts, so near-identical records (rent) need a real jump to stand out
+MIN_LOG_STD = 0.1
+
+DAY_SECONDS = 86400
+
+insights_cache = Cache("insights", ttl=INSIGHTS_CACHE_TTL)
+
+# SQL expression for the Unix time of a date, in whole seconds
+def _epoch(dialect_name, column):
+    if dialect_name == "sqlite":
+        return cast(func.strftime("%s", column), Integer)
+    if dialect_name == "postgresql":
+        return cast(func.extract("epoch", column), BigInteger)
+    return func.unix_timestamp(column)
+
+# Load ids, amounts (cents), Unix times and category ids of records since a Unix time, as arrays
+def load_columns(db: Session, user_id: int, type: str, since: int, ledger_id: int = None):
+    dialect_name = db.get_bind(Record.__mapper__).dialect.name
+    epoch = _epoch(dialect_name, Record.date)
+    scope = Record.ledger_id == ledger_id if ledger_id is not None else Record.ledger_id.is_(None)
+    # Compared as a date, not as an expression of it, so the date index applies
+    rows = db.execute(
+        select(Record.id, Record.amount_cents, epoch, Record.category_id)
+        .where(Record.user_id == user_id, scope, Record.type == type, Record.date >= datetime.fromtimestamp(since, timezone.utc))
+    ).all()
+    # fromiter over the flattened rows is far faster than np.array on Row objects
+    columns = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=4 * len(rows)).reshape(-1, 4)
+    return columns[:, 0], columns[:, 1], columns[:, 2], columns[:, 3]
+
+# Mean of each trailing window of a daily series; element i covers days i - window + 1 .. i
+def rolling_means(daily, window):
+    sums = np.concatenate(([0], np.cumsum(daily)))
+    starts = np.maximum(np.arange(1, len(daily) + 1) - window, 0)
+    return (sums[1:] - sums[starts]) / window
+
+# Totals per day from first_day (a day number since the epoch) through last_day
+def daily_totals(seconds, cents, first_day, last_day):
+    days = seconds // DAY_SECONDS - first_day
+    inside = (days >= 0) & (days <= last_day - first_day)
+    return np.bincount(days[inside], weights=cents[inside], minlength=last_day - first_day + 1)
+
+# Category totals from start (until end, when given), for the categories in index order
+def category_totals(seconds, cents, category_index, categories, start, end=None):
+    inside = seconds >= start
+    if end is not None:
+        inside &= seconds < end
+    return np.bincount(category_index[inside], weights=cents[inside], minlength=categories)
+
+# Scores of each record against the other records of its category (leave one out), and whether it has enough of them
+def anomaly_scores(cents, category_index, categories):
+    logs = np.log(np.maximum(cents, 1))
+    counts = np.bincount(category_index, minlength=categories)
+    sums = np.bincount(category_index, weights=logs, minlength=categories)
+    squares = np.bincount(category_index, weights=logs * logs, minlength=categories)
+    others = counts[category_index] - 1
+    enough = others >= max(INSIGHTS_MIN_SAMPLES, 1)
+    divisor = np.where(enough, others, 1)
+    means = (sums[category_index] - logs) / divisor
+    variances = (squares[category_index] - logs * logs) / divisor - means * means
+    stds = np.maximum(np.sqrt(np.maximum(variances, 0)), MIN_LOG_STD)
+    return (logs - means) / stds, enough
+
+# Unix time of the first second of a month, and of the month before it
+def _month_starts(now):
+    start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    previous = (start.replace(year=start.year - 1, month=12) if start.month == 1 else start.replace(month=start.month - 1))
+    return int(start.timestamp()), int(previous.timestamp()), start.strftime("%Y-%m"), previous.strftime("%Y-%m")
+
+def _amounts(cents):
+    return np.round(cents / CENTS_PER_UNIT, 2).tolist()
+
+def compute_insights(db: Session, user_id: int, type: str = "expense", days: int = 90, ledger_id: int = None, now: datetime = None):
+    """Insights of a user's (or a shared ledger's) records of one type, as a RecordInsights"""
+    now = (now or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    today = int(now.timestamp()) // DAY_SECONDS
+    first_day = today - days + 1
+    month_start, previous_start, month, previous_month = _month_starts(now)
+    since = min((first_day - max(ROLLING_WINDOWS) + 1) * DAY_SECONDS, previous_start, (today - INSIGHTS_HISTORY_DAYS) * DAY_SECONDS)
+    ids, cents, seconds, category_ids = load_columns(db, user_id, type, since, ledger_id)
+
+    # Daily totals with enough days before the window for its first trailing averages
+    history_day = first_day - max(ROLLING_WINDOWS) + 1
+    daily = daily_totals(seconds, cents, history_day, today)
+    averages = {window: rolling_means(daily, window)[-days:] for window in ROLLING_WINDOWS}
+    dates = np.datetime_as_string(np.arange(first_day, today + 1).astype("datetime64[D]")).tolist()
+    daily_rows = [
+        {"date": date, "total": total, "avg_7": avg_7, "avg_30": avg_30}
+        for date, total, avg_7, avg_30 in zip(dates, _amounts(daily[-days:]), _amounts(averages[7]), _amounts(averages[30]))
+    ]
+
+    # Month over month, per category
+    categories, category_index = np.unique(category_ids, return_inverse=True)
+    current = category_totals(seconds, cents, category_index, len(categories), month_start)
+    previous = category_totals(seconds, cents, category_index, len(categories), previous_start, month_start)
+    delta = current - previous
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = np.where(previous > 0, delta / previous, np.nan)
+    shown = np.flatnonzero((current > 0) | (previous > 0))
+    shown = shown[np.argsort(-np.abs(delta[shown]), kind="stable")]
+    category_rows = [
+        {
+            "category_id": category_id, "month_total": month_total, "previous_total": previous_total,
+            "delta": category_delta, "change": None if np.isnan(category_change) else round(float(category_change), 4)
+        }
+        for category_id, month_total, previous_total, category_delta, category_change in zip(
+            categories[shown].tolist(), _amounts(current[shown]), _amounts(previous[shown]), _amounts(delta[shown]), change[shown]
+        )
+    ]
+
+    # Unusually large records of the window
+    scores, enough = anomaly_scores(cents, category_index, len(categories))
+    flagged = np.flatnonzero(enough & (scores > INSIGHTS_ANOMALY_Z) & (seconds >= first_day * DAY_SECONDS))
+    flagged = flagged[np.argsort(-scores[flagged], kind="stable")][:MAX_ANOMALIES]
+    anomaly_rows = [
+        {"id": record_id, "date": date, "amount": amount, "category_id": category_id, "score": score}
+        for record_id, date, amount, category_id, score in zip(
+            ids[flagged].tolist(), np.datetime_as_string(seconds[flagged].astype("datetime64[s]")).tolist(),
+            _amounts(cents[flagged]), category_ids[flagged].tolist(), np.round(scores[flagged], 2).tolist()
+        )
+    ]
+
+    return RecordInsights(
+        type=type, ledger_id=ledger_id, days=days, month=month, previous_month=previous_month,
+        daily=daily_rows, categories=category_rows, anomalies=anomaly_rows
+    )
+
+def get_insights(db: Session, user_id: int, type: str = "expense", days: int = 90, ledger_id: int = None):
+    """Insights as encoded JSON, from the cache while the records are unchanged"""
+    version = records_version(db, user_id, ledger_id)
+    # The daily series ends today, so a new day needs new insights too
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    key = f"{user_id}:{ledger_id or 0}:{version}:{today}:{type}:{days}"
+    return insights_cache.get_or_set(
+        key, lambda: compute_insights(db, user_id, type, days, ledger_id).model_dump_json().encode("utf-8")
+    )
@@ -0,0 +1,299 @@
+"""In-process background jobs.
+
+A job is a row in the ``jobs`` table, run on a bounded thread pool by a
+handler registered with ``job_handler(kind)``. The handler gets a
+``JobContext`` to read data, report progress and name the file it
+produces, which clients download once the job has succeeded.
+
+Running jobs refresh a heartbeat. On startup, ``recover()`` requeues jobs
+whose heartbeat went stale (their worker died) or fails them if they
+cannot be restarted, and runs everything still queued. Claiming a job is
+an atomic ``queued -> running`` update, so with several workers each job
+runs once. An active job holds one of its user's ``JOB_MAX_PER_USER``
+slots, a unique (user_id, slot) pair released when it finishes, so
+concurrent submits cannot exceed the limit.
+
+Handlers validate their parameters when the job is submitted, and their
+session is opened on the user's shard once the job is claimed; no session
+on the main database stays open while they run.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException, status
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from app.models.job import Job
+from app.utils.database import SessionLocal
+from app.utils.metrics import Counter, Gauge, Histogram
+from app.utils.shards import user_session
+import json
+import logging
+import os
+import threading
+import time
+
+# Load environment variables
+load_dotenv()
+
+# Jobs running at once in one worker process
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# Queued or running jobs allowed in total, and per user
+JOB_MAX_ACTIVE = int(os.getenv("JOB_MAX_ACTIVE", "100"))
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "2"))
+
+# Where job results are written
+JOB_RESULT_DIR = os.getenv("JOB_RESULT_DIR", "./job_results")
+
+# How long results stay downloadable
+JOB_RESULT_TTL_HOURS = float(os.getenv("JOB_RESULT_TTL_HOURS", "24"))
+
+# A running job whose heartbeat is older than this is treated as interrupted
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+
+# Interrupted jobs are restarted at most this many times in total
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+logger = logging.getLogger(__name__)
+
+JOBS_FINISHED = Counter("duckpay_jobs_finished_total", "Background jobs finished, by kind and status", ("kind", "status"))
+JOBS_RUNNING = Gauge("duckpay_jobs_running", "Background jobs running in this process", ("kind",))
+JOB_DURATION = Histogram(
+    "duckpay_job_duration_seconds", "Background job run time", ("kind",),
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+)
+
+# Statuses of jobs that have not finished
+ACTIVE_STATUSES = ("queued", "running")
+
+class JobHandler:
+    """A registered job kind"""
+
+    def __init__(self, kind, function, admin_only=False, restartable=True, validate=None):
+        self.kind = kind
+        self.function = function
+        self.admin_only = admin_only
+        # Restartable handlers start over from scratch after an interruption
+        self.restartable = restartable
+        # validate(params) raises ValueError on parameters the handler cannot run with
+        self.validate = validate
+
+# Handlers by job kind
+_handlers = {}
+
+# Register function(context) as the handler of a job kind
+def job_handler(kind, admin_only=False, restartable=True, validate=None):
+    def decorator(function):
+        _handlers[kind] = JobHandler(kind, function, admin_only, restartable, validate)
+        return function
+    return decorator
+
+def _now():
+    return datetime.now(timezone.utc)
+
+# SQLite returns naive datetimes; they are stored in UTC
+def _as_utc(value):
+    return value.replace(tzinfo=timezone.utc) if value is not None and value.tzinfo is None else value
+
+class JobContext:
+    """What a handler sees of its job: parameters, a session on the user's shard, progress and the result file"""
+
+    def __init__(self, job, db: Session = None):
+        self.job_id = job.id
+        self.user_id = job.user_id
+        self.params = json.loads(job.params or "{}")
+        self.db = db
+        self.result_path = None
+        self._last_progress = 0.0
+
+    def progress(self, fraction):
+        # At most two writes a second; progress is informational
+        if time.monotonic() - self._last_progress < 0.5:
+            return
+        self._last_progress = time.monotonic()
+        with SessionLocal() as db:
+            db.query(Job).filter(Job.id == self.job_id).update({Job.progress: min(max(fraction, 0.0), 1.0)})
+            db.commit()
+
+    def result_file(self, suffix):
+        """Path the handler should write its result to"""
+        os.makedirs(JOB_RESULT_DIR, exist_ok=True)
+        self.result_path = os.path.join(JOB_RESULT_DIR, f"job-{self.job_id}{suffix}")
+        return self.result_path
+
+class JobRunner:
+    """Bounded pool running jobs of this process, with a heartbeat for the ones in progress"""
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._running = set()
+        self._lock = threading.Lock()
+        self._heartbeat = None
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+                self._heartbeat = threading.Thread(target=self._beat, name="job-heartbeat", daemon=True)
+                self._heartbeat.start()
+            return self._executor
+
+    def submit(self, db: Session, user_id: int, kind: str, params: dict, is_admin=False):
+        """Persist a job and queue it; raises 400/403/429/503 when it cannot be accepted"""
+        handler = _handlers.get(kind)
+        if handler is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown job kind: {kind}"
+            )
+        if handler.admin_only and not is_admin:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Insufficient permissions"
+            )
+
+        if handler.validate is not None:
+            try:
+                handler.validate(params)
+            except ValueError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Invalid job parameters: {e}"
+                )
+
+        if db.query(Job).filter(Job.status.in_(ACTIVE_STATUSES)).count() >= JOB_MAX_ACTIVE:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Job queue is full, please try again later"
+            )
+
+        # Take a free slot of the user; the unique (user_id, slot) index settles races between submits
+        taken = {slot for (slot,) in db.query(Job.slot).filter(Job.user_id == user_id, Job.slot.isnot(None))}
+        for slot in range(JOB_MAX_PER_USER):
+            if slot in taken:
+                continue
+            job = Job(user_id=user_id, kind=kind, params=json.dumps(params), status="queued", progress=0.0, slot=slot)
+            db.add(job)
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                continue
+            db.refresh(job)
+            self._pool().submit(self._run, job.id)
+            return job
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many jobs in progress, please wait for them to finish"
+        )
+
+    def _claim(self, db: Session, job_id):
+        now = _now()
+        claimed = db.query(Job).filter(Job.id == job_id, Job.status == "queued").update({
+            Job.status: "running",
+            Job.started_at: now,
+            Job.heartbeat_at: now,
+            Job.attempts: Job.attempts + 1,
+        }, synchronize_session=False)
+        db.commit()
+        return claimed == 1
+
+    def _run(self, job_id):
+        try:
+            # The job row is read and the session closed before the handler starts
+            with SessionLocal() as db:
+                if not self._claim(db, job_id):
+                    return
+                job = db.get(Job, job_id)
+                kind = job.kind
+                context = JobContext(job)
+            handler = _handlers.get(kind)
+            with self._lock:
+                self._running.add(job_id)
+            JOBS_RUNNING.inc(kind)
+            start = time.perf_counter()
+            outcome = {Job.status: "succeeded", Job.progress: 1.0}
+            try:
+                # Raises UserMoving while the user's data is being moved to another shard
+                context.db = user_session(context.user_id)
+                handler.function(context)
+                outcome[Job.result_path] = context.result_path
+            except Exception as e:
+                logger.exception("Job %s (%s) failed", job_id, kind)
+                outcome = {Job.status: "failed", Job.error: str(e)[:500] or type(e).__name__}
+                if context.result_path and os.path.exists(context.result_path):
+                    os.remove(context.result_path)
+            finally:
+                if context.db is not None:
+                    context.db.close()
+                with self._lock:
+                    self._running.discard(job_id)
+                JOBS_RUNNING.dec(kind)
+            # Finishing frees the user's slot
+            outcome.update({Job.finished_at: _now(), Job.slot: None})
+            with SessionLocal() as db:
+                db.query(Job).filter(Job.id == job_id).update(outcome, synchronize_session=False)
+                db.commit()
+            JOBS_FINISHED.inc(kind, outcome[Job.status])
+            JOB_DURATION.observe(kind, value=time.perf_counter() - start)
+        except Exception:
+            logger.exception("Could not run job %s", job_id)
+
+    def _beat(self):
+        while True:
+            time.sleep(JOB_STALE_SECONDS / 4)
+            with self._lock:
+                running = list(self._running)
+            if not running:
+                continue
+            try:
+                with SessionLocal() as db:
+                    db.query(Job).filter(Job.id.in_(running)).update({Job.heartbeat_at: _now()}, synchronize_session=False)
+                    db.commit()
+            except Exception:
+                logger.exception("Could not refresh job heartbeats")
+
+    def recover(self):
+        """Requeue or fail jobs interrupted by a restart, drop expired results and run queued jobs"""
+        now = _now()
+        with SessionLocal() as db:
+            for job in db.query(Job).filter(Job.status == "running").all():
+                heartbeat = _as_utc(job.heartbeat_at or job.started_at)
+                if heartbeat is not None and heartbeat > now - timedelta(seconds=JOB_STALE_SECONDS):
+                    continue  # Still running in another worker
+                handler = _handlers.get(job.kind)
+                if handler is not None and handler.restartable and job.attempts < JOB_MAX_ATTEMPTS:
+                    job.status = "queued"
+                    job.progress = 0.0
+                else:
+                    job.status = "failed"
+                    job.error = "Interrupted by a restart"
+                    job.finished_at = now
+                    job.slot = None
+
+            expired = db.query(Job).filter(
+                Job.result_path.isnot(None),
+                Job.finished_at < now - timedelta(hours=JOB_RESULT_TTL_HOURS)
+            ).all()
+            for job in expired:
+                if os.path.exists(job.result_path):
+                    os.remove(job.result_path)
+                job.result_path = None
+            db.commit()
+
+            queued = [job_id for (job_id,) in db.query(Job.id).filter(Job.status == "queued").order_by(Job.id)]
+        for job_id in queued:
+            self._pool().submit(self._run, job_id)
+        if queued:
+            logger.info("Resumed %d queued job(s)", len(queued))
+
+    def shutdown(self):
+        """Stop taking jobs; unfinished ones are recovered on the next start"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+job_runner = JobRunner()
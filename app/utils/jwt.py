@@ -2,7 +2,10 @@ from datetime import datetime, timedelta
 from jose import JWTError, jwt
 import bcrypt
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from app.utils.metrics import Counter, Gauge, Histogram
 
 # Load environment variables
 load_dotenv()
@@ -12,18 +15,85 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
+# bcrypt settings: the cost is calibrated at startup to the target hash time, within the bounds,
+# unless BCRYPT_ROUNDS fixes it
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "250"))
+BCRYPT_MIN_ROUNDS = int(os.getenv("BCRYPT_MIN_ROUNDS", "10"))
+BCRYPT_MAX_ROUNDS = int(os.getenv("BCRYPT_MAX_ROUNDS", "16"))
+BCRYPT_ROUNDS = os.getenv("BCRYPT_ROUNDS", "")
+
+BCRYPT_COST = Gauge("duckpay_bcrypt_rounds", "bcrypt cost used for new password hashes")
+BCRYPT_CALIBRATED_SECONDS = Gauge("duckpay_bcrypt_calibrated_hash_seconds", "Hash time measured at the chosen bcrypt cost")
+BCRYPT_SECONDS = Histogram(
+    "duckpay_bcrypt_seconds", "bcrypt hash and verify time", ("operation",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+BCRYPT_REHASHES = Counter("duckpay_bcrypt_rehashes_total", "Password hashes upgraded to the current cost on login")
+
+# Cost chosen for this process, set by calibrate_bcrypt()
+_bcrypt_rounds = None
+_calibration_lock = threading.Lock()
+
+# Seconds to hash a throwaway password at a given cost
+def _time_hash(rounds):
+    start = time.perf_counter()
+    bcrypt.hashpw(b"calibration-password", bcrypt.gensalt(rounds))
+    return time.perf_counter() - start
+
+# Pick the bcrypt cost whose hash time is closest to BCRYPT_TARGET_MS without exceeding it
+def calibrate_bcrypt():
+    global _bcrypt_rounds
+    with _calibration_lock:
+        if _bcrypt_rounds is not None:
+            return _bcrypt_rounds
+        if BCRYPT_ROUNDS:
+            rounds = int(BCRYPT_ROUNDS)
+        else:
+            # Each extra round doubles the work; extrapolate from the cheapest allowed cost
+            base = min(_time_hash(BCRYPT_MIN_ROUNDS) for _ in range(2))
+            rounds = BCRYPT_MIN_ROUNDS
+            while rounds < BCRYPT_MAX_ROUNDS and base * 2 ** (rounds + 1 - BCRYPT_MIN_ROUNDS) <= BCRYPT_TARGET_MS / 1000:
+                rounds += 1
+        BCRYPT_CALIBRATED_SECONDS.set(value=_time_hash(rounds))
+        BCRYPT_COST.set(value=rounds)
+        _bcrypt_rounds = rounds
+        return rounds
+
+# Cost recorded in a bcrypt hash ("$2b$12$...")
+def hash_rounds(hashed_password):
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+# Whether a hash uses a lower cost than new hashes would
+def needs_rehash(hashed_password):
+    rounds = hash_rounds(hashed_password)
+    return rounds is not None and rounds < calibrate_bcrypt()
+
 # Hash password
 def get_password_hash(password):
     # bcrypt only supports passwords up to 72 bytes
     safe_password = password[:72] if isinstance(password, str) else password
     # Convert to bytes if it's a string
     password_bytes = safe_password.encode('utf-8') if isinstance(safe_password, str) else safe_password
-    # Generate salt and hash
-    salt = bcrypt.gensalt()
+    # Generate salt with the calibrated cost and hash
+    salt = bcrypt.gensalt(calibrate_bcrypt())
+    start = time.perf_counter()
     hashed_bytes = bcrypt.hashpw(password_bytes, salt)
+    BCRYPT_SECONDS.observe("hash", value=time.perf_counter() - start)
     # Return as string
     return hashed_bytes.decode('utf-8')
 
+# Moving average of bcrypt verification time, used to pace logins for unknown users
+_verify_seconds = None
+_verify_lock = threading.Lock()
+
+def _record_verify_time(seconds):
+    global _verify_seconds
+    with _verify_lock:
+        _verify_seconds = seconds if _verify_seconds is None else 0.9 * _verify_seconds + 0.1 * seconds
+
 # Verify password
 def verify_password(plain_password, hashed_password):
     # bcrypt only supports passwords up to 72 bytes
@@ -32,7 +102,21 @@ def verify_password(plain_password, hashed_password):
     password_bytes = safe_password.encode('utf-8') if isinstance(safe_password, str) else safe_password
     hashed_bytes = hashed_password.encode('utf-8') if isinstance(hashed_password, str) else hashed_password
     # Verify
-    return bcrypt.checkpw(password_bytes, hashed_bytes)
+    start = time.perf_counter()
+    result = bcrypt.checkpw(password_bytes, hashed_bytes)
+    elapsed = time.perf_counter() - start
+    _record_verify_time(elapsed)
+    BCRYPT_SECONDS.observe("verify", value=elapsed)
+    return result
+
+# Take as long as a password verification without running bcrypt
+def simulate_password_check():
+    """Used when the user does not exist, so response time does not reveal
+    whether a username is registered. Sleeping costs no CPU; bcrypt only
+    runs once, to measure, if no verification has happened yet."""
+    if _verify_seconds is None:
+        verify_password("dummy-password", get_password_hash("dummy-password"))
+    time.sleep(_verify_seconds)
 
 # Create access token
 def create_access_token(data: dict):
@@ -0,0 +1,202 @@
+from contextvars import ContextVar
+from bisect import bisect_left
+from sqlalchemy import event
+import threading
+import time
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# All metrics, in registration order, rendered by /api/metrics
+REGISTRY = []
+
+# Escape a label value for the Prometheus text format
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base class for a labelled metric kept in process memory"""
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, *labelvalues, value):
+        with self._lock:
+            self._values[labelvalues] = value
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labelvalues, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labelvalues)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), then sum and count
+                series = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = [(labelvalues, (list(counts), total, count)) for labelvalues, (counts, total, count) in self._values.items()]
+        for labelvalues, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+# Render every registered metric in Prometheus text format
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# HTTP metrics
+REQUESTS_TOTAL = Counter("duckpay_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+REQUEST_DURATION = Histogram("duckpay_http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+REQUESTS_IN_FLIGHT = Gauge("duckpay_http_requests_in_flight", "HTTP requests currently being served")
+
+# Database metrics, attributed to the route that issued the statements
+DB_STATEMENTS_TOTAL = Counter("duckpay_db_statements_total", "SQL statements executed", ("route",))
+DB_STATEMENT_SECONDS_TOTAL = Counter("duckpay_db_statement_seconds_total", "Time spent executing SQL statements", ("route",))
+DB_STATEMENTS_PER_REQUEST = Histogram(
+    "duckpay_db_statements_per_request", "SQL statements per HTTP request", ("route",),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)
+)
+
+class RequestStats:
+    """SQL statement count and time for the current request"""
+    __slots__ = ("statements", "statement_time")
+
+    def __init__(self):
+        self.statements = 0
+        self.statement_time = 0.0
+
+# Stats of the request being served; copied into threadpool workers with the context
+current_request_stats: ContextVar = ContextVar("current_request_stats", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.statement_time += elapsed
+
+# Count statements and their time on an engine
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+# Route template for a served request, so paths with ids share one series
+def route_label(scope):
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        return "<unmatched>"
+    # The router sets the matched route, whose template is relative to the prefix it was included under;
+    # the prefix is the part of the request path before the tail the route's own pattern matches
+    request_path = scope["path"]
+    position = len(request_path)
+    while position > 0:
+        position = request_path.rfind("/", 0, position)
+        if position < 0:
+            break
+        if route.path_regex.match(request_path[position:]):
+            return request_path[:position] + path
+    return path
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and SQL usage per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            REQUESTS_IN_FLIGHT.dec()
+            current_request_stats.reset(token)
+            method = scope["method"]
+            route = route_label(scope)
+            REQUESTS_TOTAL.inc(method, route, str(status_code))
+            REQUEST_DURATION.observe(method, route, value=elapsed)
+            DB_STATEMENTS_PER_REQUEST.observe(route, value=stats.statements)
+            if stats.statements:
+                DB_STATEMENTS_TOTAL.inc(route, amount=stats.statements)
+                DB_STATEMENT_SECONDS_TOTAL.inc(route, amount=stats.statement_time)
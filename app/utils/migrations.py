@@ -0,0 +1,181 @@
+"""Schema and data upgrades of the main database and every shard.
+
+``upgrade()`` is a one-off step, run once per deploy before the workers
+start (it takes no lock, so it must not run in several processes at once):
+
+    python -m app.utils.migrations
+
+It is a no-op on an up-to-date database:
+
+- record_rollups tables with float totals (income_total/expense_total) are
+  dropped, recreated with integer cents and rebuilt from the records;
+- missing tables, nullable columns and indexes are created;
+- SQLite records tables created without AUTOINCREMENT are rebuilt with it,
+  so the id of a deleted or archived record is never handed out again;
+- records.amount_cents is filled from the float amount for rows written by
+  older versions, rounded half to even like the API, in batches of
+  ``AMOUNT_BACKFILL_BATCH_SIZE``;
+- the description search index is created and filled with the records
+  already there;
+- the default groups and permissions are created.
+
+Workers of older versions write records without amount_cents, so upgrade
+every worker before writing again. The app and the maintenance tools only
+call ``check_schema()``, and refuse to start on a database that still
+needs the step.
+"""
+from sqlalchemy import select, update, inspect, bindparam, func, text
+from sqlalchemy.schema import CreateTable
+from app.utils.database import Base, SHARDED_TABLES, engine, shard_engines, create_shard_tables, ensure_columns, init_db
+from app.models.record import Record
+from app.models.archive import RecordArchive
+from app.models.rollup import RecordRollup
+from app.utils.rollups import data_engines, rebuild_rollups
+from app.utils.search import create_search_index, search_index_missing
+from app.utils.money import to_cents
+import argparse
+
+# Records filled with amount_cents per statement
+AMOUNT_BACKFILL_BATCH_SIZE = 10000
+
+# Whether an engine has a record_rollups table holding float totals
+def _float_rollups(target):
+    inspector = inspect(target)
+    if RecordRollup.__tablename__ not in inspector.get_table_names():
+        return False
+    columns = {column["name"] for column in inspector.get_columns(RecordRollup.__tablename__)}
+    return "income_cents" not in columns
+
+# Drop record_rollups tables holding float totals; returns the engines whose tables were dropped
+def _drop_float_rollups():
+    dropped = []
+    for target in [engine] + list(shard_engines):
+        if _float_rollups(target):
+            RecordRollup.__table__.drop(bind=target)
+            dropped.append(target)
+    return dropped
+
+def backfill_amount_cents(data_engine, batch_size=AMOUNT_BACKFILL_BATCH_SIZE):
+    """Fill amount_cents of records written by older versions; returns the rows filled"""
+    filled = 0
+    while True:
+        with data_engine.begin() as conn:
+            rows = conn.execute(
+                select(Record.id, Record.amount_value).where(Record.amount_cents.is_(None)).order_by(Record.id).limit(batch_size)
+            ).all()
+            if not rows:
+                return filled
+            # Rounded by to_cents (half to even) like amounts written by the API, not by SQL round()
+            conn.execute(
+                update(Record).where(Record.id == bindparam("record_id")).values(amount_cents=bindparam("cents")),
+                [{"record_id": record_id, "cents": to_cents(amount)} for record_id, amount in rows]
+            )
+        filled += len(rows)
+
+# Whether a SQLite records table was created without AUTOINCREMENT
+def _records_reuse_ids(conn):
+    if conn.dialect.name != "sqlite":
+        return False
+    table_sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'records'")).scalar()
+    return table_sql is not None and "AUTOINCREMENT" not in table_sql.upper()
+
+# Rebuild a SQLite records table created without AUTOINCREMENT, keeping its ids, and start its sequence past
+# every id in records and records_archive; returns whether it was rebuilt
+def _autoincrement_records(data_engine):
+    with data_engine.begin() as conn:
+        if not _records_reuse_ids(conn):
+            return False
+        high_water = max(
+            conn.execute(select(func.max(Record.id))).scalar() or 0,
+            conn.execute(select(func.max(RecordArchive.record_id))).scalar() or 0
+        )
+        # Same foreign keys as create_shard_tables on a shard, all of them on the main database
+        table = Record.__table__
+        foreign_keys = None if data_engine is engine else [
+            fk for fk in table.foreign_key_constraints if fk.referred_table.name in SHARDED_TABLES
+        ]
+        create = str(CreateTable(table, include_foreign_key_constraints=foreign_keys).compile(dialect=conn.dialect))
+        conn.execute(text(create.replace("CREATE TABLE records ", "CREATE TABLE records_rebuild ", 1)))
+        columns = ", ".join(column.name for column in table.columns)
+        conn.execute(text(f"INSERT INTO records_rebuild ({columns}) SELECT {columns} FROM records"))
+        # Dropping the old table drops its indexes and search triggers; the search index is kept
+        # (its rows are keyed by record id) and its triggers are created again by create_search_index
+        conn.execute(text("DROP TABLE records"))
+        conn.execute(text("ALTER TABLE records_rebuild RENAME TO records"))
+        for index in Record.__table__.indexes:
+            index.create(conn)
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'records'"))
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('records', :seq)"), {"seq": high_water})
+    return True
+
+def upgrade():
+    """Bring the tables of the main database and every shard up to date"""
+    dropped = _drop_float_rollups()
+    Base.metadata.create_all(bind=engine)
+    create_shard_tables()
+    ensure_columns()
+    for data_engine in data_engines():
+        if _autoincrement_records(data_engine):
+            print("Rebuilt the records table so record ids are never reused")
+        filled = backfill_amount_cents(data_engine)
+        if filled:
+            print(f"Stored the amounts of {filled} record(s) as cents")
+        indexed = create_search_index(data_engine)
+        if indexed:
+            print(f"Indexed the descriptions of {indexed} record(s) for search")
+        if data_engine in dropped:
+            with data_engine.connect() as conn:
+                user_ids = conn.execute(select(Record.user_id).distinct()).scalars().all()
+            rebuild_rollups(data_engine, user_ids)
+            print(f"Rebuilt the totals of {len(user_ids)} user(s) in cents")
+    init_db()
+
+# What upgrade() would change, one line per item; empty when the database is up to date
+def pending_upgrades():
+    pending = []
+    targets = [(engine, None)] + [(shard_engine, SHARDED_TABLES) for shard_engine in shard_engines]
+    for target, table_names in targets:
+        name = target.url.render_as_string(hide_password=True)
+        inspector = inspect(target)
+        existing = set(inspector.get_table_names())
+        for table in Base.metadata.sorted_tables:
+            if table_names is not None and table.name not in table_names:
+                continue
+            if table.name not in existing:
+                pending.append(f"{name}: table {table.name} is missing")
+                continue
+            present = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in present:
+                    pending.append(f"{name}: column {table.name}.{column.name} is missing")
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    pending.append(f"{name}: index {index.name} is missing")
+        if _float_rollups(target):
+            pending.append(f"{name}: record totals are stored as floats")
+    for data_engine in data_engines():
+        name = data_engine.url.render_as_string(hide_password=True)
+        with data_engine.connect() as conn:
+            if _records_reuse_ids(conn):
+                pending.append(f"{name}: the records table reuses ids")
+        if search_index_missing(data_engine):
+            pending.append(f"{name}: the search index is missing")
+    return pending
+
+# Refuse to run on a database that needs upgrade(), naming the command that runs it
+def check_schema():
+    pending = pending_upgrades()
+    if pending:
+        raise RuntimeError(
+            "The database needs upgrading; run `python -m app.utils.migrations` once before starting the app:\n"
+            + "\n".join(f"- {item}" for item in pending)
+        )
+
+def main():
+    argparse.ArgumentParser(description="Upgrade the main database and every shard; run once before starting the workers").parse_args()
+    upgrade()
+    print("Database is up to date")
+
+if __name__ == "__main__":
+    main()
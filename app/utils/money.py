@@ -0,0 +1,20 @@
+from decimal import Decimal
+from typing import Annotated
+from pydantic import Field
+
+# Minor units per currency unit: amounts are stored as integer cents
+CENTS_PER_UNIT = 100
+
+# Largest amount accepted by the API (exclusive); its cents stay exact as floats and fit in BIGINT
+MAX_AMOUNT = 1e13
+
+# Amount field of request schemas: finite and below MAX_AMOUNT either way, so bad values get a 422
+Amount = Annotated[float, Field(allow_inf_nan=False, gt=-MAX_AMOUNT, lt=MAX_AMOUNT)]
+
+# Convert a decimal amount (float, str or Decimal) to integer cents, rounding half to even
+def to_cents(amount) -> int:
+    return int((Decimal(str(amount)) * CENTS_PER_UNIT).to_integral_value())
+
+# Convert integer cents to the decimal amount used by the API
+def from_cents(cents: int) -> float:
+    return cents / CENTS_PER_UNIT
@@ -0,0 +1,181 @@
+from collections import Counter, deque
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+from app.utils.jwt import decode_access_token
+from app.utils.database import SessionLocal
+from app.crud.user import get_principal
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+
+# Load environment variables
+load_dotenv()
+
+# Install the profiling middleware; when off, requests pay nothing
+PROFILER_ENABLED = os.getenv("PROFILER", "False").lower() == "true"
+
+# Fraction of requests profiled without being asked (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+
+# Time between stack samples
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+# Profiles kept in memory, oldest dropped first
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "50"))
+
+# Requests profiled at the same time; extra requests run unprofiled
+PROFILE_MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "1"))
+
+# Request header an admin sends to profile that request
+PROFILE_HEADER = b"x-profile"
+
+# Groups allowed to trigger profiling through the header
+PROFILE_GROUPS = {"owner", "admin"}
+
+# Modules whose innermost frame means the thread is idle (waiting for work or I/O)
+_IDLE_MODULES = {"threading.py", "selectors.py", "queue.py"}
+
+# Describe a frame as "function (file:line)"
+def _frame_label(frame):
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+# Fold a stack into "root;...;leaf", or None for idle threads
+def fold_stack(frame):
+    if os.path.basename(frame.f_code.co_filename) in _IDLE_MODULES:
+        return None
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+class StackSampler:
+    """Samples the stacks of busy threads on a background thread.
+
+    Every sampled stack is counted in collapsed-stack form, which
+    flamegraph.pl and speedscope read directly. Samples from requests
+    served concurrently on other threads can appear in the profile too.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        sampler_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                stack = fold_stack(frame)
+                if stack:
+                    self.samples[stack] += 1
+
+class ProfileStore:
+    """Most recent request profiles, kept in process memory"""
+
+    def __init__(self, max_stored=PROFILE_MAX_STORED):
+        self._profiles = deque(maxlen=max_stored)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, method, path, status_code, duration_ms, samples):
+        profile = {
+            "id": next(self._ids),
+            "method": method,
+            "path": path,
+            "status_code": status_code,
+            "started_at": datetime.now(timezone.utc),
+            "duration_ms": round(duration_ms, 3),
+            "samples": sum(samples.values()),
+            "folded": "\n".join(f"{stack} {count}" for stack, count in samples.most_common()),
+        }
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def list(self):
+        with self._lock:
+            return [{key: value for key, value in profile.items() if key != "folded"} for profile in reversed(self._profiles)]
+
+    def get(self, profile_id):
+        with self._lock:
+            for profile in self._profiles:
+                if profile["id"] == profile_id:
+                    return profile
+        return None
+
+profile_store = ProfileStore()
+
+# Bearer token of a request that asks to be profiled, or None
+def _profile_token(scope):
+    headers = dict(scope["headers"])
+    if headers.get(PROFILE_HEADER, b"").lower() not in (b"1", b"true"):
+        return None
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    return token if scheme.lower() == "bearer" and token else None
+
+# Whether a token belongs to a user who may profile; groups are checked as they are now, not as the token says
+def _admin_token(token):
+    payload = decode_access_token(token)
+    if payload is None or payload.get("sub") is None:
+        return False
+    with SessionLocal() as db:
+        user = get_principal(db, payload["sub"])
+    return user is not None and any(group.name in PROFILE_GROUPS for group in user.groups)
+
+class ProfilerMiddleware:
+    """ASGI middleware that runs a stack sampler for selected requests"""
+
+    def __init__(self, app):
+        self.app = app
+        self._slots = threading.BoundedSemaphore(PROFILE_MAX_CONCURRENT)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        selected = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+        if not selected:
+            token = _profile_token(scope)
+            selected = token is not None and await run_in_threadpool(_admin_token, token)
+        if not selected or not self._slots.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        sampler = StackSampler()
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            # Waits for the sampler's current pass; not on the event loop
+            await run_in_threadpool(sampler.stop)
+            self._slots.release()
+            profile_store.add(scope["method"], scope["path"], status_code, duration_ms, sampler.samples)
@@ -0,0 +1,188 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from dotenv import load_dotenv
+import json
+import logging
+import os
+import re
+import time
+
+# Load environment variables
+load_dotenv()
+
+# Development/staging instrumentation, off by default
+QUERY_INSPECTOR_ENABLED = os.getenv("QUERY_INSPECTOR", "False").lower() == "true"
+
+# Same statement shape repeated this many times in one request is reported as a probable N+1
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+
+# Statements slower than this are logged with their EXPLAIN plan
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+
+# Fail requests that exceed their query budget instead of only logging them
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "False").lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+# EXPLAIN prefix per dialect
+EXPLAIN_PREFIXES = {
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "postgresql": "EXPLAIN ",
+    "mysql": "EXPLAIN ",
+}
+
+_IN_LIST = re.compile(r"\bIN\s*\((?:[^()]|\([^()]*\))*\)", re.IGNORECASE)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+# Reduce a statement to its shape so repeats with different values compare equal
+def statement_shape(statement):
+    shape = _IN_LIST.sub("IN (?)", statement)
+    shape = _STRING_LITERAL.sub("?", shape)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+class QueryTracker:
+    """Statements issued while serving one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.shapes = Counter()
+        self.budget = None
+
+    def record(self, statement):
+        self.count += 1
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated_shapes(self, threshold=QUERY_REPEAT_THRESHOLD):
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def over_budget(self):
+        return self.budget is not None and self.count > self.budget
+
+# Tracker of the request being served
+current_query_tracker: ContextVar = ContextVar("current_query_tracker", default=None)
+
+# Run EXPLAIN for a statement on the connection that executed it
+def explain_statement(conn, statement, parameters):
+    prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+    if prefix is None:
+        return None
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [tuple(row) for row in cursor.fetchall()]
+    except Exception as e:
+        return [f"EXPLAIN failed: {e}"]
+    finally:
+        cursor.close()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("inspector_start_time", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["inspector_start_time"].pop()) * 1000
+    tracker = current_query_tracker.get()
+    if tracker is not None:
+        tracker.record(statement)
+
+    if elapsed_ms > SLOW_QUERY_MS:
+        plan = None
+        if not executemany and statement.lstrip()[:6].upper() == "SELECT":
+            plan = explain_statement(conn, statement, parameters)
+        logger.warning("Slow query (%.1f ms): %s\nParameters: %r\nPlan: %s", elapsed_ms, statement, parameters, plan)
+
+# Track statements on an engine (only called when the inspector is enabled)
+def inspect_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+# Dependency declaring how many statements a route may issue
+def query_budget(max_queries: int):
+    async def dependency():
+        tracker = current_query_tracker.get()
+        if tracker is not None:
+            tracker.budget = max_queries
+    return dependency
+
+class QueryCounter:
+    """Statements seen by count_queries"""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+# Count every statement executed on an engine inside the block, for tests
+@contextmanager
+def count_queries(engine):
+    counter = QueryCounter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "after_cursor_execute", after_cursor_execute)
+
+class QueryInspectorMiddleware:
+    """ASGI middleware reporting N+1 patterns and query budgets per request.
+
+    Adds an ``X-Query-Count`` header to every response. When
+    QUERY_BUDGET_STRICT is on, a response from a route that exceeded its
+    ``query_budget`` is replaced by a 500 error so tests fail loudly.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        tracker = QueryTracker()
+        token = current_query_tracker.set(tracker)
+        replaced = False
+
+        async def send_wrapper(message):
+            nonlocal replaced
+            if message["type"] == "http.response.start":
+                route = f"{scope['method']} {scope['path']}"
+                for shape, count in tracker.repeated_shapes():
+                    logger.warning("Probable N+1 on %s: %d x %s", route, count, shape)
+
+                if tracker.over_budget():
+                    detail = f"Query budget exceeded on {route}: {tracker.count} > {tracker.budget}"
+                    logger.warning(detail)
+                    if QUERY_BUDGET_STRICT:
+                        replaced = True
+                        body = json.dumps({"detail": detail}).encode("utf-8")
+                        await send({
+                            "type": "http.response.start",
+                            "status": 500,
+                            "headers": [
+                                (b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode()),
+                                (b"x-query-count", str(tracker.count).encode()),
+                            ],
+                        })
+                        await send({"type": "http.response.body", "body": body})
+                        return
+
+                message["headers"] = list(message.get("headers", [])) + [(b"x-query-count", str(tracker.count).encode())]
+            elif replaced:
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_query_tracker.reset(token)
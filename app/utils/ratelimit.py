@@ -0,0 +1,136 @@
+from collections import OrderedDict
+from fastapi import HTTPException, Request, status
+from dotenv import load_dotenv
+from app.utils.metrics import Counter
+import math
+import os
+import sqlite3
+import threading
+import time
+
+# Load environment variables
+load_dotenv()
+
+# Where buckets live: "memory" (per process) or "sqlite:///path" (shared by workers on one host)
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")
+
+# Limits as "requests/seconds"
+LOGIN_RATE_LIMIT_IP = os.getenv("LOGIN_RATE_LIMIT_IP", "20/60")
+LOGIN_RATE_LIMIT_USERNAME = os.getenv("LOGIN_RATE_LIMIT_USERNAME", "5/60")
+REGISTER_RATE_LIMIT_IP = os.getenv("REGISTER_RATE_LIMIT_IP", "5/600")
+
+# Take the client IP from X-Forwarded-For (only behind a trusted proxy). Each proxy appends the
+# address it got the request from, so the client IP is the entry TRUSTED_PROXY_HOPS from the right
+# (the number of proxies in front of the app); entries further left are whatever the client sent.
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "False").lower() == "true"
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+if TRUSTED_PROXY_HOPS < 1:
+    raise ValueError("TRUSTED_PROXY_HOPS must be at least 1")
+
+RATE_LIMITED_TOTAL = Counter("duckpay_rate_limited_total", "Requests rejected by a rate limit", ("limit",))
+
+class RateLimit:
+    """Token bucket holding up to `capacity` tokens, refilled over `period` seconds"""
+
+    def __init__(self, name, capacity, period):
+        self.name = name
+        self.capacity = capacity
+        self.rate = capacity / period
+
+    @classmethod
+    def parse(cls, name, spec):
+        capacity, period = spec.split("/")
+        return cls(name, int(capacity), float(period))
+
+# Refill a bucket and try to take one token; returns (tokens left, seconds until a token is free)
+def _take(tokens, updated, now, limit):
+    tokens = min(limit.capacity, tokens + (now - updated) * limit.rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / limit.rate
+
+class MemoryBucketStore:
+    """Buckets in process memory; the least recently used are dropped past max_keys"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, limit):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (limit.capacity, now))
+            tokens, retry_after = _take(tokens, updated, now, limit)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+class SQLiteBucketStore:
+    """Buckets in a local SQLite file, so several workers share one set of counters"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, limit):
+        # Wall clock, since the counters are shared between processes
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (limit.capacity, now)
+            tokens, retry_after = _take(tokens, updated, now, limit)
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return retry_after
+
+# Create the bucket store named by RATE_LIMIT_STORE
+def create_bucket_store(spec=RATE_LIMIT_STORE):
+    if spec.startswith("sqlite:///"):
+        return SQLiteBucketStore(spec[len("sqlite:///"):])
+    return MemoryBucketStore()
+
+bucket_store = create_bucket_store()
+
+login_ip_limit = RateLimit.parse("login_ip", LOGIN_RATE_LIMIT_IP)
+login_username_limit = RateLimit.parse("login_username", LOGIN_RATE_LIMIT_USERNAME)
+register_ip_limit = RateLimit.parse("register_ip", REGISTER_RATE_LIMIT_IP)
+
+# Client IP of a request
+def client_ip(request: Request):
+    if TRUST_FORWARDED_FOR:
+        forwarded_for = request.headers.get("x-forwarded-for")
+        if forwarded_for:
+            addresses = [address.strip() for address in forwarded_for.split(",")]
+            # Fewer entries than proxies: the request did not come through all of them
+            if len(addresses) >= TRUSTED_PROXY_HOPS:
+                return addresses[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+# Take a token for each (limit, key) in order, raising 429 on the first empty bucket
+def enforce_rate_limits(*checks):
+    for limit, key in checks:
+        retry_after = bucket_store.take(f"{limit.name}:{key}", limit)
+        if retry_after > 0:
+            RATE_LIMITED_TOTAL.inc(limit.name)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please try again later",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
@@ -0,0 +1,273 @@
+"""Scheduler recording the occurrences of recurring rules.
+
+Every worker keeps a min-heap of (next due time, shard, rule id) and its
+scheduler thread sleeps until the earliest entry is due. Due rules are
+processed in batches: each rule's occurrences up to now are computed from
+its cron schedule, the rule is claimed by moving ``next_run_at`` past
+them with a conditional update (only if it still holds the value read),
+and the records of all claimed rules are inserted with one statement,
+together with their running totals, in the same transaction.
+
+Because the claim and the records commit together, an occurrence is
+recorded exactly once: by whichever worker wins the claim, and after any
+downtime by the first pass once the app is back (at most
+``RECURRING_MAX_CATCH_UP`` occurrences per rule and pass, the rest in the
+following passes).
+
+Rules of a user being moved to another shard are skipped (and retried once
+the directory entries have drained); the move announces them on the target
+when it is done. The move waits ``SHARD_CACHE_TTL`` + 1 seconds after
+flagging the user before copying, so a pass that read the flag before it
+was set has that long to commit.
+
+New or changed rules are announced to every worker over the cache's
+publish channel; the heap is also reloaded from the database every
+``RECURRING_REFRESH_SECONDS`` in case a message was lost or a user moved
+to another shard.
+"""
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from app.utils.database import engine, shard_engines
+from app.crud.budget import check_budget_alerts
+from app.crud.recurring import as_utc
+from app.crud.rollup import add_record_delta, apply_rollup_deltas
+from app.models.record import Record
+from app.models.recurring import RecurringRule
+from app.utils.cache import publish, subscribe
+from app.utils.cron import CronSchedule
+from app.utils.metrics import Counter
+from app.utils.money import from_cents
+from app.utils.shards import SHARD_CACHE_TTL, users_away
+import heapq
+import logging
+import os
+import threading
+import time
+
+# Load environment variables
+load_dotenv()
+
+# Run the scheduler in this process (disable in workers that should not write records)
+RECURRING_ENABLED = os.getenv("RECURRING_ENABLED", "true").lower() == "true"
+
+# Longest time between reloads of the heap from the database
+RECURRING_REFRESH_SECONDS = float(os.getenv("RECURRING_REFRESH_SECONDS", "300"))
+
+# Rules processed per transaction
+RECURRING_BATCH_SIZE = int(os.getenv("RECURRING_BATCH_SIZE", "500"))
+
+# Occurrences of one rule recorded per pass when catching up
+RECURRING_MAX_CATCH_UP = int(os.getenv("RECURRING_MAX_CATCH_UP", "1000"))
+
+logger = logging.getLogger(__name__)
+
+RECURRING_RECORDS = Counter("duckpay_recurring_records_total", "Records created from recurring rules by this worker")
+
+_CHANNEL = "recurring"
+
+# Engines holding rules and records: every shard, or the main database when sharding is off
+def _engines():
+    return list(shard_engines) or [engine]
+
+@lru_cache(maxsize=1024)
+def _schedule(expression):
+    return CronSchedule(expression)
+
+def _now():
+    return datetime.now(timezone.utc)
+
+def materialize(data_engine, rule_ids, now: datetime = None):
+    """Record the occurrences due by now of the given rules on one engine.
+
+    Returns the records created and the (rule id, next due time) of every
+    rule processed, whether this call or another worker claimed it. Rules
+    of users being moved off this shard are left alone and come back due
+    once the move's drain is over.
+    """
+    now = now or _now()
+    engines = _engines()
+    shard = engines.index(data_engine) if data_engine in engines else None
+    retry_at = now + timedelta(seconds=SHARD_CACHE_TTL + 1)
+    created = 0
+    next_runs = []
+    rule_ids = list(rule_ids)
+    for start in range(0, len(rule_ids), RECURRING_BATCH_SIZE):
+        batch = rule_ids[start:start + RECURRING_BATCH_SIZE]
+        with Session(bind=data_engine) as db:
+            rules = db.query(RecurringRule).filter(
+                RecurringRule.id.in_(batch),
+                RecurringRule.enabled == True,
+                RecurringRule.next_run_at <= now
+            ).all()
+            if shard is not None:
+                away = users_away([rule.user_id for rule in rules], shard)
+                next_runs.extend((rule.id, retry_at) for rule in rules if rule.user_id in away)
+                rules = [rule for rule in rules if rule.user_id not in away]
+            rows = []
+            deltas = {}
+            for rule in rules:
+                claimed_at = rule.next_run_at
+                end_at = as_utc(rule.end_at)
+                runs = []
+                run = as_utc(claimed_at)
+                while run is not None and run <= now and len(runs) < RECURRING_MAX_CATCH_UP:
+                    if end_at is not None and run > end_at:
+                        run = None
+                        break
+                    runs.append(run)
+                    run = _schedule(rule.schedule).next_after(run)
+                if run is not None and end_at is not None and run > end_at:
+                    run = None
+                # Claim: only the worker that still sees the value it read moves the rule on
+                claimed = db.query(RecurringRule).filter(
+                    RecurringRule.id == rule.id, RecurringRule.next_run_at == claimed_at
+                ).update({RecurringRule.next_run_at: run}, synchronize_session=False)
+                if not claimed:
+                    continue
+                next_runs.append((rule.id, run))
+                for moment in runs:
+                    rows.append({
+                        "amount_cents": rule.amount_cents,
+                        "amount": from_cents(rule.amount_cents),
+                        "type": rule.type,
+                        "description": rule.description,
+                        "date": moment,
+                        "user_id": rule.user_id,
+                        "category_id": rule.category_id,
+                        "ledger_id": rule.ledger_id,
+                    })
+                    add_record_delta(deltas, rule.user_id, rule.ledger_id, rule.category_id, rule.type, rule.amount_cents, moment)
+            if rows:
+                db.execute(insert(Record.__table__), rows)
+            totals = apply_rollup_deltas(db, deltas)
+            db.commit()
+            check_budget_alerts(db, deltas, totals)
+        created += len(rows)
+        RECURRING_RECORDS.inc(amount=len(rows))
+    return created, next_runs
+
+class RecurringScheduler:
+    """Min-heap of rules by next due time, and a thread that wakes when the earliest is due"""
+
+    def __init__(self, refresh_seconds=RECURRING_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._heap = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._reload_at = 0.0
+
+    def _load(self):
+        heap = []
+        for shard, data_engine in enumerate(_engines()):
+            with Session(bind=data_engine) as db:
+                for rule_id, next_run_at in db.query(RecurringRule.id, RecurringRule.next_run_at).filter(
+                    RecurringRule.enabled == True, RecurringRule.next_run_at.isnot(None)
+                ):
+                    heap.append((as_utc(next_run_at), shard, rule_id))
+        heapq.heapify(heap)
+        with self._condition:
+            self._heap = heap
+            self._reload_at = time.monotonic() + self.refresh_seconds
+            self._condition.notify()
+
+    def schedule(self, shard, rule_id: int, due: datetime):
+        """Wake this worker's scheduler for a rule due at due"""
+        if due is None:
+            return
+        with self._condition:
+            heapq.heappush(self._heap, (as_utc(due), shard or 0, rule_id))
+            self._condition.notify()
+
+    def _on_message(self, message):
+        shard, rule_id, due = message
+        self.schedule(shard, rule_id, datetime.fromtimestamp(due, timezone.utc))
+
+    def _take_due(self):
+        """Wait until entries are due and pop them grouped by shard; None when the heap should be reloaded"""
+        with self._condition:
+            while not self._stopped:
+                now = _now()
+                if self._heap and self._heap[0][0] <= now:
+                    break
+                timeout = self._reload_at - time.monotonic()
+                if timeout <= 0:
+                    return None
+                if self._heap:
+                    timeout = min(timeout, (self._heap[0][0] - now).total_seconds())
+                self._condition.wait(max(timeout, 0.01))
+            else:
+                return {}
+            due = {}
+            while self._heap and self._heap[0][0] <= now:
+                _, shard, rule_id = heapq.heappop(self._heap)
+                due.setdefault(shard, set()).add(rule_id)
+            return due
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                due = self._take_due()
+                if due is None:
+                    self._load()
+                    continue
+                engines = _engines()
+                for shard, rule_ids in due.items():
+                    if shard >= len(engines):
+                        continue
+                    created, next_runs = materialize(engines[shard], rule_ids)
+                    if created:
+                        logger.info("Recorded %d recurring occurrence(s)", created)
+                    with self._condition:
+                        for rule_id, run in next_runs:
+                            if run is not None:
+                                heapq.heappush(self._heap, (run, shard, rule_id))
+            except Exception:
+                logger.exception("Recurring rules could not be processed")
+                # Wait, then start over from the database rather than retrying in a tight loop
+                with self._condition:
+                    self._condition.wait(min(self.refresh_seconds, 60))
+                self._load_quietly()
+
+    def _load_quietly(self):
+        try:
+            self._load()
+        except Exception:
+            logger.exception("Could not load recurring rules")
+
+    def start(self):
+        """Load the heap, catching up on everything due, and start the scheduler thread"""
+        if not RECURRING_ENABLED or self._thread is not None:
+            return
+        self._stopped = False
+        self._load_quietly()
+        self._thread = threading.Thread(target=self._run, name="recurring", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread = None
+
+recurring_scheduler = RecurringScheduler()
+subscribe(_CHANNEL, recurring_scheduler._on_message)
+
+# Tell the scheduler of every worker that a rule is next due at due
+def announce_rule(shard, rule_id: int, due: datetime):
+    if due is None:
+        return
+    recurring_scheduler.schedule(shard, rule_id, due)
+    publish(_CHANNEL, (shard or 0, rule_id, as_utc(due).timestamp()))
+
+# Announce every enabled rule of a user, after their rules changed shard
+def announce_user_rules(shard, user_id: int):
+    with Session(bind=_engines()[shard or 0]) as db:
+        rules = db.query(RecurringRule.id, RecurringRule.next_run_at).filter(
+            RecurringRule.user_id == user_id, RecurringRule.enabled == True, RecurringRule.next_run_at.isnot(None)
+        ).all()
+    for rule_id, next_run_at in rules:
+        announce_rule(shard, rule_id, next_run_at)
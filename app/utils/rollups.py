@@ -0,0 +1,152 @@
+"""Consistency check and repair of the record totals in ``record_rollups``.
+
+Record writes keep the totals current in the same transaction. This module
+recomputes them from the records, archived ones included, to find and fix
+drift after bulk imports, manual edits or a bug:
+
+    python -m app.utils.rollups check [--user-id 42]
+    python -m app.utils.rollups repair [--user-id 42]
+
+Admins can run a repair in the background as the ``rebuild_rollups`` job.
+A repair rewrites the totals of each inconsistent user in one transaction;
+records written by that user while it runs may need another pass.
+"""
+from sqlalchemy import select, insert, delete, func
+from app.utils.database import engine, shard_engines
+from app.crud.rollup import ALL_TIME, ROLLUP_TYPES, ROLLUP_COLUMNS, add_to_buckets
+from app.models.record import Record
+from app.models.archive import RecordArchive
+from app.models.rollup import RecordRollup
+from app.utils.jobs import job_handler
+from app.utils.shards import users_away
+import argparse
+import json
+import sys
+
+# Engines holding records: every shard, or the main database when sharding is off
+def data_engines():
+    return list(shard_engines) or [engine]
+
+# SQL expression for the month of a date, YYYY-MM (UTC)
+def _month(dialect_name, column):
+    if dialect_name == "sqlite":
+        return func.strftime("%Y-%m", column)
+    if dialect_name == "postgresql":
+        return func.to_char(func.timezone("UTC", column), "YYYY-MM")
+    return func.date_format(column, "%Y-%m")
+
+# Totals computed from the records, archived ones included, by bucket
+def expected_rollups(conn, user_ids=None):
+    expected = {}
+    for model in (Record, RecordArchive):
+        month = _month(conn.dialect.name, model.date)
+        query = select(
+            model.user_id, model.ledger_id, model.category_id, model.type, month, func.sum(model.amount_cents), func.count()
+        ).where(model.type.in_(ROLLUP_TYPES)).group_by(
+            model.user_id, model.ledger_id, model.category_id, model.type, month
+        )
+        if user_ids is not None:
+            query = query.where(model.user_id.in_(user_ids))
+        for user_id, ledger_id, category_id, type, period, amount_cents, count in conn.execute(query):
+            add_to_buckets(expected, user_id, ledger_id, category_id, type, period, int(amount_cents), count)
+    return expected
+
+# Totals as stored, by bucket
+def stored_rollups(conn, user_ids=None):
+    query = select(
+        RecordRollup.user_id, RecordRollup.ledger_id, RecordRollup.category_id, RecordRollup.period,
+        *(getattr(RecordRollup, name) for name in ROLLUP_COLUMNS)
+    )
+    if user_ids is not None:
+        query = query.where(RecordRollup.user_id.in_(user_ids))
+    return {tuple(row[:4]): list(row[4:]) for row in conn.execute(query)}
+
+# Buckets whose stored totals differ from the records, as (bucket, expected, stored)
+def find_mismatches(expected, stored):
+    empty = [0, 0, 0, 0]
+    return [
+        (bucket, expected.get(bucket, empty), stored.get(bucket, empty))
+        for bucket in sorted(set(expected) | set(stored), key=str)
+        if list(expected.get(bucket, empty)) != list(stored.get(bucket, empty))
+    ]
+
+# Replace the stored totals of users with the expected ones
+def _rewrite(conn, user_ids, expected):
+    conn.execute(delete(RecordRollup).where(RecordRollup.user_id.in_(user_ids)))
+    rows = [
+        dict(zip(("user_id", "ledger_id", "category_id", "period"), bucket), **dict(zip(ROLLUP_COLUMNS, totals)))
+        for bucket, totals in expected.items() if bucket[0] in user_ids and any(totals)
+    ]
+    if rows:
+        conn.execute(insert(RecordRollup), rows)
+
+def check_rollups(user_id: int = None):
+    """Return the inconsistent buckets of every shard (or of one user)"""
+    user_ids = None if user_id is None else [user_id]
+    mismatches = []
+    for data_engine in data_engines():
+        with data_engine.connect() as conn:
+            mismatches.extend(find_mismatches(expected_rollups(conn, user_ids), stored_rollups(conn, user_ids)))
+    return mismatches
+
+def repair_rollups(user_id: int = None):
+    """Recompute the totals of every inconsistent user (or of one user); returns the users repaired.
+
+    Users being moved to another shard, or whose rows are left over on a shard they moved off,
+    are skipped."""
+    repaired = set()
+    for shard, data_engine in enumerate(data_engines()):
+        with data_engine.connect() as conn:
+            candidates = {
+                bucket[0] for bucket, _, _ in find_mismatches(
+                    expected_rollups(conn, None if user_id is None else [user_id]),
+                    stored_rollups(conn, None if user_id is None else [user_id])
+                )
+            }
+        candidates -= users_away(candidates, shard)
+        for candidate in sorted(candidates):
+            with data_engine.begin() as conn:
+                _rewrite(conn, {candidate}, expected_rollups(conn, [candidate]))
+            repaired.add(candidate)
+    return sorted(repaired)
+
+def rebuild_rollups(data_engine, user_ids):
+    """Recompute the totals of users on one engine, e.g. after a bulk insert of their records"""
+    user_ids = set(user_ids)
+    with data_engine.begin() as conn:
+        _rewrite(conn, user_ids, expected_rollups(conn, list(user_ids)))
+
+# Reject a user_id that is not a whole number before the job is queued
+def _validate_rebuild_params(params):
+    user_id = params.get("user_id")
+    if user_id is not None and (isinstance(user_id, bool) or not str(user_id).isdigit()):
+        raise ValueError("user_id must be a user id")
+
+@job_handler("rebuild_rollups", admin_only=True, validate=_validate_rebuild_params)
+def rebuild_rollups_job(context):
+    """Repair the totals of every user, or of params["user_id"]"""
+    user_id = context.params.get("user_id")
+    repaired = repair_rollups(int(user_id) if user_id is not None else None)
+    context.progress(1.0)
+    with open(context.result_file(".json"), "w", encoding="utf-8") as f:
+        json.dump({"users_repaired": repaired}, f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check or repair the record totals used for balances")
+    parser.add_argument("command", choices=["check", "repair"])
+    parser.add_argument("--user-id", type=int, default=None, help="only this user (default: everyone)")
+    args = parser.parse_args()
+
+    from app.utils.migrations import check_schema
+    check_schema()
+    if args.command == "check":
+        mismatches = check_rollups(args.user_id)
+        for (user_id, ledger_id, category_id, period), expected, stored in mismatches[:50]:
+            print(f"user {user_id} ledger {ledger_id} category {category_id} {period}: expected {expected}, stored {stored}")
+        print(f"{len(mismatches)} inconsistent bucket(s)")
+        sys.exit(1 if mismatches else 0)
+    repaired = repair_rollups(args.user_id)
+    print(f"Repaired the totals of {len(repaired)} user(s)")
+
+if __name__ == "__main__":
+    main()
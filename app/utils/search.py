@@ -0,0 +1,140 @@
+"""Full-text search over record descriptions, on the database's own index.
+
+- SQLite: a contentless FTS5 table ``records_fts`` holding the words of
+  every described record plus a scope token (``u<user_id>l<ledger_id>``,
+  0 for a user's own data), so a search only walks the postings of one
+  user's or ledger's records. Triggers on ``records`` keep it in sync with
+  every write, bulk inserts and shard moves included.
+- PostgreSQL: a GIN index on ``to_tsvector('simple', description)``, which
+  PostgreSQL maintains itself.
+- Other databases, or SQLite builds without FTS5, fall back to LIKE.
+
+Every word of a search must match the start of a word of the description
+("cof" finds "Morning coffee"); results are ranked by relevance, then date.
+``create_search_index()`` runs from ``upgrade()`` (the migrate step) and indexes the records
+already there.
+"""
+from sqlalchemy import func, inspect, literal_column, table, column, text
+from functools import lru_cache
+from app.models.record import Record
+import logging
+import re
+import sqlite3
+
+# Words of a search that are matched; the rest are ignored
+MAX_SEARCH_WORDS = 8
+
+logger = logging.getLogger(__name__)
+
+_FTS_TABLE = "records_fts"
+
+_fts = table(_FTS_TABLE, column("rowid"))
+
+# Scope token of a record row in trigger bodies ("new" or "old")
+def _scope_sql(row):
+    return f"'u' || {row}.user_id || 'l' || coalesce({row}.ledger_id, 0)"
+
+def _fts_insert(row):
+    return (
+        f"INSERT INTO {_FTS_TABLE}(rowid, description, scope) "
+        f"SELECT {row}.id, {row}.description, {_scope_sql(row)} WHERE {row}.description IS NOT NULL;"
+    )
+
+def _fts_delete(row):
+    # A contentless table forgets a row only when given the values it indexed
+    return (
+        f"INSERT INTO {_FTS_TABLE}({_FTS_TABLE}, rowid, description, scope) "
+        f"SELECT 'delete', {row}.id, {row}.description, {_scope_sql(row)} WHERE {row}.description IS NOT NULL;"
+    )
+
+_SQLITE_TRIGGERS = (
+    f"CREATE TRIGGER IF NOT EXISTS records_fts_insert AFTER INSERT ON records BEGIN {_fts_insert('new')} END",
+    f"CREATE TRIGGER IF NOT EXISTS records_fts_delete AFTER DELETE ON records BEGIN {_fts_delete('old')} END",
+    f"CREATE TRIGGER IF NOT EXISTS records_fts_update AFTER UPDATE OF description, user_id, ledger_id ON records "
+    f"BEGIN {_fts_delete('old')} {_fts_insert('new')} END",
+)
+
+# Same expression in the index and the queries, so PostgreSQL can use the index
+_PG_DOCUMENT = "to_tsvector('simple'::regconfig, coalesce(description, ''))"
+
+# Whether this Python's SQLite is built with FTS5
+@lru_cache(maxsize=1)
+def fts5_available():
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("CREATE VIRTUAL TABLE probe USING fts5(text)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+def _sqlite_has_fts(conn):
+    return conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": _FTS_TABLE}
+    ).first() is not None
+
+# Whether a SQLite engine holding records lacks the index its searches join
+def search_index_missing(data_engine):
+    if data_engine.dialect.name != "sqlite" or not fts5_available():
+        return False
+    if "records" not in inspect(data_engine).get_table_names():
+        return False
+    with data_engine.connect() as conn:
+        return not _sqlite_has_fts(conn)
+
+def create_search_index(data_engine):
+    """Create the description index of an engine holding records; returns the records indexed, if any"""
+    dialect_name = data_engine.dialect.name
+    if "records" not in inspect(data_engine).get_table_names():
+        return 0
+    if dialect_name == "postgresql":
+        with data_engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_records_description_search ON records USING gin ({_PG_DOCUMENT})"))
+        return 0
+    if dialect_name != "sqlite":
+        return 0
+    if not fts5_available():
+        logger.warning("SQLite is built without FTS5; record search falls back to LIKE")
+        return 0
+    indexed = 0
+    with data_engine.begin() as conn:
+        if not _sqlite_has_fts(conn):
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE {_FTS_TABLE} USING fts5("
+                "description, scope, content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            ))
+            indexed = conn.execute(text(
+                f"INSERT INTO {_FTS_TABLE}(rowid, description, scope) "
+                f"SELECT id, description, {_scope_sql('records')} FROM records WHERE description IS NOT NULL"
+            )).rowcount
+        for statement in _SQLITE_TRIGGERS:
+            conn.execute(text(statement))
+    return indexed
+
+# Lowercased words of a search
+def search_words(q: str):
+    return re.findall(r"\w+", q.casefold())[:MAX_SEARCH_WORDS]
+
+def _sqlite_match(words, user_id, ledger_id):
+    # Quoted, so the words cannot be read as FTS5 syntax
+    terms = " ".join(f'"{word}"*' for word in words)
+    return f'scope : "u{user_id}l{ledger_id or 0}" AND description : ({terms})'
+
+def apply_search(query, bind, words, user_id: int, ledger_id: int = None):
+    """Restrict a records query (already scoped to the user or ledger) to descriptions matching words, best first"""
+    dialect_name = bind.dialect.name
+    if dialect_name == "sqlite" and fts5_available():
+        query = query.join(_fts, _fts.c.rowid == Record.id).filter(
+            text(f"{_FTS_TABLE} MATCH :search_match").bindparams(search_match=_sqlite_match(words, user_id, ledger_id))
+        )
+        # Rank by the description column only
+        return query.order_by(text(f"bm25({_FTS_TABLE}, 1.0, 0.0)"), Record.date.desc())
+    if dialect_name == "postgresql":
+        document = literal_column(_PG_DOCUMENT.replace("description", "records.description"))
+        tsquery = func.to_tsquery(literal_column("'simple'::regconfig"), " & ".join(f"{word}:*" for word in words))
+        return query.filter(document.op("@@")(tsquery)).order_by(func.ts_rank(document, tsquery).desc(), Record.date.desc())
+    description = func.lower(Record.description)
+    for word in words:
+        query = query.filter(description.contains(word, autoescape=True))
+    return query.order_by(Record.date.desc())
@@ -0,0 +1,110 @@
+from datetime import timezone
+from functools import lru_cache
+from types import UnionType
+from typing import Optional, Union, get_args, get_origin
+from fastapi import Response
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError:  # pydantic_core produces the same bytes, only slower
+    orjson = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # Arrow responses are unavailable without pyarrow
+    pyarrow = None
+
+# Media types of the compact columnar formats
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.duckpay.columnar+json"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Integer codes used for record types in columnar responses
+TYPE_CODES = {"expense": 0, "income": 1}
+
+# orjson writes 1e20 where pydantic writes 1e+20; payloads with floats this large use pydantic's encoder
+_EXPONENT_FLOAT = 1e16
+
+# Field names of a response schema (or of a subset of its fields) in JSON order, and the positions of its float fields
+@lru_cache(maxsize=None)
+def schema_layout(schema, names=None):
+    names = tuple(schema.model_fields) if names is None else tuple(names)
+    float_indexes = []
+    for index, name in enumerate(names):
+        annotation = schema.model_fields[name].annotation
+        if get_origin(annotation) in (Union, UnionType):
+            annotation = next((arg for arg in get_args(annotation) if arg is not type(None)), None)
+        if annotation is float:
+            float_indexes.append(index)
+    return names, tuple(float_indexes)
+
+# Encode JSON content the way FastAPI encodes response models
+def dumps(content, exact=False):
+    if exact or orjson is None:
+        return to_json(content)
+    return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
+def encode_rows(schema, rows, names=None):
+    """Encode column tuples, selected in schema field order, as a JSON list of schema objects.
+
+    Produces the same bytes as returning the rows as ORM objects with
+    ``response_model=List[schema]``, without building a model per row.
+    ``names`` (a tuple) encodes rows holding only those fields.
+    """
+    names, float_indexes = schema_layout(schema, names)
+    exact = False
+    items = []
+    for row in rows:
+        item = dict(zip(names, row))
+        for index in float_indexes:
+            value = row[index]
+            if value is not None:
+                value = float(value)
+                exact = exact or abs(value) >= _EXPONENT_FLOAT
+                item[names[index]] = value
+        items.append(item)
+    return dumps(items, exact)
+
+# JSON response from already encoded bytes
+def json_response(content: bytes, status_code: int = 200, headers: Optional[dict] = None):
+    return Response(content=content, status_code=status_code, headers=headers, media_type="application/json")
+
+# Values of the format query parameter
+RESPONSE_FORMATS = ("json", "columnar", "arrow")
+
+# Pick the response format: an explicit format query parameter first, then the Accept header
+def negotiate_format(format: Optional[str] = None, accept: Optional[str] = None):
+    if format is not None:
+        if format not in RESPONSE_FORMATS:
+            raise ValueError(f"Unknown response format: {format}")
+        return format
+    accept = accept or ""
+    if ARROW_STREAM_MEDIA_TYPE in accept:
+        return "arrow"
+    if COLUMNAR_JSON_MEDIA_TYPE in accept:
+        return "columnar"
+    return "json"
+
+# Seconds since the epoch; naive datetimes are stored in UTC
+def epoch_seconds(value):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+def encode_columnar(columns, media_type):
+    """Encode parallel arrays as columnar JSON or an Arrow IPC stream.
+
+    ``columns`` maps a column name to ``(values, arrow_type)``, where the
+    Arrow type is an alias such as ``"int64"``, used only for Arrow.
+    """
+    if media_type == ARROW_STREAM_MEDIA_TYPE:
+        table = pyarrow.table({name: pyarrow.array(values, type=pyarrow.type_for_alias(arrow_type)) for name, (values, arrow_type) in columns.items()})
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    count = len(next(iter(columns.values()))[0]) if columns else 0
+    return dumps({"count": count, **{name: values for name, (values, arrow_type) in columns.items()}})
@@ -0,0 +1,271 @@
+"""Per-user shards: directory lookups, request dependencies and the move tool.
+
+The ``user_shards`` table in the main database maps each user to a shard.
+Users get a shard (``user_id % shard count``) the first time their data is
+touched, and can be moved with
+
+    python -m app.utils.shards move --user-id 42 --to 1
+    python -m app.utils.shards status
+
+A move flags the user as moving (their requests get 503), waits for every
+worker's cached directory entry to expire, copies the rows of every sharded
+table to the target, switches the directory entry, then deletes the rows
+from the source. Shared ledgers keep their rows under the owner's user_id,
+so they move with their owner.
+
+A move renumbers the user's rows: integer primary keys are reassigned on
+the target, and foreign keys between sharded tables (and columns naming a
+sharded table in ``info["remap"]``) are remapped to match. Record,
+category, rule and budget ids seen by clients change, so bookmarked URLs,
+replayed Idempotency-Key responses and finished export files name the old
+ids afterwards. Archived records are restored into ``records`` first, so
+they get new ids too, and archived again on the target afterwards.
+
+Default categories (no user_id) the user's rows refer to are matched on
+the target by their columns, and copied there when it has none; they stay
+on the source for everyone else. A reference to any other row the user
+does not own stops the move before anything is switched.
+"""
+from fastapi import HTTPException, status
+from sqlalchemy import select, insert, delete, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from app.utils.database import Base, SessionLocal, SHARDED_TABLES, engine, shard_engines
+from app.crud.category import invalidate_user_categories, invalidate_ledger_categories
+from app.utils.cache import Cache
+from app.models.shard import UserShard
+from app.models.ledger import Ledger
+import argparse
+import os
+import time
+
+# Load environment variables
+load_dotenv()
+
+# How long workers cache a user's shard; a move waits this long before copying
+SHARD_CACHE_TTL = float(os.getenv("SHARD_CACHE_TTL", "5"))
+
+# Rows copied per statement when moving a user
+MOVE_BATCH_SIZE = 1000
+
+shard_cache = Cache("shards", ttl=SHARD_CACHE_TTL)
+
+# Directory entry of a user as (shard, moving), assigning a shard on first use
+def lookup_shard(user_id: int):
+    def load():
+        with SessionLocal() as db:
+            entry = db.get(UserShard, user_id)
+            if entry is None:
+                entry = UserShard(user_id=user_id, shard=user_id % len(shard_engines), moving=False)
+                db.add(entry)
+                try:
+                    db.commit()
+                except IntegrityError:
+                    # Another worker assigned it first
+                    db.rollback()
+                    entry = db.get(UserShard, user_id)
+            return entry.shard, entry.moving
+    return shard_cache.get_or_set(user_id, load)
+
+# Shard number of a user, or None when sharding is off
+def shard_for_user(user_id: int):
+    if not shard_engines:
+        return None
+    return lookup_shard(user_id)[0]
+
+# Engine holding a user's rows of the sharded tables
+def user_engine(user_id: int):
+    shard = shard_for_user(user_id)
+    return engine if shard is None else shard_engines[shard]
+
+# Route a session's sharded tables to a user's shard
+def bind_user_shard(db: Session, user_id: int):
+    if not shard_engines:
+        return db
+    shard, moving = lookup_shard(user_id)
+    if moving:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Account data is being moved, please try again shortly",
+            headers={"Retry-After": str(int(SHARD_CACHE_TTL) + 1)}
+        )
+    db.info["shard"] = shard
+    return db
+
+# Users among user_ids that are being moved or no longer live on shard, read from the directory rather than the cache
+def users_away(user_ids, shard: int):
+    if not shard_engines or not user_ids:
+        return set()
+    with SessionLocal() as db:
+        return {user_id for (user_id,) in db.query(UserShard.user_id).filter(
+            UserShard.user_id.in_(set(user_ids)), (UserShard.moving == True) | (UserShard.shard != shard)
+        )}
+
+class UserMoving(RuntimeError):
+    """A user's data is being moved between shards"""
+
+# Session for background work on a user's data; raises UserMoving during a move
+def user_session(user_id: int):
+    if not shard_engines:
+        return SessionLocal(info={"shard": None})
+    shard, moving = lookup_shard(user_id)
+    if moving:
+        raise UserMoving("Account data is being moved, please try again shortly")
+    return SessionLocal(info={"shard": shard})
+
+def _set_directory(user_id, **values):
+    with SessionLocal() as db:
+        db.query(UserShard).filter(UserShard.user_id == user_id).update(values)
+        db.commit()
+    shard_cache.invalidate(user_id)
+
+# Sharded tables in copy order: tables with columns remapped through info["remap"] go last
+def _sharded_tables():
+    tables = [table for table in Base.metadata.sorted_tables if table.name in SHARDED_TABLES]
+    return sorted(tables, key=lambda table: any(column.info.get("remap") for column in table.columns))
+
+class MoveError(Exception):
+    """A user's rows cannot be moved as they are"""
+
+# Id on the target of a row of another table that the user's rows refer to but the user does not own: a default
+# category (no user_id) is matched by its columns, and copied when the target has none
+def _shared_row_id(source, target, table, row_id):
+    row = source.execute(select(table).where(table.c.id == row_id)).mappings().first()
+    if row is None or row["user_id"] is not None:
+        raise MoveError(f"The user's rows refer to {table.name} row {row_id}, which is not theirs or a default one")
+    values = {name: value for name, value in row.items() if name != "id"}
+    match = select(table.c.id).where(
+        *(table.c[name].is_(None) if value is None else table.c[name] == value for name, value in values.items())
+    ).order_by(table.c.id).limit(1)
+    target_id = target.execute(match).scalar()
+    if target_id is None:
+        target_id = target.execute(insert(table).values(values).returning(table.c.id)).scalar()
+    return target_id
+
+# Copy one table's rows of a user, remapping primary keys and foreign keys to already copied tables
+def _copy_table(source, target, table, user_id, id_maps):
+    primary_key = list(table.primary_key.columns)
+    remap_key = len(primary_key) == 1 and primary_key[0].autoincrement in (True, "auto") and primary_key[0].type.python_type is int
+    remapped_columns = {
+        fk.parent.name: fk.column.table
+        for fk in table.foreign_keys if fk.column.table.name in id_maps
+    }
+    # Columns holding ids of another sharded table without a foreign key
+    remapped_columns.update({
+        column.name: Base.metadata.tables[column.info["remap"]]
+        for column in table.columns if column.info.get("remap") in id_maps
+    })
+    id_map = {}
+    copied = 0
+    last_key = None
+    order = primary_key[0]
+    while True:
+        query = select(table).where(table.c.user_id == user_id).order_by(*primary_key).limit(MOVE_BATCH_SIZE)
+        if last_key is not None:
+            query = query.where(order > last_key)
+        rows = [dict(row) for row in source.execute(query).mappings()]
+        if not rows:
+            break
+        last_key = rows[-1][order.name]
+        copied += len(rows)
+        for row in rows:
+            for column, referred in remapped_columns.items():
+                # None and 0 (e.g. the all-categories rollup bucket) refer to no row
+                if not row[column]:
+                    continue
+                mapping = id_maps[referred.name]
+                if row[column] not in mapping:
+                    mapping[row[column]] = _shared_row_id(source, target, referred, row[column])
+                row[column] = mapping[row[column]]
+        if remap_key:
+            old_ids = [row.pop(order.name) for row in rows]
+            new_ids = target.execute(insert(table).returning(order, sort_by_parameter_order=True), rows).scalars().all()
+            id_map.update(zip(old_ids, new_ids))
+        else:
+            target.execute(insert(table), rows)
+    id_maps[table.name] = id_map
+    return copied
+
+def move_user(user_id: int, target_shard: int, drain_seconds=SHARD_CACHE_TTL + 1, log=print):
+    """Move a user's rows of every sharded table to target_shard; their ids change on the way.
+
+    Raises MoveError, with nothing switched, when their rows refer to rows they do not own."""
+    if not 0 <= target_shard < len(shard_engines):
+        raise ValueError(f"Shard {target_shard} does not exist")
+    source_shard = shard_for_user(user_id)
+    if source_shard == target_shard:
+        log(f"User {user_id} is already on shard {target_shard}")
+        return
+
+    from app.utils.archive import restore_user, archive_user
+    _set_directory(user_id, moving=True)
+    try:
+        # Let every worker's cached entry expire so no request writes to the source during the copy
+        time.sleep(drain_seconds)
+        # Archived records keep the ids of the source's records; they are copied as records to get new ones
+        restored = restore_user(shard_engines[source_shard], user_id)
+        if restored:
+            log(f"Restored {restored} archived records")
+        tables = _sharded_tables()
+        id_maps = {}
+        with shard_engines[source_shard].connect() as source, shard_engines[target_shard].begin() as target:
+            for table in tables:
+                copied = _copy_table(source, target, table, user_id, id_maps)
+                log(f"Copied {copied} {table.name} rows")
+        _set_directory(user_id, shard=target_shard, moving=False)
+    except Exception:
+        _set_directory(user_id, moving=False)
+        archive_user(shard_engines[source_shard], user_id)
+        raise
+
+    with shard_engines[source_shard].begin() as source:
+        for table in reversed(tables):
+            source.execute(delete(table).where(table.c.user_id == user_id))
+    archive_user(shard_engines[target_shard], user_id)
+    # Cached category lists hold the old ids
+    invalidate_user_categories(user_id)
+    with SessionLocal() as db:
+        for (ledger_id,) in db.query(Ledger.id).filter(Ledger.owner_id == user_id):
+            invalidate_ledger_categories(ledger_id)
+    # Rules skipped by the schedulers during the move are due on the target now
+    from app.utils.recurring import announce_user_rules
+    announce_user_rules(target_shard, user_id)
+    log(f"Moved user {user_id} from shard {source_shard} to shard {target_shard}")
+
+# Users and rows per shard
+def shard_status():
+    with SessionLocal() as db:
+        users = dict(db.query(UserShard.shard, func.count()).group_by(UserShard.shard).all())
+    report = []
+    for shard, shard_engine in enumerate(shard_engines):
+        with shard_engine.connect() as conn:
+            rows = {table.name: conn.execute(select(func.count()).select_from(table)).scalar() for table in _sharded_tables()}
+        report.append({"shard": shard, "url": shard_engine.url.render_as_string(hide_password=True), "users": users.get(shard, 0), "rows": rows})
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect shards and move users between them")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    move_parser = subparsers.add_parser("move", help="move a user's data to another shard")
+    move_parser.add_argument("--user-id", type=int, required=True)
+    move_parser.add_argument("--to", type=int, required=True, help="target shard number")
+    subparsers.add_parser("status", help="show users and rows per shard")
+    args = parser.parse_args()
+
+    if not shard_engines:
+        raise SystemExit("No shards configured; set SHARD_DATABASE_URLS")
+    from app.utils.migrations import check_schema
+    check_schema()
+    if args.command == "move":
+        try:
+            move_user(args.user_id, args.to)
+        except MoveError as e:
+            raise SystemExit(str(e))
+        print("Record, category, rule and budget ids of the user changed; links and exports naming the old ones are stale")
+    else:
+        for entry in shard_status():
+            print(entry)
+
+if __name__ == "__main__":
+    main()
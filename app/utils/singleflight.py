@@ -0,0 +1,100 @@
+"""Request coalescing for expensive read endpoints.
+
+``@single_flight()`` on a (sync) route makes concurrent identical calls,
+same route, principal scope and parameters, share one execution: the
+first caller runs the route and the others wait for its result. Nothing is
+kept once the call finishes: a request only shares a result that was still
+being computed when it arrived.
+
+Results are shared between requests, so they must not depend on the
+caller's session: ORM objects are converted with ``response_model`` by the
+leader, and responses are copied for each follower.
+"""
+from functools import wraps
+from fastapi import Response
+from pydantic import TypeAdapter
+from app.utils.metrics import Counter
+import threading
+
+SINGLE_FLIGHT_CALLS = Counter(
+    "duckpay_single_flight_calls_total", "Coalesced route calls, by whether they ran or shared another call's result", ("route", "role")
+)
+
+# Route parameters that are per-request plumbing rather than part of the query
+IGNORED_PARAMETERS = ("db", "current_user", "request")
+
+class _Call:
+    """One in-flight execution and its outcome"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers with the same key share its outcome"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """Return (result, shared) for function(), or raise its exception"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = function()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+_group = SingleFlight()
+
+# Copy a shared response so each request sends its own object
+def _copy_response(response):
+    headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+    return Response(content=response.body, status_code=response.status_code, headers=headers, media_type=response.media_type)
+
+def single_flight(per_user=False, response_model=None, ignore=IGNORED_PARAMETERS):
+    """Coalesce concurrent identical calls of a sync route.
+
+    With ``per_user`` the key includes the current user's id; otherwise
+    every caller allowed through the route's dependencies shares results.
+    ``response_model`` converts ORM results into models before sharing.
+    """
+    adapter = TypeAdapter(response_model) if response_model is not None else None
+
+    def decorator(function):
+        route = function.__qualname__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            principal = kwargs["current_user"].id if per_user else None
+            parameters = tuple(sorted((name, repr(value)) for name, value in kwargs.items() if name not in ignore))
+
+            def run():
+                result = function(*args, **kwargs)
+                if adapter is not None and not isinstance(result, Response):
+                    result = adapter.validate_python(result, from_attributes=True)
+                return result
+
+            result, shared = _group.do((route, principal, parameters), run)
+            SINGLE_FLIGHT_CALLS.inc(route, "shared" if shared else "leader")
+            if shared and isinstance(result, Response):
+                return _copy_response(result)
+            return result
+        return wrapper
+    return decorator
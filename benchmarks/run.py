@@ -0,0 +1,215 @@
+"""Benchmark scenarios driven in-process over httpx's ASGI transport.
+
+Every scenario sends a fixed number of requests with a fixed concurrency
+and reports throughput and latency percentiles. Results are printed as
+JSON (and optionally written to a file) so runs can be diffed across
+commits.
+
+    python -m benchmarks.run --database sqlite:///./bench.db --seed-users 50 --seed-records 1000000 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+# Nearest-rank percentile of sorted values
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(name, latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "scenario": name,
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": round(count / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if count else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3) if count else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if count else None,
+        "mean_ms": round(sum(latencies) / count * 1000, 3) if count else None,
+    }
+
+async def run_scenario(client, name, make_request, requests, concurrency):
+    """Send requests through make_request(client, index) and measure them"""
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for index in counter:
+            start = time.perf_counter()
+            response = await make_request(client, index)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(name, latencies, errors, time.perf_counter() - start)
+
+def build_scenarios(users, tokens, owner_token, categories, records_per_user, rng):
+    from benchmarks.seed import BENCH_PASSWORD
+
+    def auth(user_id):
+        return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+    async def login(client, index):
+        user_id = users[index % len(users)]
+        return await client.post("/api/users/login", json={"username": f"bench{user_id}", "password": BENCH_PASSWORD})
+
+    def list_records(page_size, depth):
+        async def request(client, index):
+            user_id = users[index % len(users)]
+            skip = min(depth, max(records_per_user - page_size, 0))
+            return await client.get("/api/records/", params={"skip": skip, "limit": page_size}, headers=auth(user_id))
+        return request
+
+    async def create_record(client, index):
+        user_id = users[index % len(users)]
+        category_id, type = rng.choice(categories[user_id])
+        payload = {"amount": round(rng.uniform(1, 200), 2), "type": type, "category_id": category_id, "description": "bench"}
+        return await client.post("/api/records/", json=payload, headers=auth(user_id))
+
+    async def admin_users(client, index):
+        return await client.get("/api/admin/users", headers={"Authorization": f"Bearer {owner_token}"})
+
+    async def admin_groups(client, index):
+        return await client.get("/api/admin/groups", headers={"Authorization": f"Bearer {owner_token}"})
+
+    return {
+        "login": login,
+        "records_page_first": list_records(100, 0),
+        "records_page_middle": list_records(100, records_per_user // 2),
+        "records_page_last": list_records(100, records_per_user),
+        "records_page_large": list_records(1000, 0),
+        "create_record": create_record,
+        "admin_users": admin_users,
+        "admin_groups": admin_groups,
+    }
+
+# Requests per scenario; bcrypt makes logins far slower than the rest
+DEFAULT_REQUESTS = {"login": 50}
+
+async def run(args):
+    import httpx
+    from sqlalchemy import select, func
+    from app.main import app
+    from app.utils.database import engine
+    from app.utils.shards import user_engine
+    from app.utils.jwt import create_access_token
+    from app.models.user import User
+    from app.models.category import Category
+    from app.models.record import Record
+    from app.models.group import Group, UserGroup
+    from benchmarks.seed import seed
+
+    if args.seed_records or args.seed_users:
+        start = time.perf_counter()
+        seed(engine, users=args.seed_users, records=args.seed_records, seed=args.seed)
+        print(f"Seeded in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    with engine.connect() as conn:
+        users = {user_id: username for user_id, username in conn.execute(
+            select(User.id, User.username).where(User.username.like("bench%")).order_by(User.id)
+        )}
+        owner_id = conn.execute(
+            select(UserGroup.user_id).join(Group, Group.id == UserGroup.group_id).where(Group.name == "owner")
+        ).scalar()
+        owner_name = conn.execute(select(User.username).where(User.id == owner_id)).scalar()
+        groups = {}
+        for user_id, group_name in conn.execute(
+            select(UserGroup.user_id, Group.name).join(Group, Group.id == UserGroup.group_id).where(UserGroup.user_id.in_(list(users)))
+        ):
+            groups.setdefault(user_id, []).append(group_name)
+    if not users:
+        raise SystemExit("No benchmark users found; pass --seed-users/--seed-records or run benchmarks.seed first")
+
+    # Categories and records live on each user's shard
+    categories = {}
+    for user_id in users:
+        with user_engine(user_id).connect() as conn:
+            categories[user_id] = [tuple(row) for row in conn.execute(
+                select(Category.id, Category.type).where(Category.user_id == user_id)
+            )]
+    first_user = next(iter(users))
+    with user_engine(first_user).connect() as conn:
+        records_per_user = conn.execute(
+            select(func.count()).select_from(Record).where(Record.user_id == first_user)
+        ).scalar()
+
+    # Tokens are minted directly so only the login scenario pays for bcrypt
+    tokens = {
+        user_id: create_access_token({"sub": username, "user_id": user_id, "groups": groups.get(user_id, [])})
+        for user_id, username in users.items()
+    }
+    owner_token = create_access_token({"sub": owner_name, "user_id": owner_id, "groups": ["owner"]})
+
+    rng = random.Random(args.seed)
+    scenarios = build_scenarios(list(users), tokens, owner_token, categories, records_per_user, rng)
+    selected = args.scenarios.split(",") if args.scenarios else list(scenarios)
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name in selected:
+            requests = DEFAULT_REQUESTS.get(name, args.requests)
+            # Warm up connections, caches and lazy imports
+            await run_scenario(client, name, scenarios[name], min(args.warmup, requests), args.concurrency)
+            result = await run_scenario(client, name, scenarios[name], requests, args.concurrency)
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Run DuckPay benchmarks in-process")
+    parser.add_argument("--database", default=None, help="database URL (defaults to DATABASE_URL)")
+    parser.add_argument("--seed-users", type=int, default=0, help="seed this many users before running")
+    parser.add_argument("--seed-records", type=int, default=0, help="seed this many records before running")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="warm-up requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenarios", default=None, help="comma separated scenario names")
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+    if args.seed_users < 0 or args.seed_records < 0:
+        parser.error("--seed-users and --seed-records must not be negative")
+    if args.seed_records and not args.seed_users:
+        parser.error("--seed-records needs --seed-users")
+
+    if args.database:
+        os.environ["DATABASE_URL"] = args.database
+
+    results = asyncio.run(run(args))
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": os.getenv("DATABASE_URL", "sqlite:///./app.db").split("@")[-1],
+        "concurrency": args.concurrency,
+        "scenarios": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Synthetic data generator for benchmarks.
+
+Seeds users, their categories and records with bulk inserts. The output
+is deterministic for a given ``--seed`` and ``--now`` (record dates are
+spread over the three years before it, not before the wall clock) so runs
+on different commits and days see the same data.
+
+    python -m benchmarks.seed --database sqlite:///./bench.db --users 100 --records 1000000
+"""
+from datetime import datetime, timedelta, timezone
+import argparse
+import os
+import random
+import time
+
+# Password of every seeded user
+BENCH_PASSWORD = "benchpass"
+
+# Category names per type
+EXPENSE_CATEGORIES = ["Food", "Rent", "Transport", "Shopping", "Utilities", "Health", "Travel", "Fun"]
+INCOME_CATEGORIES = ["Salary", "Bonus", "Interest", "Refund"]
+
+# Words used to build record descriptions
+DESCRIPTION_WORDS = ["coffee", "rent", "lunch", "taxi", "groceries", "movie", "salary", "gift", "book", "train"]
+
+# Insert rows in batches of this size
+BATCH_SIZE = 50000
+
+# Moment the seeded records lead up to, unless --now says otherwise
+DEFAULT_NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def seed(engine, users=10, categories_per_user=8, records=100000, seed=42, batch_size=BATCH_SIZE, now=DEFAULT_NOW):
+    """Seed the database behind engine and return what was created.
+
+    The first seeded user becomes the owner. Records are spread evenly
+    across users and over the three years before now.
+    """
+    if users < 1 or categories_per_user < 1 or records < 0:
+        raise ValueError("Seeding needs at least one user and one category per user, and no negative record count")
+    from sqlalchemy import insert, select, func
+    from app.utils.database import SessionLocal, init_db
+    from app.utils.migrations import upgrade
+    from app.utils.shards import user_engine
+    from app.utils.rollups import rebuild_rollups
+    from app.utils.jwt import get_password_hash
+    from app.utils.money import to_cents, from_cents
+    from app.models.user import User
+    from app.models.category import Category
+    from app.models.record import Record
+    from app.models.group import Group, UserGroup
+
+    rng = random.Random(seed)
+    upgrade()
+    init_db()
+
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            conn.exec_driver_sql("PRAGMA synchronous=OFF")
+
+        # One bcrypt run shared by every user keeps seeding fast
+        hashed_password = get_password_hash(BENCH_PASSWORD)
+        first_user_id = (conn.execute(select(func.max(User.id))).scalar() or 0) + 1
+        conn.execute(insert(User), [
+            {
+                "username": f"bench{first_user_id + i}",
+                "email": f"bench{first_user_id + i}@example.com",
+                "nickname": f"Bench {first_user_id + i}",
+                "hashed_password": hashed_password,
+            }
+            for i in range(users)
+        ])
+        user_ids = list(range(first_user_id, first_user_id + users))
+
+        groups = dict(conn.execute(select(Group.name, Group.id)).all())
+        has_owner = conn.execute(
+            select(func.count()).select_from(UserGroup).where(UserGroup.group_id == groups["owner"])
+        ).scalar()
+        conn.execute(insert(UserGroup), [
+            {"user_id": user_id, "group_id": groups["user"] if has_owner or index else groups["owner"]}
+            for index, user_id in enumerate(user_ids)
+        ])
+
+    # Categories and records go to each user's shard (the main database when sharding is off)
+    engines = {}
+    for user_id in user_ids:
+        engines.setdefault(user_engine(user_id), []).append(user_id)
+
+    # Records spread over the three years before now
+    span_seconds = 3 * 365 * 24 * 3600
+
+    for data_engine, shard_user_ids in engines.items():
+        with data_engine.begin() as conn:
+            if data_engine.dialect.name == "sqlite":
+                conn.exec_driver_sql("PRAGMA synchronous=OFF")
+
+            # Categories: a mix of expense and income per user
+            category_rows = []
+            for user_id in shard_user_ids:
+                for index in range(categories_per_user):
+                    if index % 4 == 3:
+                        name, type = INCOME_CATEGORIES[index // 4 % len(INCOME_CATEGORIES)], "income"
+                    else:
+                        name, type = EXPENSE_CATEGORIES[index % len(EXPENSE_CATEGORIES)], "expense"
+                    category_rows.append({"name": name, "type": type, "user_id": user_id, "color": "#000000"})
+            conn.execute(insert(Category), category_rows)
+
+            categories = {}
+            for category_id, user_id, type in conn.execute(
+                select(Category.id, Category.user_id, Category.type).where(Category.user_id.in_(shard_user_ids))
+            ):
+                categories.setdefault(user_id, []).append((category_id, type))
+
+            def record_rows():
+                for index in range(records):
+                    user_id = user_ids[index % users]
+                    if user_id not in categories:
+                        continue
+                    category_id, type = rng.choice(categories[user_id])
+                    amount_cents = to_cents(round(rng.uniform(1, 500 if type == "expense" else 5000), 2))
+                    yield {
+                        "amount_cents": amount_cents,
+                        "amount": from_cents(amount_cents),
+                        "type": type,
+                        "description": " ".join(rng.sample(DESCRIPTION_WORDS, 2)),
+                        "date": now - timedelta(seconds=rng.randrange(span_seconds)),
+                        "user_id": user_id,
+                        "category_id": category_id,
+                    }
+
+            for batch in _batched(record_rows(), batch_size):
+                conn.execute(insert(Record), batch)
+
+        # Bulk inserts bypass the running totals, so compute them once at the end
+        rebuild_rollups(data_engine, shard_user_ids)
+
+    return {"user_ids": user_ids, "records": records}
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed synthetic DuckPay data")
+    parser.add_argument("--database", default=None, help="database URL (defaults to DATABASE_URL)")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--categories", type=int, default=8, help="categories per user")
+    parser.add_argument("--records", type=int, default=100000, help="records in total")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--now", type=datetime.fromisoformat, default=DEFAULT_NOW, help="ISO date the records lead up to (UTC when naive)")
+    args = parser.parse_args()
+    if args.users < 1:
+        parser.error("--users must be at least 1")
+    if args.categories < 1:
+        parser.error("--categories must be at least 1")
+    if args.records < 0:
+        parser.error("--records must not be negative")
+    if args.now.tzinfo is None:
+        args.now = args.now.replace(tzinfo=timezone.utc)
+
+    if args.database:
+        os.environ["DATABASE_URL"] = args.database
+    from app.utils.database import engine
+
+    start = time.perf_counter()
+    seed(engine, users=args.users, categories_per_user=args.categories, records=args.records, seed=args.seed, now=args.now)
+    elapsed = time.perf_counter() - start
+    print(f"Seeded {args.users} users and {args.records} records in {elapsed:.1f}s ({args.records / elapsed:.0f} records/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Serialization cost per 1k rows: response models versus the fast path.
+
+Compares the classic FastAPI path (ORM objects validated into response
+models, run through jsonable_encoder and rendered by JSONResponse)
+with the column-tuple path used by the hot list endpoints, and checks
+that the fast path's bytes match pydantic's JSON for the same models.
+
+    python -m benchmarks.serialization --rows 1000 --repeat 50
+"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import List
+import argparse
+import json
+import random
+import time
+
+def build_rows(count, seed=42):
+    from app.schemas.record import Record
+
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    rows = []
+    for index in range(count):
+        values = {
+            "amount": round(rng.uniform(1, 500), 2),
+            "type": rng.choice(["income", "expense"]),
+            "description": rng.choice(["coffee", "rent", "午饭", None]),
+            "category_id": rng.randrange(1, 20),
+            "date": start + timedelta(minutes=index * 37, microseconds=rng.randrange(1000000)),
+            "id": index + 1,
+            "user_id": 1,
+        }
+        rows.append(tuple(values[name] for name in Record.model_fields))
+    return rows
+
+def measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+def main():
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+    from app.schemas.record import Record
+    from app.utils.serialization import encode_rows, orjson
+
+    parser = argparse.ArgumentParser(description="Measure record list serialization cost")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rows = build_rows(args.rows)
+    # Stand-ins for ORM objects: attribute access like a loaded Record
+    objects = [SimpleNamespace(**dict(zip(Record.model_fields, row))) for row in rows]
+    adapter = TypeAdapter(List[Record])
+
+    def response_model_path():
+        models = adapter.validate_python(objects, from_attributes=True)
+        return JSONResponse(jsonable_encoder(models)).body
+
+    def fast_path():
+        return encode_rows(Record, rows)
+
+    exact = adapter.dump_json(adapter.validate_python(objects, from_attributes=True))
+    per_thousand = 1000 / args.rows
+    report = {
+        "rows": args.rows,
+        "encoder": "orjson" if orjson else "pydantic_core",
+        "byte_compatible": fast_path() == exact,
+        "response_model_us_per_1k": round(measure(response_model_path, args.repeat) * 1e6 * per_thousand, 1),
+        "fast_path_us_per_1k": round(measure(fast_path, args.repeat) * 1e6 * per_thousand, 1),
+    }
+    report["speedup"] = round(report["response_model_us_per_1k"] / report["fast_path_us_per_1k"], 1)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Shared fixtures: the app on throwaway SQLite databases (a main database and two shards).
+
+The app reads its configuration when imported, so the environment is set up here first.
+"""
+import os
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp(prefix="duckpay-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{DATA_DIR}/main.db",
+    "SHARD_DATABASE_URLS": f"sqlite:///{DATA_DIR}/shard0.db,sqlite:///{DATA_DIR}/shard1.db",
+    "JOB_RESULT_DIR": f"{DATA_DIR}/job_results",
+    "ATTACHMENTS_DIR": f"{DATA_DIR}/attachments",
+    "RECURRING_ENABLED": "false",
+    "BCRYPT_ROUNDS": "4",
+    # Every test registers and signs in from the same address
+    "REGISTER_RATE_LIMIT_IP": "10000/60",
+    "LOGIN_RATE_LIMIT_IP": "10000/60",
+    # Keep principals cached for the whole test so statement counts leave out the lookup
+    "PRINCIPAL_LOCAL_CACHE_TTL": "600",
+})
+
+import itertools
+import pytest
+from fastapi.testclient import TestClient
+from app.utils.migrations import upgrade
+
+# The migrate step, as run before the workers start
+upgrade()
+
+from app.main import app
+from app.utils.database import SessionLocal
+from app.models.group import Group, UserGroup
+from app.crud.user import invalidate_principals
+
+_usernames = (f"user{n}" for n in itertools.count(1))
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+# Register and sign in a new user; returns (user id, auth headers)
+def _register(client, groups=()):
+    username = next(_usernames)
+    response = client.post("/api/users/register", json={"username": username, "email": f"{username}@example.com", "password": "password1"})
+    assert response.status_code == 201, response.text
+    user_id = response.json()["id"]
+    if groups:
+        with SessionLocal() as db:
+            db.add_all(UserGroup(user_id=user_id, group_id=group.id) for group in db.query(Group).filter(Group.name.in_(groups)))
+            db.commit()
+        invalidate_principals(username)
+    token = client.post("/api/users/login", json={"username": username, "password": "password1"}).json()["access_token"]
+    return user_id, {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def make_user(client):
+    return lambda: _register(client)
+
+@pytest.fixture
+def make_owner(client):
+    return lambda: _register(client, groups=("owner",))
@@ -0,0 +1,69 @@
+import itertools
+from app.utils.acl import ACLIndex, ACL_REBUILDS
+from app.utils.database import SessionLocal
+from app.models.group import TablePermission, UserGroup
+from app.models.ledger import Ledger
+from tests.conftest import _register
+
+_group_names = (f"auditors{n}" for n in itertools.count(1))
+
+def test_deleting_a_group_revokes_its_ledger_grants(client, make_owner):
+    _, owner_headers = make_owner()
+    name = next(_group_names)
+    group_id = client.post("/api/admin/groups/add", json={"name": name}, headers=owner_headers).json()["id"]
+    _, member_headers = _register(client, groups=(name,))
+    ledger_id = client.post("/api/ledgers/", json={"name": "Household"}, headers=owner_headers).json()["id"]
+    records = f"/api/records/?ledger_id={ledger_id}"
+    assert client.get(records, headers=member_headers).status_code == 404
+
+    grant = {"group_id": group_id, "can_access": True, "can_add": True}
+    assert client.post(f"/api/ledgers/{ledger_id}/permissions", json=grant, headers=owner_headers).status_code == 200
+    assert client.get(records, headers=member_headers).status_code == 200
+
+    assert client.post(f"/api/admin/groups/delete/{group_id}", headers=owner_headers).status_code == 200
+    assert client.get(records, headers=member_headers).status_code == 404
+    # The ledger itself stays with its owner
+    assert client.get(f"/api/ledgers/{ledger_id}", headers=owner_headers).status_code == 200
+    with SessionLocal() as db:
+        assert db.query(TablePermission).filter(TablePermission.group_id == group_id).count() == 0
+
+# Rebuilds counted so far, by scope
+def _rebuilds():
+    return {scope: ACL_REBUILDS._values.get((scope,), 0) for scope in ("full", "ledger", "user")}
+
+def test_invalidations_reload_only_the_named_ledgers_and_users(client, make_user, make_owner):
+    owner_id, owner_headers = make_owner()
+    member_id, _ = make_user()
+    index = ACLIndex(ttl=600)
+    with SessionLocal() as db:
+        ledger = Ledger(name="Trip", owner_id=owner_id)
+        db.add(ledger)
+        db.commit()
+        ledger_id = ledger.id
+    assert index.access(owner_id, ledger_id).can_manage
+    assert index.access(member_id, ledger_id) is None
+
+    # A grant to a group of the member shows once the ledger is invalidated, without a full rebuild
+    name = next(_group_names)
+    group_id = client.post("/api/admin/groups/add", json={"name": name}, headers=owner_headers).json()["id"]
+    with SessionLocal() as db:
+        db.add(UserGroup(user_id=member_id, group_id=group_id))
+        db.add(TablePermission(table_name="records", group_id=group_id, ledger_id=ledger_id, can_access=True, can_edit=True))
+        db.commit()
+    before = _rebuilds()
+    assert index.access(member_id, ledger_id) is None
+    index.invalidate({"ledgers": [ledger_id]})
+    access = index.access(member_id, ledger_id)
+    assert access.can_edit and not access.can_delete and access.owner_id == owner_id
+    assert list(index.ledgers(member_id)) == [ledger_id]
+
+    # Leaving the group takes the access away once the user is invalidated
+    with SessionLocal() as db:
+        db.query(UserGroup).filter(UserGroup.user_id == member_id, UserGroup.group_id == group_id).delete()
+        db.commit()
+    index.invalidate({"users": [member_id]})
+    assert index.access(member_id, ledger_id) is None
+    assert index.access(owner_id, ledger_id).can_manage
+    after = _rebuilds()
+    assert after["full"] == before["full"]
+    assert (after["ledger"], after["user"]) == (before["ledger"] + 1, before["user"] + 1)
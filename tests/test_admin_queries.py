@@ -0,0 +1,77 @@
+import pytest
+from app.utils.database import SessionLocal, engine
+from app.utils.query_inspector import count_queries
+from app.crud.user import find_user_collisions, get_user_access, get_groups_by_names
+
+# Statements a request runs on the main database (the caller's principal is already cached)
+def _statements(call):
+    with count_queries(engine) as counter:
+        response = call()
+    return response, counter.count
+
+@pytest.fixture
+def owner_headers(client, make_owner):
+    _, headers = make_owner()
+    # Cache the owner's principal so the counts below leave out its lookup
+    assert client.get("/api/admin/groups", headers=headers).status_code == 200
+    return headers
+
+def test_find_user_collisions_runs_one_statement(make_user):
+    user_id, _ = make_user()
+    with SessionLocal() as db:
+        username = get_user_access(db, user_id).username
+        with count_queries(engine) as counter:
+            assert find_user_collisions(db, username=username, email="nobody@example.com") == (True, False)
+    assert counter.count == 1
+
+def test_get_user_access_runs_one_statement(make_owner):
+    user_id, _ = make_owner()
+    with SessionLocal() as db, count_queries(engine) as counter:
+        access = get_user_access(db, user_id)
+        assert get_user_access(db, -1) is None
+    assert sorted(group.name for group in access.groups) == ["owner", "user"]
+    assert counter.count == 2
+
+def test_get_groups_by_names_runs_one_statement():
+    with SessionLocal() as db:
+        with count_queries(engine) as counter:
+            groups = get_groups_by_names(db, ["admin", "missing", "user"])
+        assert [group.name for group in groups] == ["admin", "user"]
+        assert counter.count == 1
+        with count_queries(engine) as counter:
+            assert get_groups_by_names(db, []) == []
+        assert counter.count == 0
+
+def test_list_users_statements_do_not_grow_with_users(client, make_user, owner_headers):
+    response, statements = _statements(lambda: client.get("/api/admin/users", headers=owner_headers))
+    assert response.status_code == 200
+    # Group permissions, groups, memberships and users, each in one query whatever the number of users
+    assert statements == 4
+    for _ in range(3):
+        make_user()
+    response, more_statements = _statements(lambda: client.get("/api/admin/users", headers=owner_headers))
+    assert len(response.json()) > 3
+    assert more_statements == statements
+    _, statements = _statements(lambda: client.get("/api/admin/users?fields=id,username", headers=owner_headers))
+    assert statements == 1
+
+def test_user_admin_routes_statements(client, make_user, owner_headers):
+    new_user = {"username": "admin-made", "email": "admin-made@example.com", "password": "password1", "groups": ["user"]}
+    response, statements = _statements(lambda: client.post("/api/admin/users/add", json=new_user, headers=owner_headers))
+    assert response.status_code == 200, response.text
+    assert statements == 5
+    response, statements = _statements(lambda: client.post("/api/admin/users/add", json=new_user, headers=owner_headers))
+    assert response.status_code == 400
+    assert statements == 1
+
+    users = client.get("/api/admin/users?fields=id,username", headers=owner_headers).json()
+    user_id = next(user["id"] for user in users if user["username"] == "admin-made")
+    response, statements = _statements(lambda: client.post(f"/api/admin/users/update/{user_id}", json={"nickname": "made"}, headers=owner_headers))
+    assert response.status_code == 200
+    assert statements == 3
+    response, statements = _statements(lambda: client.post(f"/api/admin/users/update/{user_id}", json={"groups": ["admin"]}, headers=owner_headers))
+    assert response.status_code == 200
+    assert statements == 5
+    response, statements = _statements(lambda: client.post(f"/api/admin/users/delete/{user_id}", headers=owner_headers))
+    assert response.status_code == 200
+    assert statements == 3
@@ -0,0 +1,54 @@
+import socket
+from app.utils.cache import (
+    CacheServer, RemoteBackend, MISSING, CACHE_EVICTIONS, CACHE_SERVER_ERRORS, worker_count
+)
+
+AUTHKEY = b"test-cache-secret-0123456789"
+
+def _free_address():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()
+
+def test_invalidations_lost_while_the_server_is_away_are_replayed():
+    # No server listens yet: the deletion cannot reach it
+    address = _free_address()
+    backend = RemoteBackend(address, authkey=AUTHKEY)
+    backend.local.set("principals:1", "admin", 60)
+    errors = CACHE_SERVER_ERRORS._values.get(("delete",), 0)
+    backend.delete("principals:1")
+    assert CACHE_SERVER_ERRORS._values.get(("delete",), 0) == errors + 1
+    assert backend._pending == [("delete", "principals:1")]
+
+    # A server holding the old entry comes up: the deletion reaches it before any lookup
+    server = CacheServer(address, authkey=AUTHKEY)
+    server.store.set("principals:1", "admin", 60)
+    server.start()
+    try:
+        assert backend.get("principals:1") is MISSING
+        assert backend._pending == []
+        assert server.store.get("principals:1") is MISSING
+    finally:
+        server.close()
+
+def test_server_evictions_are_counted_per_cache():
+    address = _free_address()
+    server = CacheServer(address, authkey=AUTHKEY, maxsize=2)
+    server.start()
+    try:
+        backend = RemoteBackend(address, authkey=AUTHKEY)
+        evictions = CACHE_EVICTIONS._values.get(("shard",), 0)
+        for user_id in range(5):
+            backend.set(f"shard:{user_id}", user_id, 60)
+        assert CACHE_EVICTIONS._values.get(("shard",), 0) == evictions + 3
+    finally:
+        server.close()
+
+def test_worker_count_reads_the_server_command_line(monkeypatch):
+    monkeypatch.delenv("GUNICORN_CMD_ARGS", raising=False)
+    assert worker_count(["app.main:app", "--workers", "4"]) == 4
+    assert worker_count(["app.main:app", "--workers=3"]) == 3
+    assert worker_count(["-w", "2", "app.main:app"]) == 2
+    assert worker_count(["-w8", "app.main:app"]) == 8
+    monkeypatch.setenv("GUNICORN_CMD_ARGS", "--bind 0.0.0.0 --workers 6")
+    assert worker_count(["app.main:app"]) == 6
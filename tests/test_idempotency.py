@@ -0,0 +1,42 @@
+import pytest
+from app.utils.shards import shard_for_user
+from app.models.idempotency import IdempotencyKey
+from app.models.record import Record
+from tests.test_shards import _rows
+
+def _create(client, headers, key, body):
+    return client.post("/api/records/", json=body, headers={**headers, "Idempotency-Key": key})
+
+def _category(client, headers):
+    return client.post("/api/categories/", json={"name": "Lunch", "type": "expense"}, headers=headers).json()["id"]
+
+def test_retry_replays_the_first_response(client, make_user):
+    user_id, headers = make_user()
+    body = {"amount": 8.4, "type": "expense", "category_id": _category(client, headers), "description": "noodles"}
+    first = _create(client, headers, "lunch-1", body)
+    retry = _create(client, headers, "lunch-1", body)
+    assert first.status_code == retry.status_code == 201
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+    assert len(_rows(shard_for_user(user_id), Record, user_id)) == 1
+    # The key lives on the user's shard, next to the record
+    (entry,) = _rows(shard_for_user(user_id), IdempotencyKey, user_id)
+    assert entry["status_code"] == 201
+
+def test_failure_after_the_commit_keeps_the_key(client, make_user, monkeypatch):
+    user_id, headers = make_user()
+    body = {"amount": 3, "type": "expense", "category_id": _category(client, headers), "description": "coffee"}
+
+    # The worker dies between committing the record and answering
+    def crash(*args):
+        raise RuntimeError("worker killed")
+    monkeypatch.setattr("app.crud.record.check_budget_alerts", crash)
+    with pytest.raises(RuntimeError):
+        _create(client, headers, "coffee-1", body)
+    monkeypatch.undo()
+
+    retry = _create(client, headers, "coffee-1", body)
+    assert retry.status_code == 201
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    (record,) = _rows(shard_for_user(user_id), Record, user_id)
+    assert retry.json()["id"] == record["id"]
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event
+from app.utils.database import SessionLocal, shard_engines
+from app.utils.insights import load_columns
+from app.utils.shards import shard_for_user
+from tests.test_shards import _add_record
+
+def test_insights_read_the_window_through_the_date_index(client, make_user):
+    user_id, headers = make_user()
+    category_id = client.post("/api/categories/", json={"name": "Snacks", "type": "expense"}, headers=headers).json()["id"]
+    now = datetime.now(timezone.utc)
+    recent_id = _add_record(client, headers, category_id, 4.5, "chips", now - timedelta(days=2))
+    _add_record(client, headers, category_id, 9, "old chips", now - timedelta(days=60))
+
+    shard = shard_for_user(user_id)
+    statements = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+    event.listen(shard_engines[shard], "before_cursor_execute", capture)
+    try:
+        with SessionLocal(info={"shard": shard}) as db:
+            ids, cents, seconds, _ = load_columns(db, user_id, "expense", int((now - timedelta(days=30)).timestamp()))
+    finally:
+        event.remove(shard_engines[shard], "before_cursor_execute", capture)
+    assert ids.tolist() == [recent_id]
+    assert cents.tolist() == [450]
+
+    (statement, parameters), = statements
+    with shard_engines[shard].connect() as conn:
+        plan = " ".join(str(row) for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters))
+    assert "ix_records_scope_date (user_id=? AND ledger_id=? AND date>?)" in plan
+
+    daily = client.get("/api/records/insights?days=7", headers=headers).json()["daily"]
+    assert sum(day["total"] for day in daily) == 4.5
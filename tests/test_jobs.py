@@ -0,0 +1,70 @@
+import threading
+import time
+from fastapi import HTTPException
+from app.utils.database import SessionLocal
+from app.utils.jobs import job_handler, job_runner, JOB_MAX_PER_USER
+from app.utils.shards import _set_directory
+
+# Jobs of this kind run until the event is set
+_release = threading.Event()
+
+@job_handler("test_wait")
+def _wait(context):
+    _release.wait(10)
+
+def _finished(client, headers, job_id):
+    for _ in range(200):
+        job = client.get(f"/api/jobs/{job_id}", headers=headers).json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+def test_export_parameters_are_checked_on_submit(client, make_user):
+    _, headers = make_user()
+    for params in ({"start_date": "yesterday"}, {"type": "transfer"}, {"start_date": "2024-05-01", "end_date": "2024-04-01"}):
+        response = client.post("/api/jobs/", json={"kind": "export_records", "params": params}, headers=headers)
+        assert response.status_code == 400, params
+    response = client.post("/api/jobs/", json={"kind": "export_records", "params": {"start_date": "2024-01-01", "type": "expense"}}, headers=headers)
+    assert response.status_code == 202
+    assert _finished(client, headers, response.json()["id"])["status"] == "succeeded"
+
+def test_concurrent_submits_respect_the_per_user_limit(client, make_user):
+    user_id, headers = make_user()
+    accepted = []
+    rejected = []
+
+    def submit():
+        with SessionLocal() as db:
+            try:
+                accepted.append(job_runner.submit(db, user_id, "test_wait", {}).id)
+            except HTTPException as e:
+                rejected.append(e.status_code)
+
+    _release.clear()
+    threads = [threading.Thread(target=submit) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(accepted) == JOB_MAX_PER_USER
+    assert set(rejected) == {429}
+
+    # Finished jobs give their slots back
+    _release.set()
+    for job_id in accepted:
+        assert _finished(client, headers, job_id)["status"] == "succeeded"
+    response = client.post("/api/jobs/", json={"kind": "export_records", "params": {}}, headers=headers)
+    assert response.status_code == 202
+
+def test_jobs_do_not_touch_a_moving_user(client, make_user):
+    user_id, headers = make_user()
+    client.get("/api/records/", headers=headers)
+    _set_directory(user_id, moving=True)
+    try:
+        response = client.post("/api/jobs/", json={"kind": "export_records", "params": {}}, headers=headers)
+        job = _finished(client, headers, response.json()["id"])
+    finally:
+        _set_directory(user_id, moving=False)
+    assert job["status"] == "failed"
+    assert "being moved" in job["error"]
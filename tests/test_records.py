@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta, timezone
+from app.utils.archive import archive_user
+from app.utils.database import shard_engines
+from app.utils.shards import shard_for_user
+from tests.test_shards import _add_record
+
+# Descriptions of every page of a listing, in order
+def _pages(client, headers, query, size=2):
+    pages = []
+    while True:
+        page = client.get(f"/api/records/?{query}&skip={len(pages) * size}&limit={size}", headers=headers).json()
+        if not page:
+            return pages
+        pages.append([record["description"] for record in page])
+
+def test_pages_follow_record_ids_without_the_id_field(client, make_user):
+    user_id, headers = make_user()
+    category_id = client.post("/api/categories/", json={"name": "Books", "type": "expense"}, headers=headers).json()["id"]
+    now = datetime.now(timezone.utc)
+    # Created in an order unlike their dates; the two oldest are archived
+    for description, days_ago in (("a", 3), ("b", 900), ("c", 1), ("d", 1000), ("e", 2)):
+        _add_record(client, headers, category_id, 1, description, now - timedelta(days=days_ago))
+    assert archive_user(shard_engines[shard_for_user(user_id)], user_id) == 2
+
+    # With the archive (no start date) and without it
+    assert _pages(client, headers, "fields=description") == [["a", "b"], ["c", "d"], ["e"]]
+    recent = (now - timedelta(days=10)).isoformat().replace("+00:00", "Z")
+    assert _pages(client, headers, f"fields=description&start_date={recent}") == [["a", "c"], ["e"]]
+    # Only the fields asked for come back
+    assert client.get("/api/records/?fields=description&limit=1", headers=headers).json() == [{"description": "a"}]
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta, timezone
+import threading
+import pytest
+from sqlalchemy import update
+from app.utils.cron import CronError, CronSchedule
+from app.utils.database import shard_engines
+import app.utils.recurring
+from app.utils.recurring import materialize
+from app.utils.rollups import check_rollups
+from app.utils.shards import move_user, shard_for_user
+from app.models.record import Record
+from app.models.recurring import RecurringRule
+from tests.test_shards import _rows
+
+# Daily rule starting at 09:00 five days ago; returns its start
+def _daily_rule(client, headers):
+    category_id = client.post("/api/categories/", json={"name": "Rent", "type": "expense"}, headers=headers).json()["id"]
+    start = (datetime.now(timezone.utc) - timedelta(days=5)).replace(hour=9, minute=0, second=0, microsecond=0)
+    rule = {"amount": 12.5, "type": "expense", "category_id": category_id, "schedule": "0 9 * * *", "start_at": start.isoformat()}
+    assert client.post("/api/recurring/", json=rule, headers=headers).status_code == 201
+    return start
+
+def test_scheduler_skips_rules_of_a_moving_user(client, make_user, monkeypatch):
+    user_id, headers = make_user()
+    start = _daily_rule(client, headers)
+    now = start + timedelta(days=4, hours=1)
+    source = shard_for_user(user_id)
+    target = 1 - source
+    (rule,) = _rows(source, RecurringRule, user_id)
+    passes = []
+
+    # The scheduler of another worker fires while the move drains
+    def drain(seconds):
+        def run():
+            passes.append(materialize(shard_engines[source], [rule["id"]], now=now))
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+    monkeypatch.setattr("app.utils.shards.time.sleep", drain)
+    move_user(user_id, target, drain_seconds=0, log=lambda message: None)
+
+    (created, next_runs), = passes
+    assert created == 0
+    assert [rule_id for rule_id, _ in next_runs] == [rule["id"]]
+    assert _rows(source, Record, user_id) == []
+    # The rule was copied unclaimed, and the target records each occurrence once
+    (moved,) = _rows(target, RecurringRule, user_id)
+    assert moved["next_run_at"].replace(tzinfo=timezone.utc) == start
+    assert materialize(shard_engines[target], [moved["id"]], now=now)[0] == 5
+    assert materialize(shard_engines[target], [moved["id"]], now=now)[0] == 0
+    assert sorted(row["date"].replace(tzinfo=timezone.utc) for row in _rows(target, Record, user_id)) == [
+        start + timedelta(days=day) for day in range(5)
+    ]
+    assert check_rollups(user_id) == []
+
+# Run times of a schedule after a moment, in UTC
+def _runs(expression, after, count=3):
+    runs = []
+    moment = after
+    for _ in range(count):
+        moment = CronSchedule(expression).next_after(moment)
+        runs.append(moment)
+    return runs
+
+def test_cron_fields():
+    after = datetime(2024, 1, 31, 23, 50, tzinfo=timezone.utc)  # a Wednesday
+    at = lambda *fields: datetime(*fields, tzinfo=timezone.utc)
+    assert _runs("*/20 * * * *", after) == [at(2024, 2, 1, 0, 0), at(2024, 2, 1, 0, 20), at(2024, 2, 1, 0, 40)]
+    assert _runs("5,50 8-9 * * *", after) == [at(2024, 2, 1, 8, 5), at(2024, 2, 1, 8, 50), at(2024, 2, 1, 9, 5)]
+    assert _runs("0 0 29 2 *", after, 2) == [at(2024, 2, 29, 0, 0), at(2028, 2, 29, 0, 0)]
+    assert _runs("@monthly", after, 2) == _runs("0 0 1 * *", after, 2) == [at(2024, 2, 1, 0, 0), at(2024, 3, 1, 0, 0)]
+    # Sunday is 0 and 7; with both day fields restricted either one matches
+    assert _runs("0 12 * * 7", after, 1) == _runs("0 12 * * 0", after, 1) == [at(2024, 2, 4, 12, 0)]
+    assert _runs("0 12 10 * 1", after) == [at(2024, 2, 5, 12, 0), at(2024, 2, 10, 12, 0), at(2024, 2, 12, 12, 0)]
+    # Naive times are UTC, and the next run is strictly later
+    assert CronSchedule("50 23 * * *").next_after(after.replace(tzinfo=None)) == at(2024, 2, 1, 23, 50)
+    assert CronSchedule("0 0 30 2 *").next_after(after) is None
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "*/0 * * * *", "5-1 * * * *", "a * * * *", "@often"])
+def test_invalid_cron_expressions(expression):
+    with pytest.raises(CronError):
+        CronSchedule(expression)
+
+def test_each_occurrence_is_claimed_once(client, make_user, monkeypatch):
+    user_id, headers = make_user()
+    start = _daily_rule(client, headers)
+    shard = shard_for_user(user_id)
+    data_engine = shard_engines[shard]
+    (rule,) = _rows(shard, RecurringRule, user_id)
+    now = start + timedelta(days=2, hours=1)
+
+    # Two workers fire the same rule at the same time: one records the occurrences
+    barrier = threading.Barrier(2)
+    results = []
+    schedule = app.utils.recurring._schedule
+    def slow_schedule(expression):
+        barrier.wait(5)
+        return schedule(expression)
+    monkeypatch.setattr("app.utils.recurring._schedule", slow_schedule)
+    threads = [threading.Thread(target=lambda: results.append(materialize(data_engine, [rule["id"]], now=now))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    monkeypatch.setattr("app.utils.recurring._schedule", schedule)
+    assert sorted(created for created, _ in results) == [0, 3]
+    assert [next_runs for created, next_runs in results if created] == [[(rule["id"], start + timedelta(days=3))]]
+    assert len(_rows(shard, Record, user_id)) == 3
+
+    # Catch-up is capped per pass, and a rule stops at its end
+    monkeypatch.setattr("app.utils.recurring.RECURRING_MAX_CATCH_UP", 1)
+    later = start + timedelta(days=6)
+    assert materialize(data_engine, [rule["id"]], now=later) == (1, [(rule["id"], start + timedelta(days=4))])
+    with data_engine.begin() as conn:
+        conn.execute(update(RecurringRule).where(RecurringRule.id == rule["id"]).values(end_at=start + timedelta(days=4, hours=12)))
+    assert materialize(data_engine, [rule["id"]], now=later) == (1, [(rule["id"], None)])
+    assert materialize(data_engine, [rule["id"]], now=later) == (0, [])
+    assert len(_rows(shard, Record, user_id)) == 5
+    assert check_rollups(user_id) == []
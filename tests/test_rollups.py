@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta, timezone
+from app.crud.rollup import ALL_TIME
+from app.models.recurring import RecurringRule
+from app.models.rollup import RecordRollup
+from app.utils.archive import archive_user
+from app.utils.database import shard_engines
+from app.utils.recurring import materialize
+from app.utils.rollups import check_rollups
+from app.utils.shards import shard_for_user
+from tests.test_shards import _add_record, _rows
+
+# Stored all-time expense total (cents) and count of a user, or (0, 0) without a row
+def _expenses(user_id):
+    for row in _rows(shard_for_user(user_id), RecordRollup, user_id):
+        if (row["ledger_id"], row["category_id"], row["period"]) == (0, 0, ALL_TIME):
+            return row["expense_cents"], row["expense_count"]
+    return 0, 0
+
+def test_totals_follow_every_record_write(client, make_user):
+    user_id, headers = make_user()
+    groceries = client.post("/api/categories/", json={"name": "Groceries", "type": "expense"}, headers=headers).json()["id"]
+    travel = client.post("/api/categories/", json={"name": "Travel", "type": "expense"}, headers=headers).json()["id"]
+    now = datetime.now(timezone.utc)
+
+    bread = _add_record(client, headers, groceries, 3.25, "bread", now - timedelta(days=1))
+    train = _add_record(client, headers, travel, 40, "train", now - timedelta(days=40))
+    _add_record(client, headers, groceries, 12.1, "market", now - timedelta(days=800))
+    old = _add_record(client, headers, travel, 99.99, "flight", now - timedelta(days=900))
+    assert check_rollups(user_id) == []
+    assert _expenses(user_id) == (15534, 4)
+
+    # Amount, category and month all change
+    update = {"amount": 5, "category_id": travel, "date": (now - timedelta(days=70)).isoformat()}
+    assert client.post(f"/api/records/update/{bread}", json=update, headers=headers).status_code == 200
+    assert check_rollups(user_id) == []
+    assert client.post(f"/api/records/delete/{train}", headers=headers).status_code == 200
+    assert check_rollups(user_id) == []
+    assert _expenses(user_id) == (11709, 3)
+
+    # Archiving moves rows without changing totals; writes to archived records restore them first
+    assert archive_user(shard_engines[shard_for_user(user_id)], user_id) == 2
+    assert check_rollups(user_id) == []
+    assert _expenses(user_id) == (11709, 3)
+    assert client.post(f"/api/records/update/{old}", json={"amount": 100}, headers=headers).status_code == 200
+    assert check_rollups(user_id) == []
+    assert _expenses(user_id) == (11710, 3)
+    assert client.post(f"/api/records/delete/{old}", headers=headers).status_code == 200
+    assert check_rollups(user_id) == []
+    assert _expenses(user_id) == (1710, 2)
+
+def test_totals_count_recurring_records(client, make_user):
+    user_id, headers = make_user()
+    category_id = client.post("/api/categories/", json={"name": "Gym", "type": "expense"}, headers=headers).json()["id"]
+    start = (datetime.now(timezone.utc) - timedelta(days=3)).replace(hour=6, minute=0, second=0, microsecond=0)
+    rule = {"amount": 7.5, "type": "expense", "category_id": category_id, "schedule": "0 6 * * *", "start_at": start.isoformat()}
+    assert client.post("/api/recurring/", json=rule, headers=headers).status_code == 201
+    _add_record(client, headers, category_id, 1, "towel", start)
+
+    shard = shard_for_user(user_id)
+    (rule,) = _rows(shard, RecurringRule, user_id)
+    assert materialize(shard_engines[shard], [rule["id"]], now=start + timedelta(days=2, hours=1))[0] == 3
+    assert check_rollups(user_id) == []
+    assert _expenses(user_id) == (2350, 4)
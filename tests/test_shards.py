@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import select, insert, func
+from app.utils.database import shard_engines
+from app.utils.shards import move_user, shard_for_user, MoveError
+from app.utils.rollups import check_rollups
+from app.models.archive import RecordArchive
+from app.models.budget import Budget
+from app.models.category import Category
+from app.models.record import Record
+from app.models.recurring import RecurringRule
+
+# Rows of a user in one table of a shard
+def _rows(shard, model, user_id):
+    with shard_engines[shard].connect() as conn:
+        return conn.execute(select(model).where(model.user_id == user_id).order_by(model.id)).mappings().all()
+
+# Default category (no user_id) added to a shard directly
+def _default_category(shard, name):
+    with shard_engines[shard].begin() as conn:
+        return conn.execute(insert(Category).values(name=name, type="expense", is_default=True).returning(Category.id)).scalar()
+
+def _add_record(client, headers, category_id, amount, description, date=None):
+    body = {"amount": amount, "type": "expense", "category_id": category_id, "description": description}
+    if date is not None:
+        body["date"] = date.isoformat()
+    response = client.post("/api/records/", json=body, headers=headers)
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+def test_move_user_between_shards(client, make_user):
+    user_id, headers = make_user()
+    source = shard_for_user(user_id)
+    target = 1 - source
+    # A default category the target lacks, and one it already has (under a different id)
+    default_id = _default_category(source, "Groceries")
+    _default_category(target, "Placeholder")
+    shared_id = _default_category(source, "Transport")
+    target_shared_id = _default_category(target, "Transport")
+
+    own_id = client.post("/api/categories/", json={"name": "Coffee", "type": "expense"}, headers=headers).json()["id"]
+    _add_record(client, headers, own_id, 3.5, "espresso")
+    _add_record(client, headers, default_id, 42.25, "market")
+    _add_record(client, headers, shared_id, 2.75, "bus")
+    old = datetime.now(timezone.utc) - timedelta(days=900)
+    _add_record(client, headers, own_id, 1.25, "old latte", old)
+    assert client.post("/api/budgets/", json={"category_id": own_id, "amount": 100}, headers=headers).status_code == 201
+    rule = {"amount": 9, "type": "expense", "category_id": default_id, "schedule": "0 9 1 * *"}
+    assert client.post("/api/recurring/", json=rule, headers=headers).status_code == 201
+    # The old record is archived on the source, and comes back archived on the target
+    from app.utils.archive import archive_user
+    assert archive_user(shard_engines[source], user_id) == 1
+    before = sorted((r["description"], r["amount"]) for r in client.get("/api/records/", headers=headers).json())
+
+    move_user(user_id, target, drain_seconds=0, log=lambda message: None)
+
+    assert shard_for_user(user_id) == target
+    for model in (Record, RecordArchive, Category, Budget, RecurringRule):
+        assert _rows(source, model, user_id) == []
+    # Default categories stay on the source for everyone else
+    with shard_engines[source].connect() as conn:
+        assert conn.execute(select(func.count()).select_from(Category).where(Category.user_id.is_(None))).scalar() >= 2
+
+    with shard_engines[target].connect() as conn:
+        names = dict(conn.execute(select(Category.id, Category.name)).all())
+    records = _rows(target, Record, user_id)
+    assert sorted((r["description"], names[r["category_id"]]) for r in records) == [
+        ("bus", "Transport"), ("espresso", "Coffee"), ("market", "Groceries")
+    ]
+    # A matching default category on the target is reused, a missing one is copied
+    assert next(r["category_id"] for r in records if r["description"] == "bus") == target_shared_id
+    assert [(r["description"], names[r["category_id"]]) for r in _rows(target, RecordArchive, user_id)] == [("old latte", "Coffee")]
+    assert [names[r["category_id"]] for r in _rows(target, Budget, user_id)] == ["Coffee"]
+    assert [names[r["category_id"]] for r in _rows(target, RecurringRule, user_id)] == ["Groceries"]
+    assert check_rollups(user_id) == []
+
+    after = sorted((r["description"], r["amount"]) for r in client.get("/api/records/", headers=headers).json())
+    assert after == before
+
+def test_move_refuses_rows_of_another_user(client, make_user):
+    user_id, headers = make_user()
+    source = shard_for_user(user_id)
+    target = 1 - source
+    own_id = client.post("/api/categories/", json={"name": "Mine", "type": "expense"}, headers=headers).json()["id"]
+    _add_record(client, headers, own_id, 5, "fine")
+    # A record filed under another user's category (only possible through bad data)
+    with shard_engines[source].begin() as conn:
+        foreign_id = conn.execute(
+            insert(Category).values(name="Theirs", type="expense", user_id=user_id + 1000).returning(Category.id)
+        ).scalar()
+        conn.execute(insert(Record.__table__).values(
+            amount_cents=100, amount=1.0, type="expense", user_id=user_id, category_id=foreign_id, date=datetime.now(timezone.utc)
+        ))
+
+    with pytest.raises(MoveError):
+        move_user(user_id, target, drain_seconds=0, log=lambda message: None)
+
+    assert shard_for_user(user_id) == source
+    assert len(_rows(source, Record, user_id)) == 2
+    assert _rows(target, Record, user_id) == []
+    assert _rows(target, Category, user_id) == []